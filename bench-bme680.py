@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+
+###############################################################################
+# bench-bme680.py
+#
+# This file is part of the VSCP (http://www.vscp.org)
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2000-2021 Ake Hedman, Grodans Paradis AB <info@grodansparadis.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Benchmark for the measure-encode-publish cycle of mqtt-bme680.py. Uses
+# simulated sensors and an in-process MQTT broker (or a broker given with
+# --broker, for example a mosquitto on loopback) and prints the results
+# as JSON. Run it from a checkout of the source tree, the in-process
+# broker is the test broker in tests/broker.py and is not installed.
+
+import sys
+import os
+import getopt
+import json
+
+import paho.mqtt.client as mqtt
+
+from vscp_bme680.bench import benchSensors, runBenchmark, runStartup, benchEnvironment
+from tests.broker import LocalBroker
+from vscp_bme680.publisher import waitForConnection
+
+def usage():
+    print("usage: bench-bme680.py -v -n <cycles> -m <sensors> -q <qos> -b <host:port> -l <seconds> -e <encoding> -o <file> -S <runs> -h ")
+    print("---------------------------------------------")
+    print("-h/--help     - This text.")
+    print("-v/--verbose  - Print progress to screen.")
+    print("-n/--cycles   - Measurement cycles per run (default 200).")
+    print("-m/--sensors  - Number of sensors in the many sensor run (default 10).")
+    print("-q/--qos      - QoS for the published messages (default 1).")
+    print("-b/--broker   - Use this broker instead of the in-process one.")
+    print("-l/--latency  - Simulated sensor conversion time in seconds (default 0).")
+    print("-e/--encoding - Event encoding, string, float or level1 (default string).")
+    print("-o/--output   - Write the JSON result to this file.")
+    print("-S/--startup  - Also time this many one-shot runs of mqtt-bme680.py,")
+    print("                with and without the configuration cache.")
+
+# ----------------------------------------------------------------------------
+
+bVerbose = False
+cycles = 200
+nsensors = 10
+qos = 1
+broker = ""
+latency = 0.0
+encoding = "string"
+outpath = ""
+startup = 0
+
+args = sys.argv[1:]
+
+try:
+    opts, args = getopt.getopt(args,"hvn:m:q:b:l:e:o:S:",["help","verbose","cycles=","sensors=","qos=","broker=","latency=","encoding=","output=","startup="])
+except getopt.GetoptError:
+    print("unrecognized format!")
+    usage()
+    sys.exit(2)
+for opt, arg in opts:
+    if opt in ("-h", "--help"):
+        usage()
+        sys.exit()
+    elif opt in ("-v", "--verbose"):
+        bVerbose = True
+    elif opt in ("-n", "--cycles"):
+        cycles = int(arg)
+    elif opt in ("-m", "--sensors"):
+        nsensors = int(arg)
+    elif opt in ("-q", "--qos"):
+        qos = int(arg)
+    elif opt in ("-b", "--broker"):
+        broker = arg
+    elif opt in ("-l", "--latency"):
+        latency = float(arg)
+    elif opt in ("-e", "--encoding"):
+        encoding = arg
+    elif opt in ("-o", "--output"):
+        outpath = arg
+    elif opt in ("-S", "--startup"):
+        startup = int(arg)
+
+# ----------------------------------------------------------------------------
+
+local = None
+if len(broker):
+    host, sep, port = broker.partition(":")
+    port = int(port) if len(port) else 1883
+else:
+    local = LocalBroker()
+    host = local.host
+    port = local.port
+
+client = mqtt.Client()
+client.connect(host, port)
+client.loop_start()
+if not waitForConnection(client):
+    print("Unable to connect to broker", host, port)
+    sys.exit(1)
+
+result = benchEnvironment("local" if local is not None else "{}:{}".format(host, port))
+result["runs"] = []
+
+for count in (1, nsensors):
+    if bVerbose:
+        print("Running", cycles, "cycles with", count, "sensor(s)...", file=sys.stderr)
+    run = runBenchmark(client, benchSensors(count, latency, encoding), cycles, qos)
+    result["runs"].append(run)
+    if bVerbose:
+        print("  {} messages/s".format(run["msg_per_s"]), file=sys.stderr)
+
+client.disconnect()
+client.loop_stop()
+if local is not None:
+    local.close()
+
+# The script is started against its own broker that records the messages
+if startup > 0:
+    if bVerbose:
+        print("Timing", startup, "one-shot runs of mqtt-bme680.py...", file=sys.stderr)
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mqtt-bme680.py")
+    local = LocalBroker(record=True)
+    result["startup"] = runStartup(script, local, startup)
+    local.close()
+
+if len(outpath):
+    with open(outpath, "w") as f:
+        json.dump(result, f, indent=2)
+else:
+    print(json.dumps(result, indent=2))
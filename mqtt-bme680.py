@@ -28,38 +28,41 @@
 # SOFTWARE.
 
 import sys
-import configparser
 import getopt
+import time
 
-import vscp 
-import vscp_class as vc
-import vscp_type as vt
-
-import json
 import paho.mqtt.client as mqtt
 
-import math
-import time
-
-# Set to True to run with simulated data
-bDebug = False
+# Only what a one-shot run always needs is imported here. The rest is
+# imported when it is used, startup time counts when the script is run
+# from cron on a small board.
+from vscp_bme680.config import readConfig, schemaValues, cachePath, cacheKey, loadCache, saveCache
+from vscp_bme680.sensors import SENSOR_KEYS, readSensorConfigs, Sensor
+from vscp_bme680.backends import openBackend
+from vscp_bme680.publisher import Publisher, messageState, waitForConnection
+from vscp_bme680.deadband import ChangeFilter
+from vscp_bme680.events import resolveGuids
+from vscp_bme680.bundle import Bundle
 
 # Set to True to use SPI instead of I2C
 bUseSPI = False
 
-config = configparser.ConfigParser()
-
-if not bDebug :
-    import board
-    import busio
-    import adafruit_bme680
+# The configuration file is only read if there is no valid cache
+config = None
 
 def usage():
-    print("usage: mqtt-bm680.py -v -c <pat-to-config-file> -h ")
+    print("usage: mqtt-bm680.py -v -c <pat-to-config-file> -d -i <seconds> -s -n -t -r <file> -h ")
     print("---------------------------------------------")
-    print("-h/--help    - This text.")
-    print("-v/--verbose - Print output also to screen.")
-    print("-c/--config  - Path to configuration file.")
+    print("-h/--help     - This text.")
+    print("-v/--verbose  - Print output also to screen.")
+    print("-c/--config   - Path to configuration file.")
+    print("-d/--daemon   - Keep running and publish on even intervals.")
+    print("-i/--interval - Seconds between measurements in daemon mode.")
+    print("-s/--simulate - Use a simulated sensor.")
+    print("-n/--no-cache - Always read the configuration file.")
+    print("-t/--calibrate-timing - Print conversion time and noise for oversampling")
+    print("                and filter settings and quit.")
+    print("-r/--record-dump - Record raw samples to a register dump and quit.")
 
 # ----------------------------------------------------------------------------
 #                              C O N F I G U R E
@@ -77,6 +80,64 @@ temp_corr = 0.0
 # Height at installation  location
 height_at_location = 0.0
 
+# I2C address of the sensor (0x76 or 0x77)
+address = 0x77
+
+# I2C bus number (/dev/i2c-N), None for the default bus of the board
+bus = None
+
+# Sensor backend, "adafruit" for a real sensor or "simulator"
+backend = "adafruit"
+
+# Gas heater temperature (200-400 degrees Celsius) and the time it is
+# heated (milliseconds) for a gas measurement
+heater_temperature = 320
+heater_duration = 150
+
+# Measure gas every n:th measurement cycle, the cycles in between only
+# measure temperature, humidity and pressure with the heater off. 0 never
+# measures gas.
+gas_every_n_cycles = 1
+
+# Oversampling for temperature, humidity and pressure (1, 2, 4, 8 or 16)
+# and IIR filter size (0, 1, 3, 7, 15, 31, 63 or 127). More oversampling
+# gives less noise and a longer conversion, the filter smooths
+# temperature and pressure over several conversions.
+temperature_oversample = 8
+humidity_oversample = 2
+pressure_oversample = 4
+filter_size = 3
+
+# Burst acquisition in daemon mode (backend "burst" or "dump"). Each cycle
+# reads the raw data block of the sensor in one I2C transaction and
+# queues it, burst_batch samples are then compensated in one batch
+# (vectorized if NumPy is installed) and published. 0 compensates every
+# sample as it is read.
+burst_batch = 0
+
+# Register dump the "dump" backend replays (see --record-dump)
+dump_file = ""
+
+# Indoor air quality index from the gas resistance. Seconds of gas
+# measurements before the index is published (while the baseline of the
+# sensor settles) and min seconds between saves of the baseline to the
+# state_file so a restart continues from it.
+iaq_burn_in = 300.0
+iaq_save_interval = 3600.0
+
+# Simulator settings. Seed for the random generator, seconds a conversion
+# takes, noise scale and probabilities for injected I2C errors and stuck
+# values. With sim_step the simulated time starts at sim_start (Unix time,
+# 0 for now) and advances sim_step seconds each read, 0 follows the wall
+# clock.
+sim_seed = 0
+sim_latency = 0.0
+sim_noise = 1.0
+sim_i2c_error_rate = 0.0
+sim_stuck_rate = 0.0
+sim_start = 0.0
+sim_step = 0.0
+
 # GUID for sensors (Ethernet MAC used if empty)
 # Should normally have two LSB's set to zero for sensor id use
 guid=""
@@ -99,6 +160,110 @@ password="secret"
 #   %type% is replaced with event type   
 topic="vscp/{xguid}/{xclass}/{xtype}"
 
+# MQTT QoS used for published events
+qos = 0
+
+# Max number of published events that can wait for confirmation
+max_inflight = 20
+
+# Max time in seconds to wait for the events of a measurement cycle
+# to be confirmed before continuing/disconnecting
+flush_timeout = 5.0
+
+# Path to a database where events are stored when the broker can't be
+# reached. They are sent when the broker is back. Empty disables.
+outbox = ""
+
+# Max size in bytes of stored events. Oldest are removed first.
+outbox_max_size = 10000000
+
+# Max number of stored events/second to send when the broker is back
+replay_rate = 50.0
+
+# Max number of stored events to send in one measurement cycle
+replay_batch = 500
+
+# Topic for status messages with timers and counters. Empty disables.
+status_topic = ""
+
+# Seconds between status messages in daemon mode
+status_interval = 60.0
+
+# Path of a Prometheus textfile with the timers and counters (for the
+# node exporter textfile collector). Empty disables.
+metrics_file = ""
+
+# Seconds between checks if the configuration file has been modified in
+# daemon mode, it is then read again. 0 to only reload on SIGHUP.
+reload_interval = 0.0
+
+# Directory where the readings of each sensor are kept in ring files of
+# history_size readings (see vscp_bme680/history.py). Empty disables.
+history_dir = ""
+history_size = 525600
+
+# Local query service in daemon mode, "port", "host:port" or
+# "unix:/path" (see vscp_bme680/query.py). It answers from 1 minute, 15
+# minute and 1 hour rollups of the last query_span seconds. Empty
+# disables.
+query_listen = ""
+query_span = 86400.0
+
+# Topic for each sensor, the general topic is used if not set.
+# An empty topic disables publishing of the value.
+topic_temperature = None
+topic_humidity = None
+topic_pressure = None
+topic_pressure_adj = None
+topic_gas = None
+topic_altitude = None
+topic_dewpoint = None
+topic_iaq = None
+
+# Deadband for each channel. A value is only published when it has changed
+# more than this since it was last published. Absolute in the unit of the
+# channel (0.1) or percent of the last published value ("0.5%" in the
+# configuration file). None publishes every value.
+deadband_temperature = None
+deadband_humidity = None
+deadband_pressure = None
+deadband_pressure_adj = None
+deadband_gas = None
+deadband_altitude = None
+deadband_dewpoint = None
+deadband_iaq = None
+
+# Max seconds a channel with a deadband can go without being published
+# (heartbeat). 0 disables the heartbeat.
+max_silence = 900.0
+
+# Seconds of readings to aggregate into one publish in daemon mode. The
+# sensor is read every interval seconds and the statistics in
+# aggregate_stats are published once a window. 0 publishes every reading.
+aggregate_window = 0.0
+
+# Statistics to publish for a window, any of mean, min, max, stddev and
+# count (adds the number of samples to the events)
+aggregate_stats = ('mean', 'min', 'max', 'count')
+
+# Topic for bundles. If set all values of a sensor from a cycle are sent
+# as one message on this topic. {sensor} is replaced with the sensor name
+# and {xguid} with the GUID of the sensor. Empty disables.
+bundle_topic = ""
+
+# Bundle format, events (array of VSCP events) or compact (values keyed
+# by channel name)
+bundle_format = "events"
+
+# Publish on the channel topics also when bundles are sent
+channel_topics = False
+
+# File where the last published values are kept between runs so that
+# cron runs can suppress unchanged values (and count cycles for
+# gas_every_n_cycles and keep the IAQ baseline). Empty keeps them in
+# memory.
+state_file = ""
+
 # Sensor index for sensors (BME680)
 # Default is to use GUID to identify sensor
 sensorindex_temperature = 0
@@ -108,6 +273,7 @@ sensorindex_pressure_adj = 0
 sensorindex_gas = 0
 sensorindex_altitude = 0
 sensorindex_dewpoint = 0
+sensorindex_iaq = 0
 
 # Zone for module
 zone=0
@@ -115,6 +281,12 @@ zone=0
 # Subzone for module
 subzone=0
 
+# How the value is coded in the events
+#   string - CLASS2.MEASUREMENT_STR, value as a string
+#   float  - CLASS2.MEASUREMENT_FLOAT, value as an IEEE double
+#   level1 - CLASS1.MEASUREMENT, value as a normalized integer
+encoding = "string"
+
 # Last two bytes for GUID is made up of number
 # given here on the form MSB:LSB
 id_temperature = 1
@@ -124,6 +296,7 @@ id_pressure_adj = 4
 id_gas = 5
 id_altitude = 6
 id_dewpoint = 7
+id_iaq = 8
 
 note_temperature = "Temperature from BME680"
 note_humidity = "Humidity from BME680"
@@ -132,17 +305,39 @@ note_pressure_adj = "Sea level pressure from BME680"
 note_gas = "Gas concentration from BME680"
 note_altitude = "Altitude from BME680"
 note_dewpoint = "Dewpoint from BME680"
+note_iaq = "Indoor air quality from BME680"
 
 # Configuration will be read from path set here
 cfgpath=""   
 
+# Run as a long running daemon instead of a one-shot (cron) run
+bDaemon = False
+
+# Seconds between measurement cycles in daemon mode
+interval = 60.0
+
+# Use simulated sensors (overrides backend)
+bSimulate = False
+
+# Measure conversion time and noise for oversampling and filter settings
+# and quit
+bCalibrate = False
+
+# Record a register dump of DUMP_SAMPLES raw samples to this file and quit
+dumppath = ""
+DUMP_SAMPLES = 100
+
+# Keep the resolved configuration in <cfgpath>.cache and use it as long
+# as the configuration file and this script are unchanged
+bUseCache = True
+
 # ----------------------------------------------------------------------------
 
 args = sys.argv[1:]
 nargs = len(args)
 
 try:
-    opts, args = getopt.getopt(args,"hvc:",["help","verbose","config="])
+    opts, args = getopt.getopt(args,"hvc:di:sntr:",["help","verbose","config=","daemon","interval=","simulate","no-cache","calibrate-timing","record-dump="])
 except getopt.GetoptError:
     print("unrecognized format!")
     usage()
@@ -156,185 +351,74 @@ for opt, arg in opts:
         bVerbose = True
     elif opt in ("-c", "--config"):
         cfgpath = arg
+    elif opt in ("-d", "--daemon"):
+        bDaemon = True
+    elif opt in ("-i", "--interval"):
+        interval = float(arg)
+    elif opt in ("-s", "--simulate"):
+        bSimulate = True
+    elif opt in ("-n", "--no-cache"):
+        bUseCache = False
+    elif opt in ("-t", "--calibrate-timing"):
+        bCalibrate = True
+    elif opt in ("-r", "--record-dump"):
+        dumppath = arg
+
+# Defaults for settings not in the configuration file, used when the
+# configuration is reloaded
+script_defaults = schemaValues(globals())
+
+# Settings from the configuration file (or the cache) and the settings
+# of the sensors if they were cached too
+settings = {}
+sensor_configs = None
+cache_key = None
 
 if (len(cfgpath)):
 
-    init = config.read(cfgpath)
-
-    # ----------------- GENERAL -----------------
-    if 'bVerbose' in config['GENERAL']:
-        bVerbose = config.getboolean('GENERAL','bVerbose')
-        if bVerbose :
-            print('Verbose mode enabled.')
-            print('READING CONFIGURATION')
-            print('---------------------')    
-
-    # ----------------- VSCP -----------------
-    if 'guid' in config['VSCP']:        
-        guid = config['VSCP']['guid']
-        if bVerbose:
-            print("guid =", guid)
-    
-    if 'sensorindex_temperature' in config['VSCP']:        
-        sensorindex_temperature = int(config['VSCP']['sensorindex_temperature'])
-        if bVerbose:
-            print("sensorindex_temperature =", sensorindex_temperature)
-
-    if 'sensorindex_humidity' in config['VSCP']:        
-        sensorindex_humidity = int(config['VSCP']['sensorindex_humidity'])
-        if bVerbose:
-            print("sensorindex_humidity =", sensorindex_humidity)
-    
-    if 'sensorindex_pressure' in config['VSCP']:        
-        sensorindex_pressure = int(config['VSCP']['sensorindex_pressure'])
-        if bVerbose:
-            print("sensorindex_pressure =", sensorindex_pressure)
-    
-    if 'sensorindex_pressure_adj' in config['VSCP']:        
-        sensorindex_pressure_adj = int(config['VSCP']['sensorindex_pressure_adj'])
-        if bVerbose:
-            print("sensorindex_pressure_adj =", sensorindex_pressure_adj)
-    
-    if 'sensorindex_gas' in config['VSCP']:        
-        sensorindex_gas = int(config['VSCP']['sensorindex_gas'])
-        if bVerbose:
-            print("sensorindex_gas =", sensorindex_gas)
-    
-    if 'sensorindex_altitude' in config['VSCP']:        
-        sensorindex_altitude = int(config['VSCP']['sensorindex_altitude'])
-        if bVerbose:
-            print("sensorindex_altitude =", sensorindex_altitude)
-
-    if 'sensorindex_dewpoint' in config['VSCP']:        
-        sensorindex_dewpoint = int(config['VSCP']['sensorindex_dewpoint'])
-        if bVerbose:
-            print("sensorindex_dewpoint =", sensorindex_dewpoint)
-    
-    if 'zone' in config['VSCP']:        
-        zone = int(config['VSCP']['zone'])
-        if bVerbose:
-            print("zone =", zone)
-
-    if 'subzone' in config['VSCP']:        
-        subzone = int(config['VSCP']['subzone'])
-        if bVerbose:
-            print("subzone =", subzone)
-    
-    if 'id_temperature' in config['VSCP']:        
-        id_temperature = int(config['VSCP']['id_temperature'])
-        if bVerbose:
-            print("id_temperature =", id_temperature)
-    
-    if 'id_humidity' in config['VSCP']:        
-        id_humidity = int(config['VSCP']['id_humidity'])
-        if bVerbose:
-            print("id_humidity =", id_humidity)
-    
-    if 'id_pressure' in config['VSCP']:        
-        id_pressure = int(config['VSCP']['id_pressure'])
-        if bVerbose:
-            print("id_pressure =", id_pressure)
-    
-    if 'id_pressure_adj' in config['VSCP']:        
-        id_pressure_adj = int(config['VSCP']['id_pressure_adj'])
-        if bVerbose:
-            print("id_pressure_adj =", id_pressure_adj)
-    
-    if 'id_gas' in config['VSCP']:        
-        id_gas = int(config['VSCP']['id_gas'])
-        if bVerbose:
-            print("id_gas =", id_gas)
-    
-    if 'id_altitude' in config['VSCP']:        
-        id_altitude = int(config['VSCP']['id_altitude'])
-        if bVerbose:
-            print("id_altitude =", id_altitude)
-    
-    if 'id_dewpoint' in config['VSCP']:        
-        id_dewpoint = int(config['VSCP']['id_dewpoint'])
-        if bVerbose:
-            print("id_dewpoint =", id_dewpoint)
-    
-    # ----------------- MQTT -----------------
-    if 'host' in config['MQTT']:        
-        host = config['MQTT']['host']
-        if bVerbose:
-            print("host =", host)
-
-    if 'port' in config['MQTT']:        
-        port = int(config['MQTT']['port'])
-        if bVerbose:
-            print("port =", port)
-
-    if 'user' in config['MQTT']:        
-        user = config['MQTT']['user']
-        if bVerbose:
-            print("user =", user)
-    
-    if 'password' in config['MQTT']:        
-        password = config['MQTT']['password']
-        if bVerbose:
-            print("password =", "***********")
-            #print("password =", password)
-
-    if 'topic' in config['MQTT']:        
-        topic = config['MQTT']['topic']
-        if bVerbose:
-            print("topic =", password)
-    
-    if 'note_temperature' in config['MQTT']:        
-        note_temperature = config['MQTT']['note_temperature']
-        if bVerbose:
-            print("note_temperature =", note_temperature)
-    
-    if 'note_humidity' in config['MQTT']:        
-        note_humidity = config['MQTT']['note_humidity']
-        if bVerbose:
-            print("note_humidity =", note_humidity)
-    
-    if 'note_pressure' in config['MQTT']:        
-        note_pressure = config['MQTT']['note_pressure']
-        if bVerbose:
-            print("note_pressure =", note_pressure)
-    
-    if 'note_pressure_adj' in config['MQTT']:        
-        note_pressure_adj = config['MQTT']['note_pressure_adj']
-        if bVerbose:
-            print("note_pressure_adj =", note_pressure_adj)
-
-    if 'note_gas' in config['MQTT']:        
-        note_gas = config['MQTT']['note_gas']
-        if bVerbose:
-            print("note_gas =", note_gas)
-
-    if 'note_altitude' in config['MQTT']:        
-        note_altitude = config['MQTT']['note_altitude']
-        if bVerbose:
-            print("note_altitude =", note_altitude)
-    
-    if 'note_dewpoint' in config['MQTT']:        
-        note_dewpoint = config['MQTT']['note_dewpoint']
-        if bVerbose:
-            print("note_dewpoint =", note_dewpoint)
-    
-    # ----------------- BME680 -----------------
-    if 'sea_level_pressure' in config['BME680']:
-        if not bDebug :
-            sea_level_pressure = float(config['BME680']['sea_level_pressure'])       
-        if bVerbose:
-            print("sea_level_pressure =", float(config['BME680']['sea_level_pressure']))
-    
-    if 'temp_corr' in config['BME680']:
-        if not bDebug :
-            temp_corr = float(config['BME680']['temp_corr'])       
-        if bVerbose:
-            print("temp_corr =", temp_corr)
-    
-    if 'height_at_location' in config['BME680']:
-        if not bDebug :
-            height_at_location = float(config['BME680']['height_at_location'])       
-        if bVerbose:
-            print("height_at_location =", temp_corr)
+    if bUseCache :
+        try:
+            cache_key = cacheKey(cfgpath, __file__)
+        except OSError:
+            cache_key = None
+
+    cached = None
+    if cache_key is not None :
+        cached = loadCache(cachePath(cfgpath), cache_key)
+
+    if cached is not None :
+        settings, sensor_configs = cached
+        if settings.get('bVerbose', bVerbose) :
+            print("Configuration read from", cachePath(cfgpath))
+    else :
+        import configparser
+        config = configparser.ConfigParser()
+        init = config.read(cfgpath)
+        try:
+            settings = readConfig(config, bVerbose)
+        except ValueError as e:
+            print("Error in configuration:", e)
+            sys.exit(2)
+
+    globals().update(settings)
+
+# Use the general topic for sensors that have no topic of their own
+if topic_temperature is None:
+    topic_temperature = topic
+if topic_humidity is None:
+    topic_humidity = topic
+if topic_pressure is None:
+    topic_pressure = topic
+if topic_pressure_adj is None:
+    topic_pressure_adj = topic
+if topic_gas is None:
+    topic_gas = topic
+if topic_altitude is None:
+    topic_altitude = topic
+if topic_dewpoint is None:
+    topic_dewpoint = topic
+if topic_iaq is None:
+    topic_iaq = topic
 
 # -----------------------------------------------------------------------------
 
@@ -342,370 +426,402 @@ if (len(cfgpath)):
 def on_message(client, userdata, msg):
     print(msg.topic+" "+str(msg.payload))
 
+# Timers and counters, only kept if they are reported somewhere
+metrics = None
+reporter = None
+if len(status_topic) or len(metrics_file) :
+    from vscp_bme680.metrics import Metrics, MetricsReporter
+    metrics = Metrics()
+    reporter = MetricsReporter(metrics, status_topic, metrics_file)
+
+# Suppresses values that have not changed more than their deadband. The
+# sensors keep their IAQ baseline in it too.
+changes = ChangeFilter(state_file, max_silence)
+
+# Set up the sensors. Settings in [BME680.<name>] sections override the
+# general ones. The VSCP events for all channels are compiled here as
+# nothing of this changes between measurement cycles.
+if sensor_configs is None :
+    defaults = {}
+    for key, conv in SENSOR_KEYS :
+        defaults[key] = globals()[key]
+    try:
+        sensor_configs = readSensorConfigs(config, defaults)
+    except ValueError as e:
+        print("Error in configuration:", e)
+        sys.exit(2)
+    for name, cfg in sensor_configs :
+        cfg['guids'] = resolveGuids(cfg)
+    if cache_key is not None :
+        saveCache(cachePath(cfgpath), cache_key, (settings, sensor_configs))
+
+sensors = []
+for name, cfg in sensor_configs :
+    if bSimulate :
+        cfg['backend'] = "simulator"
+    sensors.append(Sensor(name, cfg, openBackend(cfg, bUseSPI), metrics, changes))
+    if bVerbose :
+        print("Sensor", name, "backend =", cfg['backend'], "bus =", cfg['bus'], "address =", hex(cfg['address']))
+
+# Theoretical and measured conversion time for the oversampling and
+# heater settings
+if bVerbose or bCalibrate :
+    from vscp_bme680.timing import sensorConversionTime
+    for sensor in sensors :
+        # The simulator takes the time a real sensor would need
+        if bCalibrate and "simulator" == sensor.cfg['backend'] :
+            sensor.backend.timing = True
+        gas = sensor.cfg['gas_every_n_cycles'] > 0
+        print("Sensor", sensor.name, "conversion time theoretical {:.1f} ms, measured {:.1f} ms".format(
+              sensorConversionTime(sensor.cfg, gas) * 1000, sensor.timeConversion(gas) * 1000),
+              "(with gas)" if gas else "(without gas)")
+
+# Sweep oversampling and filter settings, print conversion time against
+# noise and quit
+if bCalibrate :
+    from vscp_bme680.timing import calibrate, printCalibration
+    for sensor in sensors :
+        print()
+        printCalibration(sensor.name, sensor.cfg, calibrate(sensor.backend, sensor.cfg))
+    sys.exit()
+
+# Record raw samples from sensors with a burst backend and quit
+if len(dumppath) :
+    from vscp_bme680.raw import writeDump
+    for sensor in sensors :
+        if not hasattr(sensor.backend, 'acquire') :
+            print("Sensor", sensor.name, "has no raw samples, use backend = burst")
+            continue
+        path = dumppath
+        if len(sensors) > 1 :
+            path = dumppath + "." + sensor.name
+        samples = []
+        for i in range(DUMP_SAMPLES) :
+            samples.append(sensor.backend.acquire(sensor.gasCycle()))
+        writeDump(path, sensor.backend.calibration, samples)
+        print("Sensor", sensor.name, len(samples), "samples written to", path)
+    sys.exit()
+
+# Keep the readings locally
+if len(history_dir) :
+    import os
+    from vscp_bme680.history import HistoryStore
+    for sensor in sensors :
+        sensor.history = HistoryStore(os.path.join(history_dir, sensor.name), history_size)
+        if bVerbose :
+            print("Sensor", sensor.name, "history holds", len(sensor.history), "of", sensor.history.capacity, "readings")
+
 # define connect callback
+connects = 0
 def on_connect(client, userdata, flags, rc):
-    print("Connected =",str(rc))
+    global connects
+    if bVerbose :
+        print("Connected =",str(rc))
+    if 0 == rc :
+        connects += 1
+        if metrics is not None and connects > 1 :
+            metrics.inc('reconnects_total')
 
 client= mqtt.Client()
 
 # bind callback function
-client.on_message=on_connect
+client.on_connect=on_connect
 client.on_message=on_message
 
 client.username_pw_set(user, password)
 
+# Events that can't be delivered are stored here
+store = None
+if len(outbox) :
+    from vscp_bme680.outbox import Outbox, Replayer
+    store = Outbox(outbox, outbox_max_size)
+    if bVerbose :
+        print("Outbox holds", store.count, "events")
+
 if bVerbose :
     print("\n\nConnection in progress...", host)
-client.connect(host,port)    
+if bDaemon :
+    # Keep trying in the background if the broker is not reachable
+    client.connect_async(host,port)
+else :
+    try:
+        client.connect(host,port)    
+    except OSError as e:
+        if store is None :
+            raise
+        print("Unable to connect to broker, events will be stored:", e)
 
 client.loop_start()     # start loop to process received messages
-
-# Initialize VSCP event content
-def initEvent(ex,id,vscpClass,vscpType):
-    # Dumb node, priority normal
-    ex.head = vscp.VSCP_PRIORITY_NORMAL | vscp.VSCP_HEADER16_DUMB
-    g = vscp.guid()
-    if ("" != guid):
-        g.setFromString(guid)
-    else :    
-        g.setGUIDFromMAC(id)
-    ex.guid = g.guid
-    ex.vscpclass = vscpClass
-    ex.vscptype = vscpType
-    return g
-
-# -----------------------------------------------------------------------------
-
-# Create library object using our Bus I2C port
-if not bUseSPI :
-    if not bDebug :
-        i2c = busio.I2C(board.SCL, board.SDA)
-        bme680 = adafruit_bme680.Adafruit_BME680_I2C(i2c)
-
-else :     
-    # OR create library object using our Bus SPI port
-    if not bDebug :
-        spi = busio.SPI(board.SCK, board.MOSI, board.MISO)
-        bme_cs = digitalio.DigitalInOut(board.D10)
-        bme280 = adafruit_bme280.Adafruit_BME280_SPI(spi, bme_cs)
-
-# -----------------------------------------------------------------------------
-
-# change this to match the location's pressure (hPa) at sea level
-if not bDebug :
-    bme680.sea_level_pressure = sea_level_pressure
-
-if bVerbose :
-    print("-------------------------------------------------------------------------------")
-    print("Sending...")
-
-# -----------------------------------------------------------------------------
-#                           T E M P E R A T U R E
-# -----------------------------------------------------------------------------
-
-if not bDebug :
-    temperature = "{:0.1f}".format(bme680.temperature - temp_corr)
-else:     
-    temperature = "-27.8"    
-
-if bVerbose :
-    print("Temperature:", temperature, "C")
-
-ex = vscp.vscpEventEx()
-g = initEvent(ex, id_temperature, vc.VSCP_CLASS2_MEASUREMENT_STR, vt.VSCP_TYPE_MEASUREMENT_TEMPERATURE)
-
-# Size is predata + string length + terminating zero
-ex.sizedata = 4 + len(temperature) + 1
-ex.data[0] = sensorindex_temperature
-ex.data[1] = zone
-ex.data[2] = subzone
-ex.data[3] = 1  # unit is degrees Celsius
-b = temperature.encode()
-for idx in range(len(b)):
-    ex.data[idx + 4] = b[idx]
-ex.data[4 + len(temperature)] = 0  # optional terminating zero
-
-j = ex.toJSON()
-j["vscpNote"] = note_temperature
-# Add extra measurement information
-j["measurement"] = { 
-    "value" : float(temperature),
-    "unit" : 1,
-    "sensorindex" : sensorindex_temperature,
-    "zone" : zone,
-    "subzone" : subzone
-}
-
-ptopic = topic.format( xguid=g.getAsString(), xclass=ex.vscpclass, xtype=ex.vscptype)
-if ( len(ptopic) ):
-    print(ptopic)
-    client.publish(ptopic, json.dumps(j))
-
-
-# -----------------------------------------------------------------------------
-#                             H U M I D I T Y
-# -----------------------------------------------------------------------------
-
-if not bDebug :
-    humidity = "{:0.1f}".format(bme680.humidity)
-else:     
-    humidity = "{:0.1f}".format(1.23)
-
-if bVerbose :
-    print("Humidity:",humidity,"%")
-
-ex = vscp.vscpEventEx()
-initEvent(ex, id_humidity, vc.VSCP_CLASS2_MEASUREMENT_STR,vt.VSCP_TYPE_MEASUREMENT_HUMIDITY)
-
-# Size is predata + string length + terminating zero
-ex.sizedata = 4 + len(humidity) + 1
-ex.data[0] = sensorindex_humidity
-ex.data[1] = zone
-ex.data[2] = subzone
-ex.data[3] = 0  # default unit % of moisture
-b = humidity.encode()
-for idx in range(len(b)):
-    ex.data[idx + 4] = b[idx]
-ex.data[4 + len(humidity)] = 0  # optional terminating zero
-
-j = ex.toJSON()
-j["vscpNote"] = note_humidity
-# Add extra measurement information
-j["measurement"] = { 
-    "value" : float(humidity),
-    "unit" : 0,
-    "sensorindex" : sensorindex_humidity,
-    "zone" : zone,
-    "subzone" : subzone
-}
-
-ptopic = topic.format( xguid=g.getAsString(), xclass=ex.vscpclass, xtype=ex.vscptype)
-if ( len(ptopic) ):
-    client.publish(ptopic, json.dumps(j))
-
-# -----------------------------------------------------------------------------
-#                             P R E S S U R E
-# -----------------------------------------------------------------------------
-
-if not bDebug :
-    pressure = "{:0.0f}".format(bme680.pressure*100)
-else:     
-    pressure = "102300"
-
-if bVerbose :
-    print("Pressure:", pressure, "Pa")
-
-ex = vscp.vscpEventEx()
-initEvent(ex, id_pressure, vc.VSCP_CLASS2_MEASUREMENT_STR,vt.VSCP_TYPE_MEASUREMENT_PRESSURE)
-
-# Size is predata + string length + terminating zero
-ex.sizedata = 4 + len(pressure) + 1
-ex.data[0] = sensorindex_pressure
-ex.data[1] = zone
-ex.data[2] = subzone
-ex.data[3] = 0  # default unit Pascal
-b = pressure.encode()
-for idx in range(len(b)):
-    ex.data[idx + 4] = b[idx]
-ex.data[4 + len(pressure)] = 0  # optional terminating zero
-
-j = ex.toJSON()
-j["vscpNote"] = note_pressure
-# Add extra pressure information
-j["measurement"] = { 
-    "value" : float(pressure),
-    "unit" : 0,
-    "sensorindex" : sensorindex_pressure,
-    "zone" : zone,
-    "subzone" : subzone
-}
-
-ptopic = topic.format( xguid=g.getAsString(), xclass=ex.vscpclass, xtype=ex.vscptype)
-if ( len(ptopic) ):
-    client.publish(ptopic, json.dumps(j))
-
-# -----------------------------------------------------------------------------
-#                           Adjusted Pressure
-# -----------------------------------------------------------------------------
-
-if not bDebug :
-    pressure = "{:0.0f}".format((bme680.pressure + height_at_location/8.3)*100)
-else:     
-    pressure = "1000"   
-
-if bVerbose :
-    print("Relative pressure:", pressure, "Pa")
-
-ex = vscp.vscpEventEx()
-initEvent(ex, id_pressure_adj, vc.VSCP_CLASS2_MEASUREMENT_STR,vt.VSCP_TYPE_MEASUREMENT_PRESSURE)
-
-# Size is predata + string length + terminating zero
-ex.sizedata = 4 + len(pressure) + 1
-ex.data[0] = sensorindex_pressure_adj
-ex.data[1] = zone
-ex.data[2] = subzone
-ex.data[3] = 0  # default unit Pascal
-b = pressure.encode()
-for idx in range(len(b)):
-    ex.data[idx + 4] = b[idx]
-ex.data[4 + len(pressure)] = 0  # optional terminating zero
-
-j = ex.toJSON()
-j["vscpNote"] = note_pressure_adj
-# Add extra pressure information
-j["measurement"] = { 
-    "value" : float(pressure),
-    "unit" : 0,
-    "sensorindex" : sensorindex_pressure_adj,
-    "zone" : zone,
-    "subzone" : subzone
-}
-
-ptopic = topic.format( xguid=g.getAsString(), xclass=ex.vscpclass, xtype=ex.vscptype)
-if ( len(ptopic) ):
-    client.publish(ptopic, json.dumps(j))
-
-# -----------------------------------------------------------------------------
-#                                   Gas
-# -----------------------------------------------------------------------------
-
-if not bDebug :
-    gas = "{:d}".format(bme680.gas)
-else:     
-    gas = "150000"   
-
-if bVerbose :
-    print("Gas:",gas,"Ohm")
-
-ex = vscp.vscpEventEx()
-initEvent(ex, id_gas, vc.VSCP_CLASS2_MEASUREMENT_STR,vt.VSCP_TYPE_MEASUREMENT_ELECTRICAL_RESISTANCE)
-
-# Size is predata + string length + terminating zero
-ex.sizedata = 4 + len(gas) + 1
-ex.data[0] = sensorindex_gas
-ex.data[1] = zone
-ex.data[2] = subzone
-ex.data[3] = 0  # default unit Ohms
-b = gas.encode()
-for idx in range(len(b)):
-    ex.data[idx + 4] = b[idx]
-ex.data[4 + len(gas)] = 0  # optional terminating zero
-
-j = ex.toJSON()
-j["vscpNote"] = note_gas
-# Add extra pressure information
-j["measurement"] = { 
-    "value" : int(gas),
-    "unit" : 0,
-    "sensorindex" : sensorindex_gas,
-    "zone" : zone,
-    "subzone" : subzone
-}
-
-ptopic = topic.format( xguid=g.getAsString(), xclass=ex.vscpclass, xtype=ex.vscptype)
-if ( len(ptopic) ):
-    client.publish(ptopic, json.dumps(j))
-
+waitForConnection(client, flush_timeout)
+
+if bDaemon :
+    from vscp_bme680.engine import AsyncPublisher, Engine
+    publisher = AsyncPublisher(client, qos, max_inflight, outbox=store, metrics=metrics)
+else :
+    publisher = Publisher(client, qos, max_inflight, outbox=store, metrics=metrics)
+
+# Counters the publisher and outbox keep anyway are read when the
+# metrics are reported
+def publisherMetrics():
+    result = [('published_total', 'counter', publisher.sent),
+              ('confirmed_total', 'counter', publisher.confirmed),
+              ('publish_failures_total', 'counter', publisher.failed),
+              ('stored_total', 'counter', publisher.stored),
+              ('inflight', 'gauge', publisher.inflight()),
+              ('connected', 'gauge', int(client.is_connected()))]
+    result.append(('suppressed_total', 'counter', changes.suppressed))
+    if store is not None :
+        result.append(('outbox_depth', 'gauge', store.count))
+        result.append(('outbox_evicted_total', 'counter', store.evicted))
+    return result
+
+if metrics is not None :
+    metrics.addCollector(publisherMetrics)
+
+replayer = None
+if store is not None :
+    replayer = Replayer(store, publisher, replay_rate, replay_batch)
+
+# One bundle per sensor if the values of a cycle are sent as one message
+bundles = {}
+if len(bundle_topic) :
+    for sensor in sensors :
+        bundles[sensor.name] = Bundle(bundle_topic, bundle_format, sensor.name, sensor.channels)
 
 # -----------------------------------------------------------------------------
-#                                Altitude
-# -----------------------------------------------------------------------------
-
-if not bDebug :
-    altitude = "{:0.0f}".format(bme680.altitude)
-else:     
-    altitude = "420"    
-
-if bVerbose :
-    print("Altitude",altitude,"meter")
-
-ex = vscp.vscpEventEx()
-initEvent(ex, id_altitude, vc.VSCP_CLASS2_MEASUREMENT_STR,vt.VSCP_TYPE_MEASUREMENT_ALTITUDE)
-
-# Size is predata + string length + terminating zero
-ex.sizedata = 4 + len(altitude) + 1
-ex.data[0] = sensorindex_altitude
-ex.data[1] = zone
-ex.data[2] = subzone
-ex.data[3] = 0  # default unit Meters
-b = altitude.encode()
-for idx in range(len(b)):
-    ex.data[idx + 4] = b[idx]
-ex.data[4 + len(altitude)] = 0  # optional terminating zero
-
-j = ex.toJSON()
-j["vscpNote"] = note_altitude
-# Add extra pressure information
-j["measurement"] = { 
-    "value" : float(altitude),
-    "unit" : 0,
-    "sensorindex" : sensorindex_altitude,
-    "zone" : zone,
-    "subzone" : subzone
-}
-
-ptopic = topic.format( xguid=g.getAsString(), xclass=ex.vscpclass, xtype=ex.vscptype)
-if ( len(ptopic) ):
-    client.publish(ptopic, json.dumps(j))
-
 
-# -----------------------------------------------------------------------------
-#                                Dew point
-# -----------------------------------------------------------------------------
-# https://en.wikipedia.org/wiki/Dew_point#Calculating_the_dew_point
-
-b = 17.62
-c = 243.12
-if not bDebug :
-    gamma = (b * bme680.temperature /(c + bme680.temperature)) + math.log(bme680.humidity / 100.0)
-else:
-    gamma = 1
-    
-dewpoint = (c * gamma) / (b - gamma)
-
-if not bDebug :
-    dew = "{:0.1f}".format(dewpoint)
-else:     
-    dew = "12"    
+# Read the sensor and publish one event for each measurement
+def measureAndPublish():
+
+    if bVerbose :
+        print("-------------------------------------------------------------------------------")
+        print("Sending...")
+
+    start = time.perf_counter()
+
+    # Sensors on different buses are read in parallel
+    if len(sensors) > 1 :
+        import concurrent.futures
+        with concurrent.futures.ThreadPoolExecutor(len(sensors)) as executor :
+            readings = list(executor.map(lambda sensor : sensor.read(), sensors))
+    else :
+        readings = [sensors[0].read()]
+
+    # (values for the change filter, timestamp, message info) of the cycle
+    changed = []
+
+    for sensor, reading in zip(sensors, readings) :
+        if bVerbose and len(sensors) > 1 :
+            print("Sensor", sensor.name)
+        bundle = bundles.get(sensor.name)
+        bundled = []
+        if bundle is not None :
+            bundle.begin(reading.timestamp)
+        for ch in sensor.channels :
+            value = getattr(reading, ch.name)
+            # Gas (and with it the IAQ index) is not measured in every cycle
+            if value is None :
+                continue
+            if bVerbose :
+                print(ch.label, ch.format(value), ch.unitname)
+            if ( len(ch.topic) ):
+                if not changes.check(ch, ch.value(value), reading.timestamp) :
+                    if bVerbose :
+                        print("Unchanged, not published")
+                    continue
+                values = [(ch, ch.value(value))]
+                if bundle is not None :
+                    bundle.add(ch, value)
+                    if not channel_topics :
+                        bundled.extend(values)
+                        continue
+                if bVerbose :
+                    print(ch.topic)
+                if metrics is None :
+                    payload = ch.encode(value, reading.timestamp)
+                else :
+                    t = time.perf_counter()
+                    payload = ch.encode(value, reading.timestamp)
+                    metrics.observe('encode_seconds', time.perf_counter() - t)
+                info = publisher.publish(ch.topic, payload, flush_timeout, reading.timestamp)
+                changed.append((values, reading.timestamp, info))
+
+        # All values of the sensor in one message
+        if bundle is not None and len(bundle) :
+            if bVerbose :
+                print(bundle.topic)
+            info = publisher.publish(bundle.topic, bundle.payload(), flush_timeout, reading.timestamp)
+            changed.append((bundled, reading.timestamp, info))
+
+    # All events of the cycle are sent, now wait for them to be confirmed
+    sent = publisher.inflight()
+    confirmed = publisher.flush(flush_timeout)
+    if bVerbose :
+        print("Confirmed", confirmed, "of", sent, "events")
+
+    # Values count as published when they are confirmed or will be sent
+    # later from the outbox. A lost value must not hold back the next one.
+    for values, timestamp, info in changed :
+        if store is not None or messageState(info) :
+            for ch, value in values :
+                changes.published(ch, value, timestamp)
+
+    # Send stored events if the broker is back
+    if replayer is not None :
+        replayed = replayer.step(flush_timeout)
+        if bVerbose and replayed :
+            print("Replayed", replayed, "stored events,", store.count, "left")
+
+    if metrics is not None :
+        metrics.observe('cycle_seconds', time.perf_counter() - start)
+        metrics.inc('cycles_total')
+
+# Publish the status message and write the metrics file
+def reportMetrics():
+    if len(status_topic) :
+        publisher.publish(status_topic, reporter.payload(), flush_timeout, store=False)
+        publisher.flush(flush_timeout)
+    reporter.write()
+
+# Open the connection to the broker again with new settings
+def reconnect(settings):
+    global host, port, user, password
+    host = settings['host']
+    port = settings['port']
+    user = settings['user']
+    password = settings['password']
+    if bVerbose :
+        print("Connecting to", host, "port", port)
+    client.disconnect()
+    client.loop_stop()
+    client.username_pw_set(user, password)
+    client.connect_async(host, port)
+    client.loop_start()
+
+# Use a reloaded configuration (daemon mode). Sensor settings are changed
+# from the next cycle of the sensor, the sensor itself is kept. The
+# connection to the broker is only opened again if the settings for it
+# have changed.
+def applyConfig(settings, sensor_configs, changed):
+    global bVerbose
+    from vscp_bme680.reload import HARDWARE_KEYS, CONNECTION_KEYS, isLive
+    bVerbose = settings['bVerbose']
+    if bVerbose :
+        print("Configuration reloaded, changed:", ", ".join(changed))
+    engine.verbose = bVerbose
+    engine.flush_timeout = settings['flush_timeout']
+    publisher.qos = settings['qos']
+    changes.max_silence = settings['max_silence']
+
+    for key in CONNECTION_KEYS :
+        if key in changed :
+            reconnect(settings)
+            break
+
+    for name, cfg in sensor_configs :
+        sensor = None
+        for s in sensors :
+            if s.name == name :
+                sensor = s
+        if sensor is None :
+            print("Sensor", name, "is used after a restart")
+            continue
+        if bSimulate :
+            cfg['backend'] = "simulator"
+        for key in HARDWARE_KEYS :
+            if cfg[key] != sensor.cfg[key] :
+                print("Sensor", name, key, "is changed after a restart")
+            cfg[key] = sensor.cfg[key]
+        if cfg == sensor.cfg and 'bundle_topic' not in changed and 'bundle_format' not in changed :
+            continue
+        sensor.configure(cfg)
+        # The bundle is made again for the new channels, or removed if
+        # bundle_topic has been cleared
+        if len(settings['bundle_topic']) :
+            bundles[name] = Bundle(settings['bundle_topic'], settings['bundle_format'], name, sensor.channels)
+        else :
+            bundles.pop(name, None)
+        engine.findSensor(name).update(sensor.channels, bundles.get(name))
+        if bVerbose :
+            print("Sensor", name, "reconfigured")
 
-if bVerbose :
-    print("Dew point",dew,"C")
-
-ex = vscp.vscpEventEx()
-initEvent(ex, id_dewpoint, vc.VSCP_CLASS2_MEASUREMENT_STR,vt.VSCP_TYPE_MEASUREMENT_DEWPOINT)
-
-# Size is predata + string length + terminating zero
-ex.sizedata = 4 + len(dew) + 1
-ex.data[0] = sensorindex_dewpoint
-ex.data[1] = zone
-ex.data[2] = subzone
-ex.data[3] = 0  # default unit Meters
-b = dew.encode()
-for idx in range(len(b)):
-    ex.data[idx + 4] = b[idx]
-ex.data[4 + len(dew)] = 0  # optional terminating zero
-
-j = ex.toJSON()
-j["vscpNote"] = note_dewpoint
-# Add extra pressure information
-j["measurement"] = { 
-    "value" : float(dewpoint),
-    "unit" : 1,  # unit is degrees Celsius
-    "sensorindex" : sensorindex_dewpoint,
-    "zone" : zone,
-    "subzone" : subzone
-}
-
-ptopic = topic.format( xguid=g.getAsString(), xclass=ex.vscpclass, xtype=ex.vscptype)
-if ( len(ptopic) ):
-    client.publish(ptopic, json.dumps(j))
+    restart = [key for key in changed if not isLive(key)]
+    if len(restart) :
+        print("Restart to use new", ", ".join(restart))
 
 # -----------------------------------------------------------------------------
 
+if not bDaemon :
+    # Count the cycles over runs so gas_every_n_cycles works from cron
+    # (needs a state_file)
+    for sensor in sensors :
+        sensor.cycles = changes.counter(sensor.name)
+    measureAndPublish()
+    for sensor in sensors :
+        changes.setCounter(sensor.name, sensor.cycles)
+    if reporter is not None :
+        reportMetrics()
+else :
+    if bVerbose :
+        print("Daemon mode, interval =", interval, "seconds")
+    # The configuration is read again on SIGHUP (and when the file is
+    # modified if reload_interval is set)
+    reloader = None
+    if len(cfgpath) :
+        from vscp_bme680.reload import ConfigReloader
+        reloader = ConfigReloader(cfgpath, script_defaults, schemaValues(globals()),
+                                  applyConfig, reload_interval)
+    engine = Engine(publisher, interval, flush_timeout, replayer, verbose=bVerbose,
+                    metrics=metrics, reporter=reporter, status_interval=status_interval,
+                    changes=changes, reloader=reloader, query_listen=query_listen)
+    if aggregate_window > 0 :
+        from vscp_bme680.aggregate import Aggregator
+    if len(query_listen) :
+        from vscp_bme680.events import CHANNEL_NAMES
+        from vscp_bme680.rollup import Rollups
+    for sensor in sensors :
+        aggregator = None
+        if aggregate_window > 0 :
+            aggregator = Aggregator(sensor.channels, aggregate_window, interval, aggregate_stats)
+        rollups = None
+        if len(query_listen) :
+            rollups = Rollups(CHANNEL_NAMES, query_span)
+        if sensor.burst :
+            engine.addSensor(sensor.name, sensor.readBurst, sensor.channels, aggregator,
+                             bundles.get(sensor.name), channel_topics, batch=True,
+                             rollups=rollups)
+        else :
+            engine.addSensor(sensor.name, sensor.read, sensor.channels, aggregator,
+                             bundles.get(sensor.name), channel_topics, rollups=rollups)
+    import asyncio
+    import signal
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    # Stop cleanly on SIGTERM and ctrl+c
+    loop.add_signal_handler(signal.SIGTERM, engine.stop)
+    loop.add_signal_handler(signal.SIGINT, engine.stop)
+    if reloader is not None :
+        loop.add_signal_handler(signal.SIGHUP, reloader.reload)
+    loop.run_until_complete(engine.run())
+    loop.close()
+    if reporter is not None :
+        reporter.write()
+
+for sensor in sensors :
+    sensor.saveState()
+    if sensor.history is not None :
+        sensor.history.close()
+changes.save()
+
+# Don't lose events that are still not confirmed
+if store is not None :
+    publisher.abandon()
+    store.close()
 
 client.disconnect() 
 client.loop_stop() 
 
 if bVerbose :
+    print("Published", publisher.sent, "events,", publisher.confirmed, "confirmed,", publisher.failed, "failed,", publisher.stored, "stored")
     print("-------------------------------------------------------------------------------")
     print("Closed")
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+
+###############################################################################
+# replay-bme680.py
+#
+# This file is part of the VSCP (http://www.vscp.org)
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2000-2021 Ake Hedman, Grodans Paradis AB <info@grodansparadis.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+
+# Replay a recording of BME680 readings (CSV or NDJSON, see
+# vscp_bme680/replay.py) through the same event encoding as
+# mqtt-bme680.py, at the recorded rate, a multiple of it or as fast as
+# possible, as one or many nodes. Prints the throughput and the publish
+# confirmation latency as JSON.
+
+import sys
+import getopt
+import json
+
+import paho.mqtt.client as mqtt
+
+from vscp_bme680.config import readConfig, parseQos
+from vscp_bme680.events import CHANNEL_NAMES, compileChannels, resolveGuids
+from vscp_bme680.bundle import Bundle
+from vscp_bme680.publisher import waitForConnection
+from vscp_bme680.replay import Playback, parseSpeed, readRecording, remapGuids
+
+def usage():
+    print("usage: replay-bme680.py -v -c <config> -s <speed> -m <nodes> -g <guid> -q <qos> -b <host:port> -t -o <file> -h <recording>")
+    print("---------------------------------------------")
+    print("-h/--help     - This text.")
+    print("-v/--verbose  - Print progress to screen.")
+    print("-c/--config   - mqtt-bme680.py configuration to take the events,")
+    print("                topics and broker from.")
+    print("-s/--speed    - 1 (default) for the recorded rate, 10 or 10x for ten")
+    print("                times faster or max for as fast as possible.")
+    print("-m/--nodes    - Publish every reading as this many nodes (default 1).")
+    print("-g/--guid     - GUID of the first node (default the configured).")
+    print("-q/--qos      - QoS for the published messages (default from config).")
+    print("-b/--broker   - Publish to this broker instead of the configured.")
+    print("-t/--now      - Timestamp the events with the time they are sent.")
+    print("-o/--output   - Write the JSON result to this file.")
+
+# ----------------------------------------------------------------------------
+#                              C O N F I G U R E
+# ----------------------------------------------------------------------------
+
+# Defaults are the same as for mqtt-bme680.py, a configuration file for
+# it can be used as is
+
+bVerbose = False
+guid = ""
+host = "127.0.0.1"
+port = 1883
+user = "vscp"
+password = "secret"
+topic = "vscp/{xguid}/{xclass}/{xtype}"
+qos = 0
+max_inflight = 20
+flush_timeout = 5.0
+zone = 0
+subzone = 0
+encoding = "string"
+bundle_topic = ""
+bundle_format = "events"
+channel_topics = False
+
+topic_temperature = None
+topic_humidity = None
+topic_pressure = None
+topic_pressure_adj = None
+topic_gas = None
+topic_altitude = None
+topic_dewpoint = None
+topic_iaq = None
+
+sensorindex_temperature = 0
+sensorindex_humidity = 0
+sensorindex_pressure = 0
+sensorindex_pressure_adj = 0
+sensorindex_gas = 0
+sensorindex_altitude = 0
+sensorindex_dewpoint = 0
+sensorindex_iaq = 0
+
+id_temperature = 1
+id_humidity = 2
+id_pressure = 3
+id_pressure_adj = 4
+id_gas = 5
+id_altitude = 6
+id_dewpoint = 7
+id_iaq = 8
+
+note_temperature = "Temperature from BME680"
+note_humidity = "Humidity from BME680"
+note_pressure = "Pressure from BME680"
+note_pressure_adj = "Sea level pressure from BME680"
+note_gas = "Gas concentration from BME680"
+note_altitude = "Altitude from BME680"
+note_dewpoint = "Dewpoint from BME680"
+note_iaq = "Indoor air quality from BME680"
+
+cfgpath = ""
+speed = 1.0
+nodes = 1
+remap = ""
+broker = ""
+bNow = False
+outpath = ""
+
+# ----------------------------------------------------------------------------
+
+args = sys.argv[1:]
+
+try:
+    opts, args = getopt.getopt(args,"hvc:s:m:g:q:b:to:",["help","verbose","config=","speed=","nodes=","guid=","qos=","broker=","now","output="])
+except getopt.GetoptError:
+    print("unrecognized format!")
+    usage()
+    sys.exit(2)
+
+options = {}
+for opt, arg in opts:
+    try:
+        if opt in ("-h", "--help"):
+            usage()
+            sys.exit()
+        elif opt in ("-v", "--verbose"):
+            options['bVerbose'] = True
+        elif opt in ("-c", "--config"):
+            cfgpath = arg
+        elif opt in ("-s", "--speed"):
+            speed = parseSpeed(arg)
+        elif opt in ("-m", "--nodes"):
+            nodes = int(arg)
+        elif opt in ("-g", "--guid"):
+            remap = arg
+        elif opt in ("-q", "--qos"):
+            options['qos'] = parseQos(arg)
+        elif opt in ("-b", "--broker"):
+            broker = arg
+        elif opt in ("-t", "--now"):
+            bNow = True
+        elif opt in ("-o", "--output"):
+            outpath = arg
+    except ValueError as e:
+        print("Bad value for {}: {}".format(opt, e))
+        usage()
+        sys.exit(2)
+
+if 1 != len(args):
+    usage()
+    sys.exit(2)
+
+if len(cfgpath):
+    import configparser
+    config = configparser.ConfigParser()
+    config.read(cfgpath)
+    try:
+        globals().update(readConfig(config))
+    except ValueError as e:
+        print("Error in configuration:", e)
+        sys.exit(2)
+
+# Command line options win over the configuration
+globals().update(options)
+if len(broker):
+    host, sep, p = broker.partition(":")
+    port = int(p) if len(p) else 1883
+
+# The channels as mqtt-bme680.py compiles them, no deadbands as every
+# recorded value is published
+cfg = {'guid': remap if len(remap) else guid,
+       'zone': zone,
+       'subzone': subzone,
+       'encoding': encoding}
+for name in CHANNEL_NAMES:
+    cfg['id_' + name] = globals()['id_' + name]
+    cfg['sensorindex_' + name] = globals()['sensorindex_' + name]
+    cfg['note_' + name] = globals()['note_' + name]
+    cfg['topic_' + name] = globals()['topic_' + name]
+    if cfg['topic_' + name] is None:
+        cfg['topic_' + name] = topic
+    cfg['deadband_' + name] = None
+guids = resolveGuids(cfg)
+
+# One set of channels (and bundle) per node, node 0 keeps the GUID
+nodelist = []
+for node in range(nodes):
+    cfg['guids'] = remapGuids(guids, node)
+    channels = compileChannels(cfg)
+    bundle = None
+    if len(bundle_topic):
+        bundle = Bundle(bundle_topic, bundle_format, "bme680", channels)
+    nodelist.append((channels, bundle))
+
+client = mqtt.Client()
+client.username_pw_set(user, password)
+client.connect(host, port)
+client.loop_start()
+if not waitForConnection(client, flush_timeout):
+    print("Unable to connect to broker", host, port)
+    sys.exit(1)
+
+if bVerbose:
+    print("Replaying", args[0], "as", nodes, "node(s) to", host, port, file=sys.stderr)
+
+playback = Playback(client, nodelist, speed, qos, max_inflight, channel_topics,
+                    bNow, flush_timeout, bVerbose)
+result = playback.run(readRecording(args[0]))
+result["recording"] = args[0]
+result["broker"] = "{}:{}".format(host, port)
+
+client.disconnect()
+client.loop_stop()
+
+if len(outpath):
+    with open(outpath, "w") as f:
+        json.dump(result, f, indent=2)
+else:
+    print(json.dumps(result, indent=2))
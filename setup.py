@@ -71,6 +71,7 @@ setup(
     # You can just specify the packages manually here if your project is
     # simple. Or you can use find_packages().
     #packages=find_packages(exclude=['contrib', 'docs', 'tests']),
+    packages=['vscp_bme680'],
     py_modules=["mqtt-bme680"],
 
     python_requires='>=3.0',
@@ -87,7 +88,6 @@ setup(
         'pyvscp',
         'pyvscpclasses',
         'pyvscptypes',
-        'pyvscphelper',
         'configparser',
         'adafruit-circuitpython-bme680',
         'paho-mqtt'
@@ -100,6 +100,7 @@ setup(
     extras_require={
         'dev': ['check-manifest'],
         'test': ['coverage'],
+        'numpy': ['numpy'],
     },
 
     # If there are data files included in your packages that need to be
@@ -115,8 +116,9 @@ setup(
     # In this case, 'data_file' will be installed into '<sys.prefix>/my_data'
     data_files=[('pyvscp-sensors-bme680-sample-config', ['config.ini'])],
 
-    # Scripts that will be made available
-    scripts=['mqtt-bme680.py'],
+    # Scripts that will be made available. bench-bme680.py is run from a
+    # checkout, it uses the test broker in tests/ which is not installed.
+    scripts=['mqtt-bme680.py', 'replay-bme680.py'],
 
     # To provide executable scripts, use entry points in preference to the
     # "scripts" keyword. Entry points provide cross-platform support and allow
@@ -0,0 +1,161 @@
+###############################################################################
+# tests/broker.py
+#
+# This file is part of the VSCP (http://www.vscp.org)
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2000-2021 Ake Hedman, Grodans Paradis AB <info@grodansparadis.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Minimal MQTT 3.1.1 broker for local benchmarks and tests. It accepts connections,
+# acknowledges CONNECT, PUBLISH (QoS 1 and 2), SUBSCRIBE and PINGREQ and
+# counts the messages it gets. Nothing is forwarded to subscribers. It
+# stands in for a real broker on loopback so the publish path can be
+# measured without a network in between.
+
+import socket
+import struct
+import threading
+import time
+
+# MQTT control packet types
+CONNECT = 1
+PUBLISH = 3
+PUBREL = 6
+SUBSCRIBE = 8
+PINGREQ = 12
+DISCONNECT = 14
+
+class LocalBroker:
+
+    # host      - Interface to listen on
+    # port      - Port to listen on, 0 picks a free port
+    # ack_delay - Seconds to wait before acknowledging a PUBLISH
+    # record    - Keep (time, topic, payload) for every message in messages
+    def __init__(self, host="127.0.0.1", port=0, ack_delay=0.0, record=False):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.listen(16)
+        self.host, self.port = self.sock.getsockname()
+        self.ack_delay = ack_delay
+        self.record = record
+        self.messages = []
+        self.count = 0
+        self.lock = threading.Lock()
+        self.running = True
+        self.conns = []
+        self.thread = threading.Thread(target=self._accept, daemon=True)
+        self.thread.start()
+
+    def _accept(self):
+        while self.running:
+            try:
+                conn, addr = self.sock.accept()
+            except OSError:
+                return
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.conns.append(conn)
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    # Read exactly n bytes
+    def _recv(self, conn, n):
+        buf = b""
+        while len(buf) < n:
+            data = conn.recv(n - len(buf))
+            if not data:
+                raise EOFError
+            buf += data
+        return buf
+
+    # Read one control packet, returns (header byte, body)
+    def _packet(self, conn):
+        header = self._recv(conn, 1)[0]
+        mult = 1
+        length = 0
+        while True:
+            digit = self._recv(conn, 1)[0]
+            length += (digit & 127) * mult
+            mult *= 128
+            if not digit & 128:
+                break
+        body = self._recv(conn, length) if length else b""
+        return header, body
+
+    def _publish(self, conn, header, body):
+        qos = (header >> 1) & 3
+        tlen = struct.unpack(">H", body[:2])[0]
+        pos = 2 + tlen
+        mid = None
+        if qos:
+            mid = body[pos:pos + 2]
+            pos += 2
+        with self.lock:
+            self.count += 1
+            if self.record:
+                self.messages.append((time.monotonic(),
+                                      body[2:2 + tlen].decode(),
+                                      body[pos:]))
+        if self.ack_delay:
+            time.sleep(self.ack_delay)
+        if qos == 1:
+            conn.sendall(b"\x40\x02" + mid)     # PUBACK
+        elif qos == 2:
+            conn.sendall(b"\x50\x02" + mid)     # PUBREC
+
+    def _serve(self, conn):
+        try:
+            while True:
+                header, body = self._packet(conn)
+                ptype = header >> 4
+                if ptype == CONNECT:
+                    conn.sendall(b"\x20\x02\x00\x00")   # CONNACK accepted
+                elif ptype == PUBLISH:
+                    self._publish(conn, header, body)
+                elif ptype == PUBREL:
+                    conn.sendall(b"\x70\x02" + body[:2])    # PUBCOMP
+                elif ptype == SUBSCRIBE:
+                    conn.sendall(b"\x90\x03" + body[:2] + b"\x00")  # SUBACK
+                elif ptype == PINGREQ:
+                    conn.sendall(b"\xd0\x00")   # PINGRESP
+                elif ptype == DISCONNECT:
+                    break
+        except (EOFError, OSError):
+            pass
+        finally:
+            conn.close()
+
+    # Stop listening and drop all connections
+    def close(self):
+        self.running = False
+        # Wakes up the accept() that is waiting
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        for conn in self.conns:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+                conn.close()
+            except OSError:
+                pass
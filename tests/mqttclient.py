@@ -0,0 +1,84 @@
+###############################################################################
+# tests/mqttclient.py
+#
+# This file is part of the VSCP (http://www.vscp.org)
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2000-2021 Ake Hedman, Grodans Paradis AB <info@grodansparadis.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Stand-in for the paho MQTT client in tests of the publish path, no
+# network and no broker needed.
+
+from vscp_bme680.publisher import MQTT_ERR_NO_CONN, MQTT_ERR_SUCCESS
+
+# As paho.mqtt.client.MQTTMessageInfo
+class MessageInfo:
+
+    def __init__(self, mid, rc):
+        self.mid = mid
+        self.rc = rc
+        self.published = False
+
+    def is_published(self):
+        if self.rc:
+            raise RuntimeError("Message publish failed")
+        return self.published
+
+# Stands in for a paho client with the loop started. A QoS 0 message
+# published while not connected is dropped, a QoS 1/2 message is queued
+# and sent when connected again, as paho does. The broker only confirms
+# messages when confirm() is called.
+class Client:
+
+    def __init__(self):
+        self.connected = True
+        self.on_publish = None
+        self.mid = 0
+        # mid -> (topic, payload, info) not confirmed yet
+        self.queue = {}
+        # (topic, payload) the broker got
+        self.received = []
+
+    def max_inflight_messages_set(self, n):
+        pass
+
+    def is_connected(self):
+        return self.connected
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        self.mid += 1
+        info = MessageInfo(self.mid, MQTT_ERR_SUCCESS)
+        if not self.connected:
+            info.rc = MQTT_ERR_NO_CONN
+            if not qos:
+                return info
+        self.queue[self.mid] = (topic, payload, info)
+        return info
+
+    # The broker receives and confirms the queued messages
+    def confirm(self):
+        for mid, (topic, payload, info) in sorted(self.queue.items()):
+            self.received.append((topic, payload))
+            info.published = True
+            if self.on_publish is not None:
+                self.on_publish(self, None, mid)
+        self.queue = {}
@@ -0,0 +1,116 @@
+###############################################################################
+# tests/test_config.py
+#
+# This file is part of the VSCP (http://www.vscp.org)
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2000-2021 Ake Hedman, Grodans Paradis AB <info@grodansparadis.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Reading the configuration file (vscp_bme680/config.py and the sensor
+# sections in vscp_bme680/sensors.py).
+
+import configparser
+import os
+import shutil
+
+import pytest
+
+from vscp_bme680.config import (CACHE_MODULES, PACKAGE_DIR, cacheKey, cachePath, loadCache,
+                                readConfig, saveCache)
+from vscp_bme680.sensors import SENSOR_KEYS, readSensorConfigs
+
+CONFIG = """
+[BME680]
+backend = simulator
+address = 0x77
+
+[BME680.left]
+backend = Simulator
+address = 0x76
+deadband_humidity = 2%
+
+[BME680.right]
+bus = 2
+"""
+
+def parse(text):
+    config = configparser.ConfigParser()
+    config.read_string(text)
+    return config
+
+# The sensor settings for a configuration, defaults from the general
+# sections
+def sensorConfigs(text):
+    config = parse(text)
+    settings = readConfig(config)
+    defaults = dict((key, settings.get(key)) for key, conv in SENSOR_KEYS)
+    return dict(readSensorConfigs(config, defaults))
+
+def test_sensor_sections():
+    sensors = sensorConfigs(CONFIG)
+    assert ['left', 'right'] == sorted(sensors)
+    assert "simulator" == sensors['left']['backend']
+    assert 0x76 == sensors['left']['address']
+    assert (2.0, True) == sensors['left']['deadband_humidity']
+    # From [BME680]
+    assert "simulator" == sensors['right']['backend']
+    assert 0x77 == sensors['right']['address']
+    assert 2 == sensors['right']['bus']
+
+def test_no_sensor_sections():
+    assert ['bme680'] == list(sensorConfigs("[BME680]\nbus = 3\n"))
+
+@pytest.mark.parametrize("setting, message", [
+    ("backend = simualtor", "[BME680.right] backend: Unknown backend"),
+    ("address = 0x7g", "[BME680.right] address:"),
+    ("deadband_gas = lots", "[BME680.right] deadband_gas:"),
+])
+def test_bad_sensor_setting(setting, message):
+    with pytest.raises(ValueError) as e:
+        sensorConfigs(CONFIG + setting + "\n")
+    assert str(e.value).startswith(message)
+
+def test_bad_setting():
+    with pytest.raises(ValueError) as e:
+        readConfig(parse("[MQTT]\nqos = 3\n"))
+    assert str(e.value).startswith("[MQTT] qos:")
+
+def test_cache(tmp_path):
+    cfgpath = tmp_path / "config.ini"
+    cfgpath.write_text("[MQTT]\nqos = 1\n")
+    key = cacheKey(str(cfgpath), __file__)
+    saveCache(cachePath(str(cfgpath)), key, ({'qos': 1}, []))
+    assert ({'qos': 1}, []) == loadCache(cachePath(str(cfgpath)), cacheKey(str(cfgpath), __file__))
+    cfgpath.write_text("[MQTT]\nqos = 2\n")
+    assert loadCache(cachePath(str(cfgpath)), cacheKey(str(cfgpath), __file__)) is None
+
+def test_cache_key_package(tmp_path, monkeypatch):
+    # A copy of the package modules stands in for an installed package
+    for name in CACHE_MODULES:
+        shutil.copy2(os.path.join(PACKAGE_DIR, name + ".py"), str(tmp_path / (name + ".py")))
+    monkeypatch.setattr("vscp_bme680.config.PACKAGE_DIR", str(tmp_path))
+    key = cacheKey(__file__, __file__)
+    assert key == cacheKey(__file__, __file__)
+    # An upgrade with a changed parser
+    sensors = tmp_path / "sensors.py"
+    sensors.write_text(sensors.read_text() + "\n")
+    assert key != cacheKey(__file__, __file__)
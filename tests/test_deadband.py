@@ -0,0 +1,161 @@
+###############################################################################
+# tests/test_deadband.py
+#
+# This file is part of the VSCP (http://www.vscp.org)
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2000-2021 Ake Hedman, Grodans Paradis AB <info@grodansparadis.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Change based publishing, the deadband filter (vscp_bme680/deadband.py)
+# and how the engine records what it has published.
+
+import asyncio
+
+import pytest
+
+from vscp_bme680.deadband import ChangeFilter, formatDeadband, parseDeadband
+from vscp_bme680.engine import AsyncPublisher, Engine
+from vscp_bme680.events import CHANNELS, ChannelTemplate
+from vscp_bme680.outbox import Outbox
+from vscp_bme680.reading import makeReading
+
+from mqttclient import Client
+
+def channel(name, deadband):
+    chdef = CHANNELS[[c.name for c in CHANNELS].index(name)]
+    return ChannelTemplate(chdef, "FF:FF:FF:FF:FF:FF:FF:FE:00:11:22:33:44:55:00:01",
+                           0, 0, 0, "", "test/" + name, parseDeadband(deadband))
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    loop.close()
+    asyncio.set_event_loop(None)
+
+def test_parse_deadband():
+    assert parseDeadband("") is None
+    assert parseDeadband(" 0.1 ") == (0.1, False)
+    assert parseDeadband("-20") == (20.0, False)
+    assert parseDeadband("0.5%") == (0.5, True)
+    assert formatDeadband(parseDeadband("0.5%")) == "0.5%"
+    assert formatDeadband(None) == ""
+    with pytest.raises(ValueError):
+        parseDeadband("a lot")
+
+def test_absolute():
+    changes = ChangeFilter(max_silence=0)
+    ch = channel('temperature', "0.5")
+    assert changes.check(ch, 20.0, 0)
+    changes.published(ch, 20.0, 0)
+    assert not changes.check(ch, 20.4, 10)
+    assert not changes.check(ch, 19.6, 20)
+    # A change of exactly the deadband is published
+    assert changes.check(ch, 20.5, 30)
+    assert changes.check(ch, 19.5, 40)
+    assert 2 == changes.suppressed
+
+def test_percent():
+    changes = ChangeFilter(max_silence=0)
+    ch = channel('gas', "1%")
+    changes.published(ch, 50000, 0)
+    assert not changes.check(ch, 50499, 10)
+    assert changes.check(ch, 49500, 10)
+
+def test_heartbeat():
+    changes = ChangeFilter(max_silence=900)
+    ch = channel('temperature', "0.5")
+    changes.published(ch, 20.0, 0)
+    assert not changes.check(ch, 20.0, 899)
+    assert changes.check(ch, 20.0, 900)
+
+def test_no_deadband():
+    changes = ChangeFilter()
+    ch = channel('temperature', "")
+    changes.published(ch, 20.0, 0)
+    assert changes.check(ch, 20.0, 1)
+    assert not changes.dirty
+
+def test_state_file(tmp_path):
+    path = str(tmp_path / "state.json")
+    changes = ChangeFilter(path)
+    ch = channel('humidity', "2")
+    changes.published(ch, 45.0, 100)
+    changes.setCounter("bme680", 7)
+    changes.maybeSave(100)
+    # The next one-shot run
+    changes = ChangeFilter(path)
+    assert not changes.check(ch, 46.0, 160)
+    assert 7 == changes.counter("bme680")
+
+def test_state_file_damaged(tmp_path):
+    path = tmp_path / "state.json"
+    path.write_text("{")
+    changes = ChangeFilter(str(path))
+    assert changes.check(channel('humidity', "2"), 45.0, 0)
+
+# Publish the temperature of a reading through the engine
+def publishTemperature(client, changes, value, timestamp, outbox=None):
+    publisher = AsyncPublisher(client, outbox=outbox)
+    engine = Engine(publisher, flush_timeout=0.05, changes=changes)
+    ch = channel('temperature', "0.5")
+    reading = makeReading(value, 45.0, 1000.0, None, timestamp=timestamp)
+
+    async def publish():
+        future = await engine.channelStage(ch, reading)
+        if future is not None:
+            client.confirm()
+            await publisher.confirm([future], 0.05)
+        return future
+
+    return ch, asyncio.get_event_loop().run_until_complete(publish())
+
+def test_recorded_when_confirmed(loop):
+    changes = ChangeFilter(max_silence=0)
+    client = Client()
+    ch, future = publishTemperature(client, changes, 20.0, 0)
+    assert future.result()
+    assert not changes.check(ch, 20.0, 10)
+
+def test_not_recorded_when_lost(loop):
+    changes = ChangeFilter(max_silence=0)
+    client = Client()
+    publishTemperature(client, changes, 20.0, 0)
+    # No broker and no outbox, the value is lost
+    client.connected = False
+    ch, future = publishTemperature(client, changes, 21.0, 10)
+    assert future is None
+    assert 1 == len(client.received)
+    # So the next value close to it is still published
+    assert changes.check(ch, 20.8, 20)
+
+def test_recorded_when_stored(loop, tmp_path):
+    changes = ChangeFilter(max_silence=0)
+    client = Client()
+    client.connected = False
+    outbox = Outbox(str(tmp_path / "outbox.db"))
+    ch, future = publishTemperature(client, changes, 20.0, 0, outbox)
+    assert future is None
+    assert 1 == outbox.count
+    # Sent later from the outbox
+    assert not changes.check(ch, 20.0, 10)
@@ -0,0 +1,146 @@
+###############################################################################
+# tests/test_outbox.py
+#
+# This file is part of the VSCP (http://www.vscp.org)
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2000-2021 Ake Hedman, Grodans Paradis AB <info@grodansparadis.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# The outbox (vscp_bme680/outbox.py) and the replay of stored events by
+# the engine (vscp_bme680/engine.py) when the broker goes away, with a
+# stand-in for the paho client.
+
+import asyncio
+
+import pytest
+
+from vscp_bme680.engine import AsyncPublisher, Engine
+from vscp_bme680.outbox import Outbox, Replayer
+
+from mqttclient import Client
+
+@pytest.fixture(autouse=True)
+def loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    loop.close()
+    asyncio.set_event_loop(None)
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+def publishCycle(publisher, qos, count=5):
+    async def cycle():
+        futures = [await publisher.publish("test/{}".format(n), "{}".format(n), 1000.0 + n, qos=qos)
+                   for n in range(count)]
+        return futures
+    return run(cycle())
+
+def test_qos1_timeout_not_stored(tmp_path):
+    client = Client()
+    outbox = Outbox(str(tmp_path / "outbox.db"))
+    publisher = AsyncPublisher(client, qos=1, outbox=outbox)
+    futures = publishCycle(publisher, 1)
+    # The connection is lost before the broker confirms
+    client.connected = False
+    assert 0 == run(publisher.confirm(futures, 0.05))
+    assert all(f.done() and f.result() is False for f in futures)
+    assert 0 == outbox.count
+    # paho sends them again after the reconnect, once
+    client.connected = True
+    client.confirm()
+    run(asyncio.sleep(0))
+    assert 5 == len(client.received)
+    assert 5 == publisher.confirmed
+    assert not publisher.queued
+
+def test_qos0_timeout_stored_and_replayed(tmp_path):
+    client = Client()
+    outbox = Outbox(str(tmp_path / "outbox.db"))
+    publisher = AsyncPublisher(client, qos=0, outbox=outbox)
+    futures = publishCycle(publisher, 0)
+    # Lost with the connection
+    client.connected = False
+    client.queue = {}
+    assert 0 == run(publisher.confirm(futures, 0.05))
+    assert 5 == outbox.count
+    # Published while not connected, straight to the outbox
+    publishCycle(publisher, 0, 2)
+    assert 7 == outbox.count
+
+    client.connected = True
+    replayer = Replayer(outbox, publisher, rate=1000.0, batch=100)
+    engine = Engine(publisher, interval=60.0, replayer=replayer, flush_timeout=0.5)
+
+    async def replay():
+        engine.stop_event = asyncio.Event()
+        task = asyncio.ensure_future(engine.replayLoop())
+        while outbox.count:
+            await asyncio.sleep(0.01)
+            client.confirm()
+        engine.stop()
+        await task
+
+    run(replay())
+    assert 0 == outbox.count
+    assert 7 == replayer.replayed
+    assert sorted(client.received) == sorted(
+        [("test/{}".format(n), "{}".format(n)) for n in range(5)] +
+        [("test/{}".format(n), "{}".format(n)) for n in range(2)])
+
+def test_abandon_stores_queued(tmp_path):
+    client = Client()
+    outbox = Outbox(str(tmp_path / "outbox.db"))
+    publisher = AsyncPublisher(client, qos=1, outbox=outbox)
+    futures = publishCycle(publisher, 1, 3)
+    run(publisher.confirm(futures, 0.05))
+    assert 0 == outbox.count
+    publishCycle(publisher, 1, 2)
+
+    async def others():
+        # Taken out of the outbox, and a status message that is never stored
+        return [await publisher.publish("replayed", "0", 900.0, store=False, replayed=True),
+                await publisher.publish("status", "{}", store=False)]
+    futures = run(others())
+    run(publisher.confirm(futures, 0.05))
+    # paho drops its queue when the process ends
+    publisher.abandon()
+    assert 6 == outbox.count
+    rows = outbox.peek(6)
+    assert "replayed" == rows[0][2]
+    assert all(1 == row[4] for row in rows)
+
+def test_replay_rate(tmp_path):
+    client = Client()
+    outbox = Outbox(str(tmp_path / "outbox.db"))
+    for n in range(1000):
+        outbox.put("test/{}".format(n), "{}".format(n), 1000.0 + n)
+    publisher = AsyncPublisher(client, outbox=outbox)
+    replayer = Replayer(outbox, publisher, rate=100.0, batch=50)
+    taken = replayer.take()
+    assert 50 == len(taken)
+    replayer.done(len(taken), [row[0] for row in taken])
+    # Half a second until the next batch of 50, not a measurement interval
+    assert 0.45 < replayer.delay() <= 0.5
+    outbox.remove([row[0] for row in outbox.peek(1000)])
+    assert replayer.delay() is None
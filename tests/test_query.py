@@ -0,0 +1,130 @@
+###############################################################################
+# tests/test_query.py
+#
+# This file is part of the VSCP (http://www.vscp.org)
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2000-2021 Ake Hedman, Grodans Paradis AB <info@grodansparadis.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Rollups (vscp_bme680/rollup.py) and the answers of the local query
+# service (vscp_bme680/query.py), without a network connection.
+
+import math
+import statistics
+
+import pytest
+
+from vscp_bme680.engine import Engine
+from vscp_bme680.events import CHANNELS, CHANNEL_NAMES, ChannelTemplate
+from vscp_bme680.query import QueryServer
+from vscp_bme680.reading import makeReading
+from vscp_bme680.rollup import BucketRing, Rollups, combine, EMPTY
+
+# At a whole hour
+NOW = 1610002800.0
+
+# Readings every 10 seconds for the last 30 minutes, the temperature goes
+# up 0.01 degrees each time
+def readings():
+    return [makeReading(20.0 + n * 0.01, 45.0, 1000.0, 50000 if n % 2 else None,
+                        timestamp=NOW - 1800 + n * 10)
+            for n in range(180)]
+
+@pytest.fixture
+def rollups():
+    rollups = Rollups(CHANNEL_NAMES, 3600)
+    for reading in readings():
+        rollups.add(reading)
+    return rollups
+
+@pytest.fixture
+def server(rollups):
+    engine = Engine(None)
+    channels = [ChannelTemplate(chdef, "FF:FF:FF:FF:FF:FF:FF:FE:00:11:22:33:44:55:00:{:02X}".format(id),
+                                0, 0, 0, "", "")
+                for id, chdef in enumerate(CHANNELS, 1)]
+    engine.addSensor("bme680", None, channels, rollups=rollups)
+    return QueryServer(engine, "0")
+
+def get(server, path):
+    return server.request("GET {} HTTP/1.0\r\n\r\n".format(path))
+
+def test_summary(rollups):
+    temperatures = [r.temperature for r in readings()]
+    stats = rollups.summary('temperature', NOW - 1800, NOW)
+    assert stats[0] == len(temperatures)
+    assert stats[1] == pytest.approx(statistics.mean(temperatures))
+    assert math.sqrt(stats[2] / stats[0]) == pytest.approx(statistics.pstdev(temperatures))
+    assert (stats[3], stats[4]) == (min(temperatures), max(temperatures))
+    # Gas is only in every second reading
+    assert 90 == rollups.summary('gas', NOW - 1800, NOW)[0]
+
+def test_buckets(rollups):
+    buckets = rollups.buckets('temperature', '1m', NOW - 600, NOW)
+    assert [t for t, stats in buckets] == [NOW - 600 + n * 60 for n in range(10)]
+    assert all(6 == stats[0] for t, stats in buckets)
+    stats = EMPTY
+    for t, bucket in buckets:
+        stats = combine(stats, bucket)
+    assert 60 == stats[0]
+
+def test_ring_wraps():
+    ring = BucketRing(60, 10)
+    for n in range(30):
+        ring.add(n * 60.0, float(n))
+    # The ring reaches back ten buckets from the one end is in
+    assert [t for t, stats in ring.buckets(0, 1800)] == [n * 60.0 for n in range(21, 30)]
+    assert [t for t, stats in ring.buckets(0, 1790)] == [n * 60.0 for n in range(20, 30)]
+
+@pytest.mark.parametrize("start, end", [
+    (0, math.inf), (-math.inf, NOW), (0, 1e300), (1e300, 1e300 + 1e290), (math.nan, NOW)])
+def test_buckets_any_range(rollups, start, end):
+    # However long the range, at most one round of the ring is walked
+    assert len(rollups.buckets('temperature', '1m', start, end)) <= 61
+    rollups.summary('temperature', start, end)
+
+def test_query_series(server):
+    status, body = get(server, "/sensors/bme680/temperature?resolution=15m&start={}&end={}".format(
+        NOW - 1800, NOW))
+    assert 200 == status
+    assert [b["measurement"]["samples"] for b in body["buckets"]] == [90, 90]
+    assert "mean" == body["buckets"][0]["measurement"]["stat"]
+
+def test_query_summary(server):
+    status, body = get(server, "/sensors/bme680?since=600&end={}".format(NOW))
+    assert 200 == status
+    assert 60 == body["channels"]["temperature"]["max"]["measurement"]["samples"]
+
+@pytest.mark.parametrize("query", [
+    "end=inf", "end=1e400", "start=-inf", "start=nan", "since=inf",
+    "start=200&end=100", "since=-10", "end=now"])
+def test_query_bad_range(server, query):
+    for path in ("/sensors/bme680", "/sensors/bme680/temperature"):
+        status, body = get(server, path + "?" + query)
+        assert 400 == status
+        assert "error" in body
+
+def test_query_unknown(server):
+    assert 404 == get(server, "/sensors/bme688")[0]
+    assert 404 == get(server, "/sensors/bme680/co2")[0]
+    assert 400 == get(server, "/sensors/bme680/gas?resolution=5m")[0]
+    assert 405 == server.request("POST /sensors HTTP/1.0\r\n\r\n")[0]
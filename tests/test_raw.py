@@ -0,0 +1,203 @@
+###############################################################################
+# tests/test_raw.py
+#
+# This file is part of the VSCP (http://www.vscp.org)
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2000-2021 Ake Hedman, Grodans Paradis AB <info@grodansparadis.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Compensation of raw register data (vscp_bme680/raw.py) checked against
+# the floating point compensation of the Bosch BME68x Sensor API
+# (bme68x.c with BME68X_USE_FPU) for a register dump, no hardware needed.
+
+import struct
+
+import pytest
+
+from vscp_bme680 import raw
+from vscp_bme680.backends import DumpBackend
+
+# Register dump of a BME680, the calibration registers (0x89-0xA1 and
+# 0xE1-0xF0, then 0x00-0x04) and data blocks from 0x1D at about 16, 22,
+# 26 and 32 degrees Celsius. The last sample is taken without gas.
+DUMP = """# BME680 register dump
+calibration 0 0080660300b58e67d758007a1c87ff2e1e00008cf8fcf41e003fc334002d14789cef65e6d1e2120000 2b001600f0
+1610000000.000000 1 800057e400771aa05dc000000064350000
+1610000003.000000 1 80005cc60072bf007530000000af370000
+1610000006.000000 1 80005302007ef4004e2000000032330000
+1610000009.000000 1 80005af2007a12006978000000e1390000
+1610000012.000000 0 80005af2007a12006978000000e1390000
+"""
+
+# Bosch lookup tables for the BME680 gas range (percent)
+K1_RANGE = (0.0, 0.0, 0.0, 0.0, 0.0, -1.0, 0.0, -0.8, 0.0, 0.0, -0.2, -0.5, 0.0, -1.0, 0.0, 0.0)
+K2_RANGE = (0.0, 0.0, 0.0, 0.0, 0.1, 0.7, 0.0, -0.8, -0.1, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0)
+
+# Calibration coefficients as the Bosch API reads them from the registers
+def boschCalibration(coeff, heat):
+    def reg(r):
+        return r - 0x89 if r <= 0xA1 else raw.COEFF1_LENGTH + r - 0xE1
+
+    def value(fmt, r):
+        return struct.unpack_from(fmt, coeff, reg(r))[0]
+
+    return {
+        't1': value('<H', 0xE9), 't2': value('<h', 0x8A), 't3': value('<b', 0x8C),
+        'p1': value('<H', 0x8E), 'p2': value('<h', 0x90), 'p3': value('<b', 0x92),
+        'p4': value('<h', 0x94), 'p5': value('<h', 0x96), 'p6': value('<b', 0x99),
+        'p7': value('<b', 0x98), 'p8': value('<h', 0x9C), 'p9': value('<h', 0x9E),
+        'p10': value('<B', 0xA0),
+        'h1': (value('<B', 0xE3) << 4) | (value('<B', 0xE2) & 0x0F),
+        'h2': (value('<B', 0xE1) << 4) | (value('<B', 0xE2) >> 4),
+        'h3': value('<b', 0xE4), 'h4': value('<b', 0xE5), 'h5': value('<b', 0xE6),
+        'h6': value('<B', 0xE7), 'h7': value('<b', 0xE8),
+        'sw_err': struct.unpack('b', bytes([heat[4] & 0xF0]))[0] // 16,
+    }
+
+# ADC values of a data block as the Bosch API reads them
+def boschAdc(block, variant=0):
+    adc_pres = (block[2] << 12) | (block[3] << 4) | (block[4] >> 4)
+    adc_temp = (block[5] << 12) | (block[6] << 4) | (block[7] >> 4)
+    adc_hum = (block[8] << 8) | block[9]
+    g = 15 if variant else 13
+    adc_gas = (block[g] << 2) | (block[g + 1] >> 6)
+    return adc_temp, adc_pres, adc_hum, adc_gas, block[g + 1] & 0x0F
+
+# Bosch floating point compensation. Returns (temperature, humidity,
+# pressure, gas) in the units of raw.compensate(), pressure in hPa.
+def boschCompensate(cal, block, variant=0):
+    adc_temp, adc_pres, adc_hum, adc_gas, gas_range = boschAdc(block, variant)
+
+    var1 = ((adc_temp / 16384.0) - (cal['t1'] / 1024.0)) * cal['t2']
+    var2 = (((adc_temp / 131072.0) - (cal['t1'] / 8192.0)) ** 2) * (cal['t3'] * 16.0)
+    t_fine = var1 + var2
+    temperature = t_fine / 5120.0
+
+    var1 = (t_fine / 2.0) - 64000.0
+    var2 = var1 * var1 * (cal['p6'] / 131072.0)
+    var2 = var2 + (var1 * cal['p5'] * 2.0)
+    var2 = (var2 / 4.0) + (cal['p4'] * 65536.0)
+    var1 = (((cal['p3'] * var1 * var1) / 16384.0) + (cal['p2'] * var1)) / 524288.0
+    var1 = (1.0 + (var1 / 32768.0)) * cal['p1']
+    pressure = 1048576.0 - adc_pres
+    pressure = ((pressure - (var2 / 4096.0)) * 6250.0) / var1
+    var1 = (cal['p9'] * pressure * pressure) / 2147483648.0
+    var2 = pressure * (cal['p8'] / 32768.0)
+    var3 = ((pressure / 256.0) ** 3) * (cal['p10'] / 131072.0)
+    pressure = pressure + (var1 + var2 + var3 + (cal['p7'] * 128.0)) / 16.0
+
+    var1 = adc_hum - ((cal['h1'] * 16.0) + ((cal['h3'] / 2.0) * temperature))
+    var2 = var1 * ((cal['h2'] / 262144.0) *
+                   (1.0 + ((cal['h4'] / 16384.0) * temperature) +
+                    ((cal['h5'] / 1048576.0) * temperature * temperature)))
+    var3 = cal['h6'] / 16384.0
+    var4 = cal['h7'] / 2097152.0
+    humidity = var2 + ((var3 + (var4 * temperature)) * var2 * var2)
+    humidity = max(0.0, min(humidity, 100.0))
+
+    if variant:
+        gas = 1000000.0 * (262144 >> gas_range) / (4096 + (adc_gas - 512) * 3)
+    else:
+        var1 = 1340.0 + (5.0 * cal['sw_err'])
+        var2 = var1 * (1.0 + K1_RANGE[gas_range] / 100.0)
+        var3 = 1.0 + (K2_RANGE[gas_range] / 100.0)
+        gas = 1.0 / (var3 * 0.000000125 * (1 << gas_range) *
+                     (((adc_gas - 512.0) / var2) + 1.0))
+    return temperature, humidity, pressure / 100.0, gas
+
+@pytest.fixture
+def dumpPath(tmp_path):
+    path = tmp_path / "bme680.dump"
+    path.write_text(DUMP)
+    return str(path)
+
+# Compensated values must match the Bosch reference to the resolution of
+# the sensor data
+def checkReference(values, expected, gas):
+    temperature, humidity, pressure, resistance = values
+    assert temperature == pytest.approx(expected[0], abs=0.01)
+    assert humidity == pytest.approx(expected[1], abs=0.01)
+    assert pressure == pytest.approx(expected[2], abs=0.01)
+    if gas:
+        assert abs(resistance - expected[3]) <= 1
+    else:
+        assert resistance is None
+
+def test_read_dump(dumpPath):
+    cal, samples = raw.readDump(dumpPath)
+    assert 5 == len(samples)
+    assert [gas for timestamp, gas, block in samples] == [True, True, True, True, False]
+    assert all(raw.newData(block) for timestamp, gas, block in samples)
+    assert cal.t == (26095.0, 26240.0, 3.0)
+    assert cal.h[:2] == (835.0, 1020.0)
+    assert cal.sw_err == -1
+    assert cal.heat_range == 1
+
+def test_write_dump(dumpPath, tmp_path):
+    cal, samples = raw.readDump(dumpPath)
+    path = str(tmp_path / "copy.dump")
+    raw.writeDump(path, cal, samples)
+    assert raw.readDump(path) == (cal, samples)
+
+def test_compensate_matches_bosch(dumpPath):
+    backend = DumpBackend(dumpPath)
+    cal = backend.calibration
+    reference = boschCalibration(*cal.raw)
+    for timestamp, gas, block in backend.samples:
+        checkReference(raw.compensate(cal, block, gas),
+                       boschCompensate(reference, block), gas)
+
+def test_batch_matches_scalar(dumpPath):
+    pytest.importorskip("numpy")
+    backend = DumpBackend(dumpPath)
+    cal = backend.calibration
+    blocks = []
+    gas = []
+    for n in range(len(backend.samples)):
+        timestamp, g, block = backend.acquire()
+        blocks.append(block)
+        gas.append(g)
+    batch = raw.compensateBatch(cal, blocks, gas)
+    reference = boschCalibration(*cal.raw)
+    for values, block, g in zip(batch, blocks, gas):
+        scalar = raw.compensate(cal, block, g)
+        assert values[:3] == pytest.approx(scalar[:3], rel=1e-12)
+        assert values[3] == scalar[3]
+        checkReference(values, boschCompensate(reference, block), g)
+
+def test_compensate_bme688_gas(dumpPath):
+    pytest.importorskip("numpy")
+    cal, samples = raw.readDump(dumpPath)
+    cal = cal._replace(variant=1)
+    reference = boschCalibration(*cal.raw)
+    blocks = []
+    for timestamp, gas, block in samples[:4]:
+        # The BME688 has the gas ADC value two registers later
+        block = bytearray(block)
+        block[15:17] = block[13:15]
+        blocks.append(bytes(block))
+    batch = raw.compensateBatch(cal, blocks, [True] * len(blocks))
+    for values, block in zip(batch, blocks):
+        expected = boschCompensate(reference, block, variant=1)
+        checkReference(raw.compensate(cal, block), expected, True)
+        checkReference(values, expected, True)
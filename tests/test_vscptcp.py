@@ -0,0 +1,151 @@
+###############################################################################
+# tests/test_vscptcp.py
+#
+# This file is part of the VSCP (http://www.vscp.org)
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2000-2021 Ake Hedman, Grodans Paradis AB <info@grodansparadis.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+
+# The persistent, batched VSCP tcp/ip link (vscp_bme680/vscptcp.py)
+# against the stand-in daemon (tests/vscpd.py).
+
+import time
+
+import pytest
+
+from vscp_bme680.events import CHANNELS, ChannelTemplate
+from vscp_bme680.vscptcp import VscpError, VscpLink, formatEvent, parseHost
+
+from vscpd import LocalVscpd
+
+VALUES = (21.3, 45.1, 96604.0, 101568.0, 5014, 401.0, -1.9)
+
+# The events of one measurement cycle
+def cycleEvents():
+    timestamp = time.time()
+    return [ChannelTemplate(chdef, "FF:FF:FF:FF:FF:FF:FF:FE:00:11:22:33:44:55:00:{:02X}".format(id),
+                            0, 0, 0, "", "").fill(value, timestamp)
+            for id, (chdef, value) in enumerate(zip(CHANNELS, VALUES), 1)]
+
+@pytest.fixture
+def vscpd():
+    daemon = LocalVscpd(record=True)
+    yield daemon
+    daemon.close()
+
+def connect(daemon, **kwargs):
+    return VscpLink("127.0.0.1:{}".format(daemon.port), "admin", "secret", **kwargs)
+
+def test_parse_host():
+    assert parseHost("192.168.1.7:9598") == ("192.168.1.7", 9598)
+    assert parseHost("tcp://localhost:1234") == ("localhost", 1234)
+    assert parseHost("localhost") == ("localhost", 9598)
+
+def test_format_event():
+    event = cycleEvents()[0]
+    fields = formatEvent(event).rstrip().split(',')
+    assert fields[0] == "send {}".format(event["vscpHead"])
+    assert fields[1:3] == ["1040", "6"]
+    assert fields[6] == event["vscpGuid"]
+    assert [int(b) for b in fields[7:]] == event["vscpData"]
+
+def test_send_batch(vscpd):
+    link = connect(vscpd)
+    events = cycleEvents()
+    link.send(events)
+    link.close()
+    assert vscpd.count == len(events)
+    assert [e[5] for e in vscpd.events] == [e["vscpData"] for e in events]
+    assert 1 == vscpd.logins
+
+def test_one_round_trip_per_batch():
+    daemon = LocalVscpd(latency=0.05)
+    try:
+        link = connect(daemon)
+        link.open()
+        # Login, user and pass
+        assert 2 == daemon.round_trips
+        link.send(cycleEvents())
+        round_trips = daemon.round_trips - 2
+        link.close()
+    finally:
+        daemon.close()
+    assert 7 == daemon.count
+    # One round trip for all seven events, not one for each
+    assert 1 == round_trips
+
+def test_keepalive(vscpd):
+    link = connect(vscpd, keepalive=0.1)
+    link.send(cycleEvents())
+    link.wait(0.35)
+    assert link.noops >= 2
+    assert vscpd.noops == link.noops
+    # A dropped connection is opened again by the keepalive
+    vscpd.drop()
+    link.wait(0.25)
+    assert link.isOpen()
+    assert 2 == link.opens
+    link.close()
+
+def test_resend_unconfirmed(vscpd):
+    vscpd.drop_every = 10
+    link = connect(vscpd)
+    for n in range(3):
+        link.send(cycleEvents())
+    link.close()
+    # The 10th and the 20th event the daemon got dropped the connection.
+    # They and the rest of their batches (5 events of the second and 3
+    # of the third) were sent again on a new connection.
+    assert 2 == vscpd.drops
+    assert 3 == link.opens
+    assert 5 + 3 == link.resent
+    assert 21 == vscpd.count
+    assert 21 == link.events
+
+def test_gives_up_after_retries(vscpd):
+    vscpd.drop_every = 1
+    link = connect(vscpd, retries=2)
+    with pytest.raises(OSError):
+        link.send(cycleEvents())
+    assert 3 == vscpd.drops
+    assert not link.isOpen()
+
+def test_rejected_events(vscpd):
+    link = connect(vscpd)
+    events = cycleEvents()
+    events[1]["vscpData"] = [256]
+    with pytest.raises(VscpError):
+        link.send(events)
+    # The other events were delivered and the link can still be used
+    assert 6 == vscpd.count
+    link.send(cycleEvents())
+    assert 13 == vscpd.count
+    assert 1 == link.opens
+    link.close()
+
+def test_login_failure(vscpd):
+    link = VscpLink("127.0.0.1:{}".format(vscpd.port), "admin", "wrong")
+    with pytest.raises(VscpError):
+        link.open()
+    assert not link.isOpen()
@@ -0,0 +1,231 @@
+###############################################################################
+# tests/vscpd.py
+#
+# This file is part of the VSCP (http://www.vscp.org)
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2000-2021 Ake Hedman, Grodans Paradis AB <info@grodansparadis.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+
+# Stand-in for the tcp/ip interface of the VSCP daemon, for testing
+# vscp-bme680.py and vscptcp.VscpLink without a real daemon. It knows
+# the commands user, pass, noop, send and quit, checks the events it gets
+# and counts them. Nothing is forwarded. Replies can be delayed like on a
+# slow network and connections can be dropped to test reconnects.
+
+import queue
+import socket
+import threading
+import time
+
+class LocalVscpd:
+
+    # host         - Interface to listen on
+    # port         - Port to listen on, 0 picks a free port
+    # user         - Username clients must login with
+    # password     - Password clients must login with
+    # latency      - Seconds every reply is delayed, as by a network round
+    #                trip. Commands are still read while replies wait.
+    # record       - Keep (time, head, class, type, GUID, data) for every
+    #                event in events
+    # drop_every   - Close the connection without a reply on every n:th
+    #                event, 0 never does
+    def __init__(self, host="127.0.0.1", port=0, user="admin", password="secret",
+                 latency=0.0, record=False, drop_every=0):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.listen(16)
+        self.host, self.port = self.sock.getsockname()
+        self.user = user
+        self.password = password
+        self.latency = latency
+        self.record = record
+        self.drop_every = drop_every
+        self.events = []
+        self.count = 0
+        self.noops = 0
+        self.logins = 0
+        self.drops = 0
+        self.received = 0
+        # Commands read while no reply was waiting to be sent, that is the
+        # times the client waited for the daemon (with latency set)
+        self.round_trips = 0
+        self.lock = threading.Lock()
+        self.running = True
+        self.conns = []
+        self.thread = threading.Thread(target=self._accept, daemon=True)
+        self.thread.start()
+
+    def _accept(self):
+        while self.running:
+            try:
+                conn, addr = self.sock.accept()
+            except OSError:
+                return
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.conns.append(conn)
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    # Check a send command, returns (head, class, type, GUID, data) or
+    # None if the event is not valid
+    def _event(self, args):
+        fields = args.split(',')
+        if len(fields) < 7:
+            return None
+        try:
+            head, vscpclass, vscptype = (int(f, 0) for f in fields[:3])
+            data = [int(f, 0) for f in fields[7:] if f.strip()]
+        except ValueError:
+            return None
+        guid = fields[6].strip()
+        if '-' != guid and 16 != len(guid.split(':')):
+            return None
+        if any(b < 0 or b > 255 for b in data):
+            return None
+        return head, vscpclass, vscptype, guid, data
+
+    # Reply with the configured latency. Replies are sent by a thread of
+    # their own so the next command is read while one waits.
+    def _replier(self, conn, replies):
+        try:
+            while True:
+                item = replies.get()
+                if item is None:
+                    return
+                due, text = item
+                delay = due - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                # Done before the client can have the reply and answer it
+                replies.task_done()
+                conn.sendall(text.encode())
+        except OSError:
+            pass
+
+    def _serve(self, conn):
+        replies = queue.Queue()
+        replier = None
+        if self.latency:
+            replier = threading.Thread(target=self._replier, args=(conn, replies), daemon=True)
+            replier.start()
+
+        def reply(text):
+            if replier is None:
+                conn.sendall(text.encode())
+            else:
+                replies.put((time.monotonic() + self.latency, text))
+
+        buf = b""
+        user = None
+        authorized = False
+        try:
+            reply("Welcome to the VSCP daemon stand-in\r\n+OK - Success.\r\n")
+            while True:
+                pos = buf.find(b"\n")
+                if pos < 0:
+                    data = conn.recv(65536)
+                    if not data:
+                        break
+                    buf += data
+                    continue
+                line = buf[:pos].decode(errors="replace").strip()
+                buf = buf[pos + 1:]
+                if not replies.unfinished_tasks:
+                    with self.lock:
+                        self.round_trips += 1
+                command, sep, args = line.partition(' ')
+                command = command.lower()
+                if "user" == command:
+                    user = args.strip()
+                    reply("+OK - User name accepted, password please\r\n")
+                elif "pass" == command:
+                    if user == self.user and args.strip() == self.password:
+                        authorized = True
+                        with self.lock:
+                            self.logins += 1
+                        reply("+OK - Ready to work.\r\n")
+                    else:
+                        reply("-OK - Invalid username or password.\r\n")
+                elif "noop" == command:
+                    with self.lock:
+                        self.noops += 1
+                    reply("+OK - Success.\r\n")
+                elif "quit" == command:
+                    reply("+OK - Connection closed by peer.\r\n")
+                    break
+                elif "send" == command:
+                    if not authorized:
+                        reply("-OK - Not authorized.\r\n")
+                        continue
+                    event = self._event(args)
+                    if event is None:
+                        reply("-OK - Invalid event.\r\n")
+                        continue
+                    with self.lock:
+                        self.received += 1
+                        drop = self.drop_every and 0 == self.received % self.drop_every
+                        if drop:
+                            self.drops += 1
+                        else:
+                            self.count += 1
+                            if self.record:
+                                self.events.append((time.monotonic(),) + event)
+                    if drop:
+                        conn.shutdown(socket.SHUT_RDWR)
+                        break
+                    reply("+OK - Success.\r\n")
+                else:
+                    reply("-OK - Unknown command.\r\n")
+        except OSError:
+            pass
+        finally:
+            if replier is not None:
+                replies.put(None)
+                replier.join()
+            conn.close()
+
+    # Drop all connections, clients have to connect again
+    def drop(self):
+        for conn in self.conns:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self.conns = []
+
+    # Stop listening and drop all connections
+    def close(self):
+        self.running = False
+        # Wakes up the accept() that is waiting
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        for conn in self.conns:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+                conn.close()
+            except OSError:
+                pass
@@ -32,35 +32,29 @@
 import sys
 import configparser
 import getopt
-from sys import float_repr_style
-
-import vscp
-import vscp_class as vc
-import vscp_type as vt
-import vscphelper
 
 import time
-import math
 
-# Set to True to run with simulated data
-bDebug = True
+from vscp_bme680.backends import AdafruitBackend, SimulatedBackend
+from vscp_bme680.config import parseBackend
+from vscp_bme680.reading import makeReading
+from vscp_bme680.events import compileChannel
+from vscp_bme680.vscptcp import VscpLink, VscpError
 
 # Set to True to use SPI instead of I2C
 bUseSPI = False
 
 config = configparser.ConfigParser()
 
-if not bDebug :
-    import board
-    import busio
-    import adafruit_bme680
-
 def usage():
-    print("usage: vscp-bm680.py -v -c <pat-to-config-file> -h ")
+    print("usage: vscp-bm680.py -v -c <pat-to-config-file> -s -d -i <seconds> -h ")
     print("---------------------------------------------")
     print("-h/--help    - This text.")
     print("-v/--verbose - Print output also to screen.")
     print("-c/--config  - Path to configuration file.")
+    print("-s/--simulate - Use a simulated sensor.")
+    print("-d/--daemon   - Keep running and send on even intervals.")
+    print("-i/--interval - Seconds between measurements in daemon mode.")
 
 
 # ----------------------------------------------------------------------------
@@ -69,8 +63,23 @@ def usage():
 
 
 # change this to match the location's pressure (hPa) at sea level
-if not bDebug :
-    bme680.sea_level_pressure = 1013.25
+sea_level_pressure = 1013.25
+
+# Sensor backend, "adafruit" for a real sensor or "simulator"
+backend = "adafruit"
+
+# Simulator settings. Seed for the random generator, seconds a conversion
+# takes, noise scale and probabilities for injected I2C errors and stuck
+# values. With sim_step the simulated time starts at sim_start (Unix time,
+# 0 for now) and advances sim_step seconds each read, 0 follows the wall
+# clock.
+sim_seed = 0
+sim_latency = 0.0
+sim_noise = 1.0
+sim_i2c_error_rate = 0.0
+sim_stuck_rate = 0.0
+sim_start = 0.0
+sim_step = 0.0
 
 # Print some info along the way
 bVerbose = False
@@ -94,6 +103,13 @@ user="admin"
 # Password to login at server
 password="secret"
 
+# Seconds to wait for the server to answer
+response_timeout = 5.0
+
+# Send a NOOP to the server when the connection has been idle this many
+# seconds in daemon mode, 0 never sends one
+keepalive = 30.0
+
 # Sensor index for sensors (BME680)
 # Default is to use GUID to identify sensor
 sensorindex_temperature = 0
@@ -123,13 +139,22 @@ id_dewpoint = 7
 # Configuration will be read from path set here
 cfgpath=""  
 
+# Use a simulated sensor (overrides backend)
+bSimulate = False
+
+# Run as a long running daemon instead of a one-shot (cron) run
+bDaemon = False
+
+# Seconds between measurement cycles in daemon mode
+interval = 60.0
+
 # ----------------------------------------------------------------------------
 
 args = sys.argv[1:]
 nargs = len(args)
 
 try:
-    opts, args = getopt.getopt(args,"hvc:",["help","verbose","config="])
+    opts, args = getopt.getopt(args,"hvc:sdi:",["help","verbose","config=","simulate","daemon","interval="])
 except getopt.GetoptError:
     print("unrecognized format!")
     usage()
@@ -143,6 +168,12 @@ for opt, arg in opts:
         bVerbose = True
     elif opt in ("-c", "--config"):
         cfgpath = arg
+    elif opt in ("-s", "--simulate"):
+        bSimulate = True
+    elif opt in ("-d", "--daemon"):
+        bDaemon = True
+    elif opt in ("-i", "--interval"):
+        interval = float(arg)
 
 # read config file if one is specified
 
@@ -169,6 +200,16 @@ if (len(cfgpath)):
             print("password =", "***********")
             print("password =", password)
 
+    if 'response_timeout' in config['VSCP']:
+        response_timeout = float(config['VSCP']['response_timeout'])
+        if bVerbose:
+            print("response_timeout =", response_timeout)
+
+    if 'keepalive' in config['VSCP']:
+        keepalive = float(config['VSCP']['keepalive'])
+        if bVerbose:
+            print("keepalive =", keepalive)
+
     if 'guid' in config['VSCP']:        
         guid = config['VSCP']['guid']
         if bVerbose:
@@ -255,311 +296,165 @@ if (len(cfgpath)):
             print("id_dewpoint =", id_altitude)
 
     if 'sea_level_pressure' in config['BME680']:
-        if not bDebug :
-            bme680.sea_level_pressure = float(config['BME680']['sea_level_pressure'])       
+        sea_level_pressure = float(config['BME680']['sea_level_pressure'])       
         if bVerbose:
-            print("bme6880.sea_level_pressure =", float(config['BME680']['sea_level_pressure']))
+            print("sea_level_pressure =", sea_level_pressure)
     
     if 'temp_corr' in config['BME680']:
-        if not bDebug :
-            temp_corr = float(config['BME680']['temp_corr'])       
+        temp_corr = float(config['BME680']['temp_corr'])       
         if bVerbose:
             print("temp_corr =", temp_corr)
     
     if 'height_at_location' in config['BME680']:
-        if not bDebug :
-            height_at_location = float(config['BME680']['height_at_location'])       
+        height_at_location = float(config['BME680']['height_at_location'])       
         if bVerbose:
-            print("height_at_location =", temp_corr)
-
-# -----------------------------------------------------------------------------
-
-# Initialize VSCP event content
-def initEvent(ex,id,vscpClass,vscpType):
-    # Dumb node, priority normal
-    ex.head = vscp.VSCP_PRIORITY_NORMAL | vscp.VSCP_HEADER16_DUMB
-    g = vscp.guid()
-    if (len(guid)):
-        g.setFromString(guid)
-    else :    
-        g.setGUIDFromMAC(id)
-    ex.guid = g.guid
-    ex.vscpclass = vscpClass
-    ex.vscptype = vscpType
-    return g           
-
-# -----------------------------------------------------------------------------
-
-# Create library object using our Bus I2C port
-if not bUseSPI :
-    if not bDebug :
-        i2c = busio.I2C(board.SCL, board.SDA)
-        bme680 = adafruit_bme680.Adafruit_BME680_I2C(i2c)
-
-else :     
-    # OR create library object using our Bus SPI port
-    if not bDebug :
-        spi = busio.SPI(board.SCK, board.MOSI, board.MISO)
-        bme_cs = digitalio.DigitalInOut(board.D10)
-        bme280 = adafruit_bme280.Adafruit_BME280_SPI(spi, bme_cs)
-
-# -----------------------------------------------------------------------------
-    
-h1 = vscphelper.newSession()
-if (0 == h1 ):
-    vscphelper.closeSession(h1)
-    raise ValueError('Unable to open vscphelp library session')
-
-if bVerbose :
-    print("\n\nConnection in progress...")
+            print("height_at_location =", height_at_location)
 
-rv = vscphelper.open(h1,host,user,password)
-if vscp.VSCP_ERROR_SUCCESS == rv :
-    if bVerbose :
-        print("Connected")
-else:
-    vscphelper.closeSession(h1)
-    raise ValueError('Command error: open on channel 1  Error code=%d' % rv )
-
-if bVerbose :
-    print("-------------------------------------------------------------------------------")
-    print("Sending...")
-
-# -----------------------------------------------------------------------------
-#                           T E M P E R A T U R E
-# -----------------------------------------------------------------------------
-
-if not bDebug :
-    temperature = "{:0.1f}".format(bme680.temperature - temp_corr)
-else:     
-    temperature = "-27.8"    
-
-if bVerbose :
-    print("Temperature:", temperature, "C")
-
-ex = vscp.vscpEventEx()
-initEvent(ex,id_temperature, vc.VSCP_CLASS2_MEASUREMENT_STR,vt.VSCP_TYPE_MEASUREMENT_TEMPERATURE)
-
-# Size is predata + string length + terminating zero
-ex.sizedata = 4 + len(temperature) + 1
-ex.data[0] = sensorindex_temperature
-ex.data[1] = zone
-ex.data[2] = subzone
-ex.data[3] = 1  # unit is degrees Celsius
-b = temperature.encode()
-for idx in range(len(b)):
-    ex.data[idx + 4] = b[idx]
-ex.data[4 + len(temperature)] = 0  # optional terminating zero
-
-rv = vscphelper.sendEventEx(h1,ex)
-if vscp.VSCP_ERROR_SUCCESS != rv :
-    vscphelper.closeSession(h1)
-    raise ValueError('Command error: sendEventEx  Error code=%d' % rv )
-
-# -----------------------------------------------------------------------------
-#                             H U M I D I T Y
-# -----------------------------------------------------------------------------
-
-if not bDebug :
-    humidity = "{:0.1f}".format(bme680.humidity)
-else:     
-    humidity = "1.23"
-
-if bVerbose :
-    print("Humidity:",humidity,"%")
-
-ex = vscp.vscpEventEx()
-initEvent(ex, id_humidity, vc.VSCP_CLASS2_MEASUREMENT_STR,vt.VSCP_TYPE_MEASUREMENT_HUMIDITY)
-
-# Size is predata + string length + terminating zero
-ex.sizedata = 4 + len(humidity) + 1
-ex.data[0] = sensorindex_humidity
-ex.data[1] = zone
-ex.data[2] = subzone
-ex.data[3] = 0  # default unit % of moisture
-b = humidity.encode()
-for idx in range(len(b)):
-    ex.data[idx + 4] = b[idx]
-ex.data[4 + len(humidity)] = 0  # optional terminating zero
-
-rv = vscphelper.sendEventEx(h1,ex)
-if vscp.VSCP_ERROR_SUCCESS != rv :
-    vscphelper.closeSession(h1)
-    raise ValueError('Command error: sendEventEx  Error code=%d' % rv )
-
-# -----------------------------------------------------------------------------
-#                             P R E S S U R E
-# -----------------------------------------------------------------------------
-
-if not bDebug :
-    pressure = "{:0.0f}".format(bme680.pressure*100)
-else:     
-    pressure = "102300"
+    if 'backend' in config['BME680']:
+        backend = parseBackend(config['BME680']['backend'])
+        if backend not in ("adafruit", "simulator"):
+            raise ValueError("Backend " + backend + " is only supported by mqtt-bme680.py")
+        if bVerbose:
+            print("backend =", backend)
 
-if bVerbose :
-    print("Pressure:", pressure, "Pa")
-
-ex = vscp.vscpEventEx()
-initEvent(ex, id_pressure, vc.VSCP_CLASS2_MEASUREMENT_STR,vt.VSCP_TYPE_MEASUREMENT_PRESSURE)
-
-# Size is predata + string length + terminating zero
-ex.sizedata = 4 + len(pressure) + 1
-ex.data[0] = sensorindex_pressure
-ex.data[1] = zone
-ex.data[2] = subzone
-ex.data[3] = 0  # default unit Pascal
-b = pressure.encode()
-for idx in range(len(b)):
-    ex.data[idx + 4] = b[idx]
-ex.data[4 + len(pressure)] = 0  # optional terminating zero
-
-rv = vscphelper.sendEventEx(h1,ex)
-if vscp.VSCP_ERROR_SUCCESS != rv :
-    vscphelper.closeSession(h1)
-    raise ValueError('Command error: sendEventEx  Error code=%d' % rv )
+    if 'sim_seed' in config['BME680']:
+        sim_seed = int(config['BME680']['sim_seed'])
+        if bVerbose:
+            print("sim_seed =", sim_seed)
 
-# -----------------------------------------------------------------------------
-#                           Adjusted Pressure
-# -----------------------------------------------------------------------------
+    if 'sim_latency' in config['BME680']:
+        sim_latency = float(config['BME680']['sim_latency'])
+        if bVerbose:
+            print("sim_latency =", sim_latency)
 
-if not bDebug :
-    pressure = "{:0.0f}".format((bme680.pressure + height_at_location/8.3)*100)
-else:     
-    pressure = "1000"   
+    if 'sim_noise' in config['BME680']:
+        sim_noise = float(config['BME680']['sim_noise'])
+        if bVerbose:
+            print("sim_noise =", sim_noise)
 
-if bVerbose :
-    print("Relative pressure:", pressure, "Pa")
-
-ex = vscp.vscpEventEx()
-initEvent(ex, id_pressure_adj, vc.VSCP_CLASS2_MEASUREMENT_STR,vt.VSCP_TYPE_MEASUREMENT_PRESSURE)
-
-# Size is predata + string length + terminating zero
-ex.sizedata = 4 + len(pressure) + 1
-ex.data[0] = sensorindex_pressure_adj
-ex.data[1] = zone
-ex.data[2] = subzone
-ex.data[3] = 0  # default unit Pascal
-b = pressure.encode()
-for idx in range(len(b)):
-    ex.data[idx + 4] = b[idx]
-ex.data[4 + len(pressure)] = 0  # optional terminating zero
-
-rv = vscphelper.sendEventEx(h1,ex)
-if vscp.VSCP_ERROR_SUCCESS != rv :
-    vscphelper.closeSession(h1)
-    raise ValueError('Command error: sendEventEx  Error code=%d' % rv )
+    if 'sim_i2c_error_rate' in config['BME680']:
+        sim_i2c_error_rate = float(config['BME680']['sim_i2c_error_rate'])
+        if bVerbose:
+            print("sim_i2c_error_rate =", sim_i2c_error_rate)
 
-# -----------------------------------------------------------------------------
-#                                   Gas
-# -----------------------------------------------------------------------------
+    if 'sim_stuck_rate' in config['BME680']:
+        sim_stuck_rate = float(config['BME680']['sim_stuck_rate'])
+        if bVerbose:
+            print("sim_stuck_rate =", sim_stuck_rate)
 
-if not bDebug :
-    gas = "{:d}".format(bme680.gas)
-else:     
-    gas = "150000"   
+    if 'sim_start' in config['BME680']:
+        sim_start = float(config['BME680']['sim_start'])
+        if bVerbose:
+            print("sim_start =", sim_start)
 
-if bVerbose :
-    print("Gas:",gas,"Ohm")
-
-ex = vscp.vscpEventEx()
-initEvent(ex, id_gas, vc.VSCP_CLASS2_MEASUREMENT_STR,vt.VSCP_TYPE_MEASUREMENT_ELECTRICAL_RESISTANCE)
-
-# Size is predata + string length + terminating zero
-ex.sizedata = 4 + len(gas) + 1
-ex.data[0] = sensorindex_gas
-ex.data[1] = zone
-ex.data[2] = subzone
-ex.data[3] = 0  # default unit Ohms
-b = gas.encode()
-for idx in range(len(b)):
-    ex.data[idx + 4] = b[idx]
-ex.data[4 + len(gas)] = 0  # optional terminating zero
-
-rv = vscphelper.sendEventEx(h1,ex)
-if vscp.VSCP_ERROR_SUCCESS != rv :
-    vscphelper.closeSession(h1)
-    raise ValueError('Command error: sendEventEx  Error code=%d' % rv )
+    if 'sim_step' in config['BME680']:
+        sim_step = float(config['BME680']['sim_step'])
+        if bVerbose:
+            print("sim_step =", sim_step)
 
 # -----------------------------------------------------------------------------
-#                                Altitude
-# -----------------------------------------------------------------------------
-
-if not bDebug :
-    altitude = "{:0.1f}".format(bme680.altitude)
-else:     
-    altitude = "420"    
 
-if bVerbose :
-    print("Altitude",altitude,"meter")
-
-ex = vscp.vscpEventEx()
-initEvent(ex, id_altitude, vc.VSCP_CLASS2_MEASUREMENT_STR,vt.VSCP_TYPE_MEASUREMENT_ALTITUDE)
-
-# Size is predata + string length + terminating zero
-ex.sizedata = 4 + len(altitude) + 1
-ex.data[0] = sensorindex_altitude
-ex.data[1] = zone
-ex.data[2] = subzone
-ex.data[3] = 0  # default unit Meters
-b = altitude.encode()
-for idx in range(len(b)):
-    ex.data[idx + 4] = b[idx]
-ex.data[4 + len(altitude)] = 0  # optional terminating zero
-
-rv = vscphelper.sendEventEx(h1,ex)
-if vscp.VSCP_ERROR_SUCCESS != rv :
-    vscphelper.closeSession(h1)
-    raise ValueError('Command error: sendEventEx  Error code=%d' % rv )
+# The events for the measurements, compiled once. The IAQ index is not
+# sent as it needs a gas baseline kept between runs.
+channels = [
+    compileChannel('temperature', guid, id_temperature, sensorindex_temperature, zone, subzone, "", ""),
+    compileChannel('humidity', guid, id_humidity, sensorindex_humidity, zone, subzone, "", ""),
+    compileChannel('pressure', guid, id_pressure, sensorindex_pressure, zone, subzone, "", ""),
+    compileChannel('pressure_adj', guid, id_pressure_adj, sensorindex_pressure_adj, zone, subzone, "", ""),
+    compileChannel('gas', guid, id_gas, sensorindex_gas, zone, subzone, "", ""),
+    compileChannel('altitude', guid, id_altitude, sensorindex_altitude, zone, subzone, "", ""),
+    compileChannel('dewpoint', guid, id_dewpoint, sensorindex_dewpoint, zone, subzone, "", ""),
+]
+
+# Take one reading and return the events for it
+def measure():
+    reading = makeReading(*sensor.read(),
+                          temp_corr=temp_corr,
+                          height_at_location=height_at_location,
+                          sea_level_pressure=sea_level_pressure)
+    events = []
+    for ch in channels :
+        value = getattr(reading, ch.name)
+        if bVerbose :
+            print(ch.label, ch.format(value), ch.unitname)
+        events.append(ch.fill(value, reading.timestamp))
+    return events
 
 # -----------------------------------------------------------------------------
-#                                Dew point
-# -----------------------------------------------------------------------------
-# https://en.wikipedia.org/wiki/Dew_point#Calculating_the_dew_point
-
-b = 17.62
-c = 243.12
-if not bDebug :
-    gamma = (b * bme680.temperature /(c + bme680.temperature)) + math.log(bme680.humidity / 100.0)
-else:
-    gamma = 1
-    
-dewpoint = (c * gamma) / (b - gamma)
 
-if not bDebug :
-    dew = "{:0.1f}".format(dewpoint)
-else:     
-    dew = "12"    
+# Create the sensor backend
+if bSimulate or backend == "simulator" :
+    sensor = SimulatedBackend(seed=sim_seed,
+                              latency=sim_latency,
+                              noise=sim_noise,
+                              i2c_error_rate=sim_i2c_error_rate,
+                              stuck_rate=sim_stuck_rate,
+                              start=sim_start or None,
+                              step=sim_step or None)
+else :
+    sensor = AdafruitBackend(spi=bUseSPI)
+
+# The connection to the VSCP daemon is kept open in daemon mode
+link = VscpLink(host, user, password, timeout=response_timeout,
+                keepalive=keepalive, verbose=bVerbose)
 
 if bVerbose :
-    print("Dew point",dew,"C")
-
-ex = vscp.vscpEventEx()
-initEvent(ex, id_dewpoint, vc.VSCP_CLASS2_MEASUREMENT_STR,vt.VSCP_TYPE_MEASUREMENT_DEWPOINT)
-
-# Size is predata + string length + terminating zero
-ex.sizedata = 4 + len(dew) + 1
-ex.data[0] = sensorindex_dewpoint
-ex.data[1] = zone
-ex.data[2] = subzone
-ex.data[3] = 0  # default unit Meters
-b = altitude.encode()
-for idx in range(len(b)):
-    ex.data[idx + 4] = b[idx]
-ex.data[4 + len(dew)] = 0  # optional terminating zero
-
-rv = vscphelper.sendEventEx(h1,ex)
-if vscp.VSCP_ERROR_SUCCESS != rv :
-    vscphelper.closeSession(h1)
-    raise ValueError('Command error: sendEventEx  Error code=%d' % rv )
-
-# -----------------------------------------------------------------------------
+    print("\n\nConnection in progress...")
 
-rv = vscphelper.close(h1)
-if vscp.VSCP_ERROR_SUCCESS != rv :
-    vscphelper.closeSession(h1)
-    raise ValueError('Command error: close  Error code=%d' % rv )
+try:
+    link.open()
+    if bVerbose :
+        print("Connected")
+except (OSError, VscpError) as e:
+    if not bDaemon :
+        sensor.close()
+        raise ValueError('Command error: open  Error: {}'.format(e))
+    # The VSCP daemon may not be up yet, the measurement loop connects as
+    # it does after a broken connection
+    print("Unable to connect to the VSCP daemon, trying again next cycle:", e)
+
+if not bDaemon :
+    events = measure()
+    sensor.close()
+    if bVerbose :
+        print("-------------------------------------------------------------------------------")
+        print("Sending...")
+    # All events in one write, one round trip to the daemon
+    try:
+        link.send(events)
+    except (OSError, VscpError) as e:
+        link.close()
+        raise ValueError('Command error: send  Error: {}'.format(e))
+else :
+    import signal
+    # Stop cleanly on SIGTERM and ctrl+c
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    if bVerbose :
+        print("Daemon mode, interval =", interval, "seconds")
+    try:
+        due = time.monotonic()
+        while True:
+            # A failed cycle is reported and the next one is tried, a
+            # broken connection is opened again by the next send
+            try:
+                link.send(measure())
+            except (OSError, VscpError, ValueError) as e:
+                print("Measurement cycle failed:", e)
+            due += interval
+            now = time.monotonic()
+            if due < now :
+                due = now
+            # Keep the connection alive (NOOP) while waiting
+            link.wait(due - now)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sensor.close()
+        if bVerbose :
+            print("Sent {} events in {} batches, {} connects, {} events sent again, {} NOOP".format(
+                  link.events, link.batches, link.opens, link.resent, link.noops))
 
-vscphelper.closeSession(h1)
+link.close()
 
 if bVerbose :
     print("-------------------------------------------------------------------------------")
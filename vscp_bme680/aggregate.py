@@ -0,0 +1,172 @@
+###############################################################################
+# vscp_bme680/aggregate.py
+#
+# This file is part of the VSCP (http://www.vscp.org)
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2000-2021 Ake Hedman, Grodans Paradis AB <info@grodansparadis.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Windowed aggregation. In daemon mode the sensor can be read much more
+# often than events are published. The samples of every channel are kept
+# in a ring buffer of C doubles (array module, no Python object per
+# sample) and at the end of each window the selected statistics are
+# published instead of the individual readings.
+#
+#   mean   - Published on the topic of the channel
+#   min    - Published on <topic>/min
+#   max    - Published on <topic>/max
+#   stddev - Published on <topic>/stddev (population standard deviation)
+#   count  - Adds the number of samples to the measurement block of the
+#            published events
+
+import array
+import math
+
+STATISTICS = ('mean', 'min', 'max', 'stddev', 'count')
+
+# Parse a comma separated list of statistics
+def parseStatistics(text):
+    stats = []
+    for stat in text.split(','):
+        stat = stat.strip().lower()
+        if not len(stat):
+            continue
+        if stat not in STATISTICS:
+            raise ValueError("Unknown statistic: " + stat)
+        stats.append(stat)
+    return tuple(stats)
+
+# Fixed size ring buffer of doubles
+class RingBuffer:
+
+    def __init__(self, size):
+        self.size = max(1, size)
+        self.data = array.array('d', bytes(8 * self.size))
+        self.pos = 0
+        self.count = 0
+
+    def add(self, value):
+        self.data[self.pos] = value
+        self.pos = (self.pos + 1) % self.size
+        if self.count < self.size:
+            self.count += 1
+
+    def clear(self):
+        self.pos = 0
+        self.count = 0
+
+    # The stored values (oldest not necessarily first)
+    def values(self):
+        if self.count < self.size:
+            return memoryview(self.data)[:self.count]
+        return memoryview(self.data)
+
+    # (mean, min, max, stddev) of the stored values
+    def statistics(self):
+        values = self.values()
+        n = len(values)
+        if not n:
+            return None
+        mean = math.fsum(values) / n
+        var = math.fsum((v - mean) * (v - mean) for v in values) / n
+        return (mean, min(values), max(values), math.sqrt(var))
+
+# Aggregates the readings of one sensor
+#   channels - Compiled channel templates of the sensor
+#   window   - Seconds in a window
+#   interval - Seconds between readings (sizes the ring buffers)
+#   stats    - Statistics to publish (see STATISTICS)
+class Aggregator:
+
+    def __init__(self, channels, window, interval, stats=('mean', 'min', 'max', 'count')):
+        self.channels = channels
+        self.window = window
+        self.interval = interval
+        self.stats = tuple(s for s in stats if s != 'count')
+        self.count = 'count' in stats
+        # Room for a full window plus some jitter in the sampling
+        size = int(math.ceil(window / max(interval, 0.001))) + 2
+        self.buffers = dict((ch.name, RingBuffer(size)) for ch in channels)
+        self.setChannels(channels)
+        self.start = None
+        self.last = None
+
+    # Use new channel templates (on a configuration reload). The samples of
+    # the current window are kept.
+    def setChannels(self, channels):
+        self.channels = channels
+        # Topic for every channel and statistic, the mean keeps the topic
+        # of the channel
+        self.topics = {}
+        for ch in channels:
+            for stat in self.stats:
+                if not len(ch.topic):
+                    self.topics[(ch.name, stat)] = ""
+                elif 'mean' == stat:
+                    self.topics[(ch.name, stat)] = ch.topic
+                else:
+                    self.topics[(ch.name, stat)] = ch.topic + "/" + stat
+
+    # Add a reading. Returns True when the window is complete.
+    def add(self, reading):
+        # The first sample stands for the interval before it
+        if self.start is None:
+            self.start = reading.timestamp - self.interval
+        self.last = reading.timestamp
+        for name, buffer in self.buffers.items():
+            value = getattr(reading, name)
+            # Gas is not measured in every cycle
+            if value is not None:
+                buffer.add(value)
+        return reading.timestamp - self.start >= self.window
+
+    # Statistics for the window and start a new one. Returns a list of
+    # (channel, stat, topic, value, samples).
+    def flush(self):
+        result = []
+        for ch in self.channels:
+            buffer = self.buffers[ch.name]
+            samples = buffer.count
+            values = buffer.statistics()
+            buffer.clear()
+            if values is None:
+                continue
+            for stat in self.stats:
+                if 'mean' == stat:
+                    value = values[0]
+                elif 'min' == stat:
+                    value = values[1]
+                elif 'max' == stat:
+                    value = values[2]
+                else:
+                    value = values[3]
+                if ch.vtype is int:
+                    value = int(round(value))
+                result.append((ch, stat, self.topics[(ch.name, stat)], value,
+                               samples if self.count else None))
+        self.start = None
+        return result
+
+    # True if there are samples not yet published
+    def pending(self):
+        return self.start is not None
@@ -0,0 +1,427 @@
+###############################################################################
+# vscp_bme680/backends.py
+#
+# This file is part of the VSCP (http://www.vscp.org)
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2000-2021 Ake Hedman, Grodans Paradis AB <info@grodansparadis.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Sensor backends. A backend delivers raw sensor values as the tuple
+#
+#   (temperature, humidity, pressure, gas)
+#
+# with temperature in degrees Celsius, relative humidity in percent,
+# pressure in hPa and gas resistance in Ohms (the units of the Adafruit
+# driver). Derived values are calculated by reading.makeReading().
+#
+# The gas measurement heats the hot plate of the sensor for a while on
+# every conversion, which takes most of the conversion time and power.
+# read(gas=False) does a conversion of temperature, humidity and pressure
+# only, with the heater off, and gives None for gas.
+
+import errno
+import math
+import random
+import time
+
+from vscp_bme680.timing import (OVERSAMPLING, FILTER_SIZES, TEMPERATURE_OVERSAMPLE,
+                                HUMIDITY_OVERSAMPLE, PRESSURE_OVERSAMPLE, FILTER_SIZE,
+                                conversionTime)
+from vscp_bme680 import raw
+
+# Heater temperature (degrees Celsius) and duration (milliseconds) the
+# Adafruit driver uses by default
+HEATER_TEMPERATURE = 320
+HEATER_DURATION = 150
+
+# Heater temperature, 200-400 degrees Celsius according to the datasheet
+def parseHeaterTemperature(text):
+    temperature = int(text)
+    if not 200 <= temperature <= 400:
+        raise ValueError("Heater temperature must be 200-400 C")
+    return temperature
+
+# Heater duration, the sensor can wait at most 4032 ms
+def parseHeaterDuration(text):
+    duration = int(text)
+    if not 1 <= duration <= 4032:
+        raise ValueError("Heater duration must be 1-4032 ms")
+    return duration
+
+# Base class for sensor backends
+class SensorBackend:
+
+    # Min seconds between conversions
+    min_interval = 0.0
+
+    # Oversampling for temperature, humidity and pressure and the IIR
+    # filter size (see timing.py)
+    def setOversampling(self, temperature, humidity, pressure, filter_size):
+        pass
+
+    # Do one conversion and return the raw values, gas is None if gas is
+    # False
+    def read(self, gas=True):
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+# -----------------------------------------------------------------------------
+#                               A D A F R U I T
+# -----------------------------------------------------------------------------
+
+# Open I2C buses, shared between sensors on the same bus
+_buses = {}
+
+# Open the I2C bus. None is the default bus of the board, a number is
+# /dev/i2c-<number> (needs the adafruit-extended-bus module).
+def openBus(bus):
+    if bus not in _buses:
+        if bus is None:
+            import board
+            import busio
+            _buses[bus] = busio.I2C(board.SCL, board.SDA)
+        else:
+            from adafruit_extended_bus import ExtendedI2C
+            _buses[bus] = ExtendedI2C(bus)
+    return _buses[bus]
+
+# Create the driver object for a sensor
+def openDevice(bus, address, spi=False):
+    import adafruit_bme680
+    if spi:
+        import board
+        import busio
+        import digitalio
+        spibus = busio.SPI(board.SCK, board.MOSI, board.MISO)
+        cs = digitalio.DigitalInOut(board.D10)
+        return adafruit_bme680.Adafruit_BME680_SPI(spibus, cs)
+    return adafruit_bme680.Adafruit_BME680_I2C(openBus(bus), address=address)
+
+# A real BME680 through the Adafruit driver
+class AdafruitBackend(SensorBackend):
+
+    # The driver gives the values of the last conversion if it is newer
+    # than its refresh time
+    min_interval = 0.1
+
+    # heater_temperature - Hot plate temperature for gas measurements (C)
+    # heater_duration    - Milliseconds the hot plate is heated
+    def __init__(self, bus=None, address=0x77, spi=False,
+                 heater_temperature=HEATER_TEMPERATURE, heater_duration=HEATER_DURATION):
+        self.device = openDevice(bus, address, spi)
+        self.heater_temperature = heater_temperature
+        self.heater_duration = heater_duration
+        self.gas = None
+        self._setGas(True)
+
+    # Turn the heater and gas measurement on or off. Only written to the
+    # sensor when it changes.
+    def _setGas(self, gas):
+        if gas == self.gas:
+            return
+        if gas:
+            ok = self.device.set_gas_heater(self.heater_temperature, self.heater_duration)
+        else:
+            ok = self.device.set_gas_heater(None, None)
+        if not ok:
+            raise OSError(errno.EIO, "Unable to set the gas heater")
+        self.gas = gas
+
+    def setOversampling(self, temperature, humidity, pressure, filter_size):
+        d = self.device
+        d.temperature_oversample = temperature
+        d.humidity_oversample = humidity
+        d.pressure_oversample = pressure
+        d.filter_size = filter_size
+
+    # The driver does a new forced mode conversion on property access only
+    # if the last one is older than its refresh time (0.1 s default) so
+    # reading the properties back to back like this gives one conversion
+    # for all of them.
+    def read(self, gas=True):
+        self._setGas(gas)
+        d = self.device
+        if not gas:
+            return (d.temperature, d.humidity, d.pressure, None)
+        return (d.temperature, d.humidity, d.pressure, d.gas)
+
+# -----------------------------------------------------------------------------
+#                                 B U R S T
+# -----------------------------------------------------------------------------
+
+# Backends for burst acquisition have acquire(gas) that returns a raw
+# sample (timestamp, gas, data block) without compensation, and the
+# calibration of the sensor. read() compensates one sample.
+class RawBackend(SensorBackend):
+
+    calibration = None
+
+    def acquire(self, gas=True):
+        raise NotImplementedError()
+
+    def read(self, gas=True):
+        timestamp, gas, block = self.acquire(gas)
+        return raw.compensate(self.calibration, block, gas)
+
+# Register addresses
+REG_CHIP_ID = 0xD0
+REG_VARIANT = 0xF0
+REG_RESET = 0xE0
+REG_RES_HEAT_0 = 0x5A
+REG_GAS_WAIT_0 = 0x64
+REG_CTRL_GAS_1 = 0x71
+REG_CTRL_HUM = 0x72
+REG_CTRL_MEAS = 0x74
+REG_CONFIG = 0x75
+CHIP_ID = 0x61
+
+# A real BME680 read directly over I2C. A sample is one write that starts
+# a forced mode conversion and one read of the data block when the
+# conversion should be done.
+class BurstBackend(RawBackend):
+
+    def __init__(self, bus=None, address=0x77,
+                 heater_temperature=HEATER_TEMPERATURE, heater_duration=HEATER_DURATION):
+        from adafruit_bus_device.i2c_device import I2CDevice
+        self.device = I2CDevice(openBus(bus), address)
+        self._write(REG_RESET, 0xB6)
+        time.sleep(0.005)
+        chip_id = self._read(REG_CHIP_ID, 1)[0]
+        if chip_id != CHIP_ID:
+            raise RuntimeError("No BME680 found, chip id 0x{:02x}".format(chip_id))
+        variant = self._read(REG_VARIANT, 1)[0]
+        coeff = self._read(raw.REG_COEFF1, raw.COEFF1_LENGTH) + \
+                    self._read(raw.REG_COEFF2, raw.COEFF2_LENGTH)
+        self.calibration = raw.parseCalibration(coeff, self._read(0x00, 5), variant)
+        self.heater_duration = heater_duration
+        self._write(REG_RES_HEAT_0, raw.heaterResistance(self.calibration, heater_temperature))
+        self._write(REG_GAS_WAIT_0, raw.gasWait(heater_duration))
+        self.setOversampling(TEMPERATURE_OVERSAMPLE, HUMIDITY_OVERSAMPLE,
+                             PRESSURE_OVERSAMPLE, FILTER_SIZE)
+        self.gas = None
+
+    def _read(self, register, length):
+        buf = bytearray(length)
+        with self.device as i2c:
+            i2c.write_then_readinto(bytes([register]), buf)
+        return bytes(buf)
+
+    def _write(self, register, value):
+        with self.device as i2c:
+            i2c.write(bytes([register, value]))
+
+    def setOversampling(self, temperature, humidity, pressure, filter_size):
+        self.oversampling = (temperature, humidity, pressure)
+        # Register values are the index in the list of valid values + 1
+        self._write(REG_CTRL_HUM, OVERSAMPLING.index(humidity) + 1)
+        self._write(REG_CONFIG, FILTER_SIZES.index(filter_size) << 2)
+        self.ctrl_meas = ((OVERSAMPLING.index(temperature) + 1) << 5) | \
+                             ((OVERSAMPLING.index(pressure) + 1) << 2)
+
+    def acquire(self, gas=True):
+        if gas != self.gas:
+            if not gas:
+                self._write(REG_CTRL_GAS_1, 0x00)
+            elif self.calibration.variant:
+                self._write(REG_CTRL_GAS_1, 0x20)
+            else:
+                self._write(REG_CTRL_GAS_1, 0x10)
+            self.gas = gas
+        self._write(REG_CTRL_MEAS, self.ctrl_meas | 0x01)
+        time.sleep(conversionTime(*self.oversampling, gas=gas,
+                                  heater_duration=self.heater_duration))
+        start = time.monotonic()
+        while True:
+            block = self._read(raw.REG_DATA, raw.DATA_LENGTH)
+            if raw.newData(block):
+                return (time.time(), gas, block)
+            if time.monotonic() - start >= 3.0:
+                raise RuntimeError("Timeout while reading sensor data")
+            time.sleep(0.001)
+
+# Samples from a register dump (see raw.py). The samples are given in
+# order and start over at the end of the dump. Timestamps are the time
+# of the read, not the time in the dump.
+class DumpBackend(RawBackend):
+
+    def __init__(self, path):
+        self.calibration, self.samples = raw.readDump(path)
+        if not len(self.samples):
+            raise ValueError(path + ": no samples")
+        self.pos = 0
+
+    def acquire(self, gas=True):
+        timestamp, recorded_gas, block = self.samples[self.pos]
+        self.pos = (self.pos + 1) % len(self.samples)
+        return (time.time(), gas and recorded_gas, block)
+
+# -----------------------------------------------------------------------------
+#                             S I M U L A T O R
+# -----------------------------------------------------------------------------
+
+SECONDS_PER_DAY = 86400.0
+
+# A simulated BME680 with realistic values for load testing and running
+# without hardware. Values follow diurnal curves with noise and are fully
+# determined by the seed (and start/step if used).
+class SimulatedBackend(SensorBackend):
+
+    # seed           - Seed for the random generator
+    # latency        - Seconds each conversion takes
+    # noise          - Noise scale, 0 gives clean curves
+    # i2c_error_rate - Probability for a read to fail with an I/O error
+    # stuck_rate     - Probability for the values to get stuck
+    # stuck_cycles   - Number of reads values stay stuck
+    # start, step    - If step is given the simulated time starts at start
+    #                  (Unix time) and advances step seconds each read,
+    #                  otherwise the wall clock is used
+    # timing         - Add the time a real conversion takes with the
+    #                  oversampling and heater settings to latency
+    # heater_duration - Heater milliseconds for timing
+    def __init__(self, seed=0, latency=0.0, noise=1.0,
+                 i2c_error_rate=0.0, stuck_rate=0.0, stuck_cycles=10,
+                 start=None, step=None, timing=False, heater_duration=150):
+        self.rng = random.Random(seed)
+        self.latency = latency
+        self.noise = noise
+        self.i2c_error_rate = i2c_error_rate
+        self.stuck_rate = stuck_rate
+        self.stuck_cycles = stuck_cycles
+        self.step = step
+        self.now = time.time() if start is None else start
+        self.stuck = 0
+        self.last = None
+        self.reads = 0
+        self.timing = timing
+        self.heater_duration = heater_duration
+        self.setOversampling(TEMPERATURE_OVERSAMPLE, HUMIDITY_OVERSAMPLE,
+                             PRESSURE_OVERSAMPLE, FILTER_SIZE)
+        self.filtered = None
+
+        # Each seed gives a slightly different location/climate
+        self.mean_temperature = 20.0 + self.rng.uniform(-5.0, 5.0)
+        self.mean_humidity = 50.0 + self.rng.uniform(-10.0, 10.0)
+        self.mean_pressure = 1013.25 + self.rng.uniform(-15.0, 5.0)
+        self.mean_gas = 80000.0 + self.rng.uniform(-30000.0, 30000.0)
+        self.phase = self.rng.uniform(0.0, 2 * math.pi)
+
+    def _time(self):
+        if self.step is None:
+            return time.time()
+        t = self.now
+        self.now += self.step
+        return t
+
+    def _noise(self, sigma):
+        return self.rng.gauss(0.0, sigma * self.noise)
+
+    # The noise levels of values() are for the default oversampling, more
+    # oversampling averages more samples
+    def setOversampling(self, temperature, humidity, pressure, filter_size):
+        self.oversampling = (temperature, humidity, pressure)
+        self.scale = tuple(math.sqrt(default / float(oversample)) for default, oversample in
+                           zip((TEMPERATURE_OVERSAMPLE, HUMIDITY_OVERSAMPLE, PRESSURE_OVERSAMPLE),
+                               self.oversampling))
+        self.filter_size = filter_size
+
+    # The IIR filter of the sensor, for temperature and pressure
+    def _filter(self, values):
+        temperature, humidity, pressure, gas = values
+        if self.filtered is not None and self.filter_size > 0:
+            c = self.filter_size
+            temperature = (self.filtered[0] * c + temperature) / (c + 1)
+            pressure = (self.filtered[2] * c + pressure) / (c + 1)
+        self.filtered = (temperature, humidity, pressure, gas)
+        return self.filtered
+
+    # Raw values for a given (Unix) time
+    def values(self, t):
+        # Diurnal curve, warmest early afternoon
+        day = 2 * math.pi * ((t % SECONDS_PER_DAY) / SECONDS_PER_DAY - 0.375)
+        diurnal = math.sin(day)
+        # Weather, a slow pressure swing over a few days
+        weather = math.sin(2 * math.pi * t / (3.7 * SECONDS_PER_DAY) + self.phase)
+
+        temperature = self.mean_temperature + 4.0 * diurnal + self._noise(0.05 * self.scale[0])
+        humidity = self.mean_humidity - 12.0 * diurnal + 5.0 * weather + \
+                       self._noise(0.3 * self.scale[1])
+        humidity = min(100.0, max(0.0, humidity))
+        pressure = self.mean_pressure + 12.0 * weather + 0.5 * math.sin(2 * day) + \
+                       self._noise(0.02 * self.scale[2])
+        gas = self.mean_gas * (1.0 + 0.25 * math.sin(day + self.phase)) + self._noise(800.0)
+        gas = max(1000, int(gas))
+        return (temperature, humidity, pressure, gas)
+
+    def read(self, gas=True):
+        latency = self.latency
+        if self.timing:
+            latency += conversionTime(*self.oversampling, gas=gas,
+                                      heater_duration=self.heater_duration)
+        if latency > 0:
+            time.sleep(latency)
+        t = self._time()
+        self.reads += 1
+
+        if self.i2c_error_rate > 0 and self.rng.random() < self.i2c_error_rate:
+            raise OSError(errno.EIO, "Simulated I2C error")
+
+        if self.stuck > 0:
+            self.stuck -= 1
+        elif self.last is not None and self.stuck_rate > 0 and \
+                self.rng.random() < self.stuck_rate:
+            self.stuck = self.stuck_cycles - 1
+        else:
+            self.last = self._filter(self.values(t))
+
+        if not gas:
+            return self.last[:3] + (None,)
+        return self.last
+
+# -----------------------------------------------------------------------------
+
+# Names of the available backends
+BACKENDS = ('adafruit', 'simulator', 'burst', 'dump')
+
+# Create the backend for a sensor from its settings (see sensors.py)
+def openBackend(cfg, spi=False):
+    backend = cfg['backend']
+    if 'adafruit' == backend:
+        return AdafruitBackend(cfg['bus'], cfg['address'], spi,
+                               cfg['heater_temperature'], cfg['heater_duration'])
+    elif 'burst' == backend:
+        return BurstBackend(cfg['bus'], cfg['address'],
+                            cfg['heater_temperature'], cfg['heater_duration'])
+    elif 'dump' == backend:
+        return DumpBackend(cfg['dump_file'])
+    elif 'simulator' == backend:
+        return SimulatedBackend(seed=cfg['sim_seed'],
+                                latency=cfg['sim_latency'],
+                                noise=cfg['sim_noise'],
+                                i2c_error_rate=cfg['sim_i2c_error_rate'],
+                                stuck_rate=cfg['sim_stuck_rate'],
+                                start=cfg['sim_start'] or None,
+                                step=cfg['sim_step'] or None,
+                                heater_duration=cfg['heater_duration'])
+    raise ValueError("Unknown sensor backend: " + backend)
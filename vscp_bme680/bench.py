@@ -0,0 +1,242 @@
+###############################################################################
+# vscp_bme680/bench.py
+#
+# This file is part of the VSCP (http://www.vscp.org)
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2000-2021 Ake Hedman, Grodans Paradis AB <info@grodansparadis.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Benchmark of the measure-encode-publish cycle. Drives the real sensor,
+# event and publisher code with simulated sensors against an MQTT broker
+# (the in-process LocalBroker or a broker on loopback) and collects the
+# time spent in every stage of a cycle:
+#
+#   read  - Sensor.read(), conversion and derived values
+#   fill  - ChannelTemplate.fill(), the VSCP event as a JSON object
+#   json  - json.dumps() of the event
+#   topic - Topic lookup for the channel
+#   ack   - From publish() until the broker has confirmed the message
+#
+# runStartup() measures a one-shot run of mqtt-bme680.py as started from
+# cron, with and without the configuration cache.
+#
+# Results are returned as a dictionary that can be written as JSON so runs
+# of different releases can be compared.
+
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+from vscp_bme680.backends import openBackend
+from vscp_bme680.events import CHANNEL_NAMES
+from vscp_bme680.latency import Stats
+from vscp_bme680.publisher import Publisher
+from vscp_bme680.sensors import Sensor
+
+STAGES = ('read', 'fill', 'json', 'topic', 'ack')
+
+# Settings for simulated sensor number index. The GUID is fixed so no MAC
+# address lookup is needed, the sensor index tells the sensors apart.
+def benchSensorConfig(index, latency=0.0, encoding='string'):
+    cfg = {
+        'guid': "FF:FF:FF:FF:FF:FF:FF:FE:00:00:00:00:00:00:{:02X}:00".format(index & 0xff),
+        'zone': 0,
+        'subzone': 0,
+        'encoding': encoding,
+        'temp_corr': 0.0,
+        'height_at_location': 412.0,
+        'sea_level_pressure': 1013.25,
+        'bus': index,
+        'address': 0x77,
+        'backend': "simulator",
+        'heater_temperature': 320,
+        'heater_duration': 150,
+        'gas_every_n_cycles': 1,
+        'temperature_oversample': 8,
+        'humidity_oversample': 2,
+        'pressure_oversample': 4,
+        'filter_size': 3,
+        'burst_batch': 0,
+        'dump_file': "",
+        'iaq_burn_in': 300.0,
+        'iaq_save_interval': 3600.0,
+        'sim_seed': index,
+        'sim_latency': latency,
+        'sim_noise': 1.0,
+        'sim_i2c_error_rate': 0.0,
+        'sim_stuck_rate': 0.0,
+        'sim_start': 0.0,
+        'sim_step': 0.0,
+    }
+    for id, name in enumerate(CHANNEL_NAMES):
+        cfg['id_' + name] = id
+        cfg['sensorindex_' + name] = index & 0xff
+        cfg['note_' + name] = "Benchmark " + name
+        cfg['topic_' + name] = "bench/" + str(index) + "/{xguid}/{xclass}/{xtype}/" + name
+        cfg['deadband_' + name] = None
+    return cfg
+
+# Create nsensors simulated sensors
+def benchSensors(nsensors, latency=0.0, encoding='string'):
+    sensors = []
+    for index in range(nsensors):
+        cfg = benchSensorConfig(index, latency, encoding)
+        sensors.append(Sensor("bench{}".format(index), cfg, openBackend(cfg)))
+    return sensors
+
+# Run cycles measurement cycles for all sensors and publish through
+# client (connected, loop started). Returns the result for the run.
+def runBenchmark(client, sensors, cycles=100, qos=1, max_inflight=20,
+                 flush_timeout=5.0):
+    stats = dict((stage, Stats()) for stage in STAGES)
+    publisher = Publisher(client, qos, max_inflight)
+
+    # Confirmation times by message id, set from the paho network thread
+    acked = {}
+    def onPublish(client, userdata, mid):
+        acked[mid] = time.perf_counter()
+    client.on_publish = onPublish
+
+    published = {}
+    timeouts = 0
+    start = time.perf_counter()
+    for cycle in range(cycles):
+        for sensor in sensors:
+            t0 = time.perf_counter()
+            reading = sensor.read()
+            stats['read'].add(time.perf_counter() - t0)
+            for ch in sensor.channels:
+                value = getattr(reading, ch.name)
+                # Gas (and with it the IAQ index) is not measured in every cycle
+                if value is None:
+                    continue
+                t0 = time.perf_counter()
+                event = ch.fill(value, reading.timestamp)
+                t1 = time.perf_counter()
+                payload = json.dumps(event)
+                t2 = time.perf_counter()
+                topic = ch.topic
+                if not len(topic):
+                    continue
+                t3 = time.perf_counter()
+                stats['fill'].add(t1 - t0)
+                stats['json'].add(t2 - t1)
+                stats['topic'].add(t3 - t2)
+                info = publisher.publish(topic, payload, flush_timeout, reading.timestamp)
+                published[info.mid] = t3
+        publisher.flush(flush_timeout)
+        timeouts += publisher.inflight()
+        # Message ids are reused by paho so collect the ack times per cycle
+        for mid, t in published.items():
+            if mid in acked:
+                stats['ack'].add(acked.pop(mid) - t)
+        published = {}
+    elapsed = time.perf_counter() - start
+    client.on_publish = None
+
+    messages = publisher.sent
+    return {
+        "sensors": len(sensors),
+        "encoding": sensors[0].channels[0].encoding,
+        "cycles": cycles,
+        "qos": qos,
+        "messages": messages,
+        "confirmed": publisher.confirmed,
+        "failed": publisher.failed,
+        "unconfirmed": timeouts,
+        "seconds": round(elapsed, 4),
+        "msg_per_s": round(messages / elapsed, 1) if elapsed > 0 else 0.0,
+        "cycles_per_s": round(cycles / elapsed, 2) if elapsed > 0 else 0.0,
+        "stages": dict((stage, stats[stage].summary()) for stage in STAGES),
+    }
+
+# Information about the environment the benchmark ran in
+def benchEnvironment(broker):
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "system": platform.system(),
+        "broker": broker,
+    }
+
+# Configuration for the startup benchmark, one simulated sensor that
+# publishes to the broker on host:port
+STARTUP_CONFIG = """[GENERAL]
+bVerbose = False
+
+[VSCP]
+guid = FF:FF:FF:FF:FF:FF:FF:FE:00:00:00:00:00:00:00:00
+
+[MQTT]
+host = {host}
+port = {port}
+qos = 1
+topic = bench/startup/{{xguid}}/{{xclass}}/{{xtype}}
+
+[BME680]
+backend = simulator
+"""
+
+# Start script (mqtt-bme680.py) runs times with a configuration for broker
+# (a LocalBroker with record set) and measure the time from start until
+# the first message is at the broker and until the process has ended.
+# Cold runs remove the configuration cache first, warm runs use it.
+def runStartup(script, broker, runs=10):
+    result = {}
+    tmpdir = tempfile.mkdtemp(prefix="bench-bme680-")
+    cfgpath = os.path.join(tmpdir, "startup.ini")
+    cache = cfgpath + ".cache"
+    with open(cfgpath, "w") as f:
+        f.write(STARTUP_CONFIG.format(host=broker.host, port=broker.port))
+    cmd = [sys.executable, script, "-s", "-c", cfgpath]
+    try:
+        for mode in ("cold", "warm"):
+            first = Stats()
+            total = Stats()
+            # One extra warm run writes the cache
+            for run in range(runs + ("warm" == mode)):
+                if "cold" == mode and os.path.exists(cache):
+                    os.remove(cache)
+                count = len(broker.messages)
+                start = time.monotonic()
+                subprocess.run(cmd, stdout=subprocess.DEVNULL, check=True)
+                end = time.monotonic()
+                if "warm" == mode and 0 == run:
+                    continue
+                if len(broker.messages) > count:
+                    first.add(broker.messages[count][0] - start)
+                total.add(end - start)
+            result[mode] = {"first_message": first.summary(), "exit": total.summary()}
+    finally:
+        for path in (cache, cfgpath):
+            if os.path.exists(path):
+                os.remove(path)
+        os.rmdir(tmpdir)
+    result["runs"] = runs
+    return result
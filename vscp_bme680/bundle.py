@@ -0,0 +1,114 @@
+###############################################################################
+# vscp_bme680/bundle.py
+#
+# This file is part of the VSCP (http://www.vscp.org)
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2000-2021 Ake Hedman, Grodans Paradis AB <info@grodansparadis.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Bundle mode. Instead of one MQTT message per channel all values of a
+# sensor from one measurement cycle are sent as one message. For a broker
+# the fixed cost of a message (header, topic, ack, ACL check) is often
+# higher than the cost of the payload.
+#
+# Two formats are available
+#
+#   events  - JSON array with the VSCP events of the cycle, the same
+#             events that are published per channel
+#   compact - JSON object with the values keyed by channel name
+#
+#     {"vscpGuid": "...", "vscpTimestampns": ..., "sensor": "bme680",
+#      "values": {"temperature": 20.4, "humidity": 48.2, ...}}
+#
+#   With aggregation the value of a channel is an object with the
+#   statistics ({"mean": 20.4, "min": 20.1, "max": 20.9}) and "samples"
+#   holds the number of samples in the window.
+
+import json
+
+BUNDLE_FORMATS = ('events', 'compact')
+
+# Check a bundle format setting
+def parseBundleFormat(text):
+    fmt = text.strip().lower()
+    if fmt not in BUNDLE_FORMATS:
+        raise ValueError("Unknown bundle format: " + text)
+    return fmt
+
+class Bundle:
+
+    # topic    - Topic for the bundle. {sensor} is replaced with the sensor
+    #            name and {xguid} with the GUID of the first channel.
+    # fmt      - Format (see BUNDLE_FORMATS)
+    # name     - Sensor name
+    # channels - Compiled channel templates of the sensor
+    def __init__(self, topic, fmt, name, channels):
+        self.fmt = fmt
+        self.name = name
+        self.guidstr = channels[0].guidstr
+        self.topic = topic.format(sensor=name, xguid=self.guidstr)
+        self.timestamp = 0.0
+        self.items = []
+        self.samples = None
+
+    def __len__(self):
+        return len(self.items)
+
+    # Start a new bundle
+    def begin(self, timestamp):
+        self.timestamp = timestamp
+        self.items = []
+        self.samples = None
+
+    # Add the value of a channel. stat and samples are set for aggregated
+    # values.
+    def add(self, ch, value, stat=None, samples=None):
+        if 'events' == self.fmt:
+            if stat is None:
+                self.items.append(ch.fill(value, self.timestamp))
+            else:
+                self.items.append(ch.fillStat(value, self.timestamp, stat, samples))
+        else:
+            self.items.append((ch.name, stat, ch.value(value)))
+            if samples is not None:
+                self.samples = samples
+
+    # The JSON payload for the bundle
+    def payload(self):
+        if 'events' == self.fmt:
+            return json.dumps(self.items)
+        values = {}
+        for name, stat, value in self.items:
+            if stat is None:
+                values[name] = value
+            else:
+                values.setdefault(name, {})[stat] = value
+        j = {
+            "vscpGuid": self.guidstr,
+            "vscpTimestampns": int(self.timestamp * 1000000) * 1000,
+            "sensor": self.name,
+            "values": values
+        }
+        if self.samples is not None:
+            j["samples"] = self.samples
+        return json.dumps(j)
@@ -0,0 +1,277 @@
+###############################################################################
+# vscp_bme680/config.py
+#
+# This file is part of the VSCP (http://www.vscp.org)
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2000-2021 Ake Hedman, Grodans Paradis AB <info@grodansparadis.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Table driven reading of the configuration file and a cache for the
+# resolved configuration.
+#
+# SCHEMA lists every setting with its section and a function that checks
+# and converts the value. readConfig() gives a dictionary with the
+# settings found in the file, named as the variables in the scripts.
+#
+# Reading the file, resolving GUIDs from the MAC address and building the
+# sensor settings is a noticeable part of a one-shot run on a small
+# board. The result is kept in a cache file next to the configuration
+# file (<path>.cache) and is used as long as the configuration file, the
+# script, the package and the machine are the same.
+
+import marshal
+import os
+import sys
+
+from vscp_bme680.events import CHANNEL_NAMES, parseEncoding
+from vscp_bme680.deadband import parseDeadband, formatDeadband
+from vscp_bme680.aggregate import parseStatistics
+from vscp_bme680.bundle import parseBundleFormat
+from vscp_bme680.backends import BACKENDS, parseHeaterTemperature, parseHeaterDuration
+from vscp_bme680.timing import parseOversampling, parseFilterSize
+
+# Bump when the content of the cache changes
+CACHE_VERSION = 9
+
+# Modules of the package with code that goes into the cached value (the
+# schema, the parsers and the GUIDs). Any change to them, as with an
+# upgrade of the package, gives a new cache key.
+CACHE_MODULES = ('config', 'sensors', 'events', 'deadband', 'aggregate', 'bundle',
+                 'backends', 'timing')
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Same values as configparser accepts for booleans
+BOOLEAN_STATES = {'1': True, 'yes': True, 'true': True, 'on': True,
+                  '0': False, 'no': False, 'false': False, 'off': False}
+
+def parseBool(text):
+    value = BOOLEAN_STATES.get(text.strip().lower())
+    if value is None:
+        raise ValueError("Not a boolean: " + text)
+    return value
+
+# Integer, also on hex form ("0x77")
+def intAuto(text):
+    return int(text, 0)
+
+def parseQos(text):
+    qos = int(text)
+    if qos not in (0, 1, 2):
+        raise ValueError("QoS must be 0, 1 or 2")
+    return qos
+
+def parsePort(text):
+    port = int(text)
+    if not 0 < port < 65536:
+        raise ValueError("Port must be 1-65535")
+    return port
+
+# Check a query_listen setting, "port", "host:port" or "unix:/path".
+# Empty disables the query service.
+def parseListen(text):
+    text = text.strip()
+    if not len(text) or text.startswith("unix:"):
+        return text
+    parsePort(text.rpartition(':')[2])
+    return text
+
+def parseBackend(text):
+    backend = text.strip().lower()
+    if backend not in BACKENDS:
+        raise ValueError("Unknown backend: " + text)
+    return backend
+
+# (section, key, conversion) for every setting
+SCHEMA = [
+    ('GENERAL', 'bVerbose', parseBool),
+    ('GENERAL', 'metrics_file', str),
+    ('GENERAL', 'reload_interval', float),
+    ('GENERAL', 'history_dir', str),
+    ('GENERAL', 'history_size', int),
+    ('GENERAL', 'query_listen', parseListen),
+    ('GENERAL', 'query_span', float),
+
+    ('VSCP', 'guid', str),
+]
+SCHEMA += [('VSCP', 'sensorindex_' + name, int) for name in CHANNEL_NAMES]
+SCHEMA += [
+    ('VSCP', 'zone', int),
+    ('VSCP', 'subzone', int),
+    ('VSCP', 'encoding', parseEncoding),
+]
+SCHEMA += [('VSCP', 'id_' + name, int) for name in CHANNEL_NAMES]
+SCHEMA += [
+    ('MQTT', 'host', str),
+    ('MQTT', 'port', parsePort),
+    ('MQTT', 'user', str),
+    ('MQTT', 'password', str),
+    ('MQTT', 'qos', parseQos),
+    ('MQTT', 'max_inflight', int),
+    ('MQTT', 'flush_timeout', float),
+    ('MQTT', 'outbox', str),
+    ('MQTT', 'outbox_max_size', int),
+    ('MQTT', 'replay_rate', float),
+    ('MQTT', 'replay_batch', int),
+    ('MQTT', 'status_topic', str),
+    ('MQTT', 'status_interval', float),
+    ('MQTT', 'topic', str),
+]
+SCHEMA += [('MQTT', 'topic_' + name, str) for name in CHANNEL_NAMES]
+SCHEMA += [('MQTT', 'deadband_' + name, parseDeadband) for name in CHANNEL_NAMES]
+SCHEMA += [
+    ('MQTT', 'max_silence', float),
+    ('MQTT', 'aggregate_window', float),
+    ('MQTT', 'aggregate_stats', parseStatistics),
+    ('MQTT', 'bundle_topic', str),
+    ('MQTT', 'bundle_format', parseBundleFormat),
+    ('MQTT', 'channel_topics', parseBool),
+    ('MQTT', 'state_file', str),
+]
+SCHEMA += [('MQTT', 'note_' + name, str) for name in CHANNEL_NAMES]
+SCHEMA += [
+    ('BME680', 'sea_level_pressure', float),
+    ('BME680', 'temp_corr', float),
+    ('BME680', 'height_at_location', float),
+    ('BME680', 'address', intAuto),
+    ('BME680', 'bus', int),
+    ('BME680', 'backend', parseBackend),
+    ('BME680', 'heater_temperature', parseHeaterTemperature),
+    ('BME680', 'heater_duration', parseHeaterDuration),
+    ('BME680', 'gas_every_n_cycles', int),
+    ('BME680', 'temperature_oversample', parseOversampling),
+    ('BME680', 'humidity_oversample', parseOversampling),
+    ('BME680', 'pressure_oversample', parseOversampling),
+    ('BME680', 'filter_size', parseFilterSize),
+    ('BME680', 'burst_batch', int),
+    ('BME680', 'dump_file', str),
+    ('BME680', 'iaq_burn_in', float),
+    ('BME680', 'iaq_save_interval', float),
+    ('BME680', 'sim_seed', int),
+    ('BME680', 'sim_latency', float),
+    ('BME680', 'sim_noise', float),
+    ('BME680', 'sim_i2c_error_rate', float),
+    ('BME680', 'sim_stuck_rate', float),
+    ('BME680', 'sim_start', float),
+    ('BME680', 'sim_step', float),
+]
+
+# Settings that are not shown in verbose output
+SECRET_KEYS = ('password',)
+
+# A setting as shown in verbose output
+def formatSetting(key, value):
+    if key in SECRET_KEYS:
+        return "***********"
+    if key.startswith('deadband_'):
+        return formatDeadband(value)
+    if 'address' == key:
+        return hex(value)
+    if isinstance(value, (tuple, list)):
+        return ",".join(value)
+    return value
+
+# Values of all settings in SCHEMA from a dictionary of variables (the
+# globals of the script)
+def schemaValues(variables):
+    return dict((key, variables[key]) for section, key, conv in SCHEMA)
+
+# Read all settings in SCHEMA from a ConfigParser. Returns a dictionary
+# with the settings that are present. Values are read raw (no
+# interpolation) so "%" can be used as is. A bad value raises ValueError
+# telling which setting it is.
+def readConfig(config, verbose=False):
+    settings = {}
+    for section, key, conv in SCHEMA:
+        if not config.has_option(section, key):
+            continue
+        try:
+            settings[key] = conv(config.get(section, key, raw=True))
+        except ValueError as e:
+            raise ValueError("[{}] {}: {}".format(section, key, e))
+        if 'bVerbose' == key:
+            verbose = settings[key]
+            if verbose:
+                print('Verbose mode enabled.')
+                print('READING CONFIGURATION')
+                print('---------------------')
+        elif verbose:
+            print(key, "=", formatSetting(key, settings[key]))
+    return settings
+
+# -----------------------------------------------------------------------------
+#                                  C A C H E
+# -----------------------------------------------------------------------------
+
+# Path of the cache file for a configuration file
+def cachePath(cfgpath):
+    return cfgpath + ".cache"
+
+# Something that tells this machine from others (the GUIDs are derived
+# from the MAC address)
+def machineId():
+    try:
+        with open("/etc/machine-id") as f:
+            return f.read().strip()
+    except OSError:
+        return os.uname().nodename if hasattr(os, 'uname') else ""
+
+# The key a cache is valid for. Any change to the configuration file, the
+# script or the package gives a new key.
+def cacheKey(cfgpath, script):
+    cfgstat = os.stat(cfgpath)
+    scriptstat = os.stat(script)
+    sources = []
+    for name in CACHE_MODULES:
+        st = os.stat(os.path.join(PACKAGE_DIR, name + ".py"))
+        sources += [st.st_mtime_ns, st.st_size]
+    return (CACHE_VERSION, sys.version,
+            cfgstat.st_mtime_ns, cfgstat.st_size,
+            scriptstat.st_mtime_ns, scriptstat.st_size,
+            tuple(sources),
+            machineId())
+
+# The cached value for key or None if there is no valid cache
+def loadCache(path, key):
+    try:
+        with open(path, "rb") as f:
+            data = marshal.load(f)
+        if data[0] != key:
+            return None
+        return data[1]
+    except (OSError, EOFError, ValueError, TypeError, IndexError):
+        return None
+
+# Save a value in the cache. The value may only hold the basic types
+# marshal handles. A cache that can't be written is silently skipped.
+def saveCache(path, key, value):
+    tmppath = path + ".tmp"
+    try:
+        with open(tmppath, "wb") as f:
+            marshal.dump((key, value), f)
+        os.replace(tmppath, path)
+    except (OSError, ValueError):
+        try:
+            os.remove(tmppath)
+        except OSError:
+            pass
@@ -0,0 +1,157 @@
+###############################################################################
+# vscp_bme680/deadband.py
+#
+# This file is part of the VSCP (http://www.vscp.org)
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2000-2021 Ake Hedman, Grodans Paradis AB <info@grodansparadis.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Change based publishing. A channel is only published when its value has
+# moved more than the deadband of the channel since it was last published
+# or when it has been silent for max_silence seconds (heartbeat). The last
+# published values are kept in a small JSON file so that one-shot (cron)
+# runs can suppress unchanged values too.
+#
+# A deadband is given as an absolute value in the unit of the channel
+# ("0.1", "20") or as percent of the last published value ("0.5%").
+
+import json
+import os
+
+# Parse a deadband setting. Returns (amount, percent) or None if the
+# setting is empty (always publish).
+def parseDeadband(text):
+    text = text.strip()
+    if not len(text):
+        return None
+    if text.endswith('%'):
+        return (abs(float(text[:-1])), True)
+    return (abs(float(text)), False)
+
+# Deadband as written in the configuration file
+def formatDeadband(deadband):
+    if deadband is None:
+        return ""
+    if deadband[1]:
+        return "{}%".format(deadband[0])
+    return "{}".format(deadband[0])
+
+# Key for a channel in the state file
+def channelKey(ch):
+    return "{}/{}/{}".format(ch.guidstr, ch.sensorindex, ch.name)
+
+class ChangeFilter:
+
+    # path          - State file, empty to only keep the state in memory
+    # max_silence   - Max seconds between publishes of a channel, 0 for no
+    #                 heartbeat
+    # save_interval - Min seconds between writes of the state file
+    def __init__(self, path="", max_silence=900.0, save_interval=60.0):
+        self.path = path
+        self.max_silence = max_silence
+        self.save_interval = save_interval
+        # key -> [value, time]
+        self.last = {}
+        self.dirty = False
+        self.saved = 0.0
+        self.suppressed = 0
+        if len(path):
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                self.last = json.load(f)
+        except FileNotFoundError:
+            self.last = {}
+        except (OSError, ValueError) as e:
+            print("Unable to read state file, starting over:", e)
+            self.last = {}
+
+    # Write the state file if anything has changed
+    def save(self, now=None):
+        if not self.dirty or not len(self.path):
+            return
+        tmppath = self.path + ".tmp"
+        try:
+            # A copy, sensors may add values from their threads
+            with open(tmppath, "w") as f:
+                json.dump(dict(self.last), f)
+            os.replace(tmppath, self.path)
+        except OSError as e:
+            print("Unable to write state file:", e)
+            return
+        self.dirty = False
+        if now is not None:
+            self.saved = now
+
+    # Save if save_interval has passed since the last save
+    def maybeSave(self, now):
+        if now - self.saved >= self.save_interval:
+            self.save(now)
+
+    # Check if a value should be published. value is the value as
+    # published (after formatting), timestamp the time of the reading.
+    def check(self, ch, value, timestamp):
+        if ch.deadband is None:
+            return True
+        last = self.last.get(channelKey(ch))
+        if last is None:
+            return True
+        if self.max_silence > 0 and timestamp - last[1] >= self.max_silence:
+            return True
+        amount, percent = ch.deadband
+        if percent:
+            amount = abs(last[0]) * amount / 100.0
+        # Rounded so a change of exactly the deadband is published
+        if round(abs(value - last[0]), 9) >= amount and value != last[0]:
+            return True
+        self.suppressed += 1
+        return False
+
+    # Record a published value
+    def published(self, ch, value, timestamp):
+        if ch.deadband is None:
+            return
+        self.last[channelKey(ch)] = [value, timestamp]
+        self.dirty = True
+
+    # A counter kept in the state file, the measurement cycles of a sensor
+    # in one-shot mode
+    def counter(self, key):
+        item = self.last.get("counter/" + key)
+        return 0 if item is None else int(item[0])
+
+    def setCounter(self, key, value):
+        if value != self.counter(key):
+            self.last["counter/" + key] = [value, 0]
+            self.dirty = True
+
+    # Other state kept in the state file, the IAQ baseline of a sensor
+    def value(self, key):
+        item = self.last.get("value/" + key)
+        return None if item is None else item[0]
+
+    def setValue(self, key, value, timestamp=0):
+        self.last["value/" + key] = [value, timestamp]
+        self.dirty = True
@@ -0,0 +1,144 @@
+###############################################################################
+# vscp_bme680/derived.py
+#
+# This file is part of the VSCP (http://www.vscp.org)
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2000-2021 Ake Hedman, Grodans Paradis AB <info@grodansparadis.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+
+# Values derived from temperature, humidity and pressure.
+#
+# Every function takes either plain numbers or NumPy arrays (or
+# sequences, which are converted to arrays) and returns the same kind, so
+# the live path (reading.makeReading()) and backfills over a whole
+# history or aggregation window use the same formulas. NumPy is only
+# imported when arrays are passed in.
+#
+#   temperature - Degrees Celsius
+#   humidity    - Relative humidity in percent
+#   pressure    - hPa
+#   height      - Meters above sea level
+
+import math
+
+# Magnus formula constants (over water, -45 - 60 C)
+# https://en.wikipedia.org/wiki/Dew_point#Calculating_the_dew_point
+MAGNUS_A = 6.112        # hPa
+MAGNUS_B = 17.62
+MAGNUS_C = 243.12       # C
+
+# International barometric formula
+# https://en.wikipedia.org/wiki/Barometric_formula
+BARO_HEIGHT = 44330.0   # m
+BARO_EXPONENT = 5.255
+
+# Specific gas constant of water vapour divided into 100 (hPa -> Pa) and
+# multiplied by 1000 (kg -> g), gives g/m3 from hPa/K
+WATER_VAPOUR = 100.0 / 461.5 * 1000.0
+
+ZERO_CELSIUS = 273.15
+
+# Lowest relative humidity used, log(0) is undefined
+MIN_HUMIDITY = 0.01
+
+# Return the module to calculate with (math or numpy) and the values,
+# sequences converted to arrays.
+def _lib(*values):
+    if all(isinstance(v, (int, float)) for v in values):
+        return (math,) + values
+    import numpy as np
+    return (np,) + tuple(np.asarray(v, dtype=np.float64) for v in values)
+
+def _clip(lib, value, low, high):
+    if lib is math:
+        return min(max(value, low), high)
+    return lib.clip(value, low, high)
+
+# Saturation vapour pressure over water in hPa
+def saturationVaporPressure(temperature):
+    lib, temperature = _lib(temperature)
+    return MAGNUS_A * lib.exp(MAGNUS_B * temperature / (MAGNUS_C + temperature))
+
+# Dew point in degrees Celsius. temperature should be the temperature
+# the relative humidity was measured at, i.e. the uncorrected sensor
+# temperature.
+def dewPoint(temperature, humidity):
+    lib, temperature, humidity = _lib(temperature, humidity)
+    gamma = (MAGNUS_B * temperature / (MAGNUS_C + temperature)) + \
+                lib.log(_clip(lib, humidity, MIN_HUMIDITY, 100.0) / 100.0)
+    return (MAGNUS_C * gamma) / (MAGNUS_B - gamma)
+
+# Pressure reduced to sea level in hPa from the pressure measured at
+# height meters
+def seaLevelPressure(pressure, height):
+    lib, pressure, height = _lib(pressure, height)
+    return pressure / (1.0 - height / BARO_HEIGHT) ** BARO_EXPONENT
+
+# Altitude in meters from the measured pressure and the pressure at
+# sea level
+def altitude(pressure, sea_level_pressure=1013.25):
+    lib, pressure, sea_level_pressure = _lib(pressure, sea_level_pressure)
+    return BARO_HEIGHT * (1.0 - (pressure / sea_level_pressure) ** (1.0 / BARO_EXPONENT))
+
+# Partial pressure of the water vapour in hPa
+def vaporPressure(temperature, humidity):
+    lib, temperature, humidity = _lib(temperature, humidity)
+    return saturationVaporPressure(temperature) * _clip(lib, humidity, 0.0, 100.0) / 100.0
+
+# Absolute humidity in g/m3
+def absoluteHumidity(temperature, humidity):
+    lib, temperature, humidity = _lib(temperature, humidity)
+    return WATER_VAPOUR * vaporPressure(temperature, humidity) / (temperature + ZERO_CELSIUS)
+
+# Vapour pressure deficit in hPa, how much more water vapour the air can
+# hold before it is saturated. If the air is at another temperature than
+# where the humidity was measured (the sensor heats itself up) give it as
+# air_temperature, the vapour pressure is the same in both places.
+def vaporPressureDeficit(temperature, humidity, air_temperature=None):
+    if air_temperature is None:
+        air_temperature = temperature
+    lib, temperature, humidity, air_temperature = \
+                _lib(temperature, humidity, air_temperature)
+    deficit = saturationVaporPressure(air_temperature) - \
+                vaporPressure(temperature, humidity)
+    if lib is math:
+        return max(deficit, 0.0)
+    return lib.maximum(deficit, 0.0)
+
+# All derived values at once, as a dictionary. temperature is the
+# uncorrected sensor temperature, the one the relative humidity is
+# measured at. The vapour pressure deficit is for the air around the
+# sensor, at the temperature with temp_corr subtracted.
+def derive(temperature, humidity, pressure,
+           temp_corr=0.0,
+           height_at_location=0.0,
+           sea_level_pressure=1013.25):
+    return {
+        'dewpoint': dewPoint(temperature, humidity),
+        'pressure_adj': seaLevelPressure(pressure, height_at_location),
+        'altitude': altitude(pressure, sea_level_pressure),
+        'absolute_humidity': absoluteHumidity(temperature, humidity),
+        'vpd': vaporPressureDeficit(temperature, humidity,
+                                    _lib(temperature)[1] - temp_corr),
+    }
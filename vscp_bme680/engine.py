@@ -0,0 +1,561 @@
+###############################################################################
+# vscp_bme680/engine.py
+#
+# This file is part of the VSCP (http://www.vscp.org)
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2000-2021 Ake Hedman, Grodans Paradis AB <info@grodansparadis.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# asyncio based acquisition and publishing engine used in daemon mode.
+# Sensor conversions run in an executor, events are handed to the paho
+# client without waiting and broker confirmations are collected as
+# futures, so sensor conversion time, encoding and network I/O overlap.
+
+import asyncio
+import concurrent.futures
+import time
+
+from vscp_bme680.publisher import clientPublish, messageState
+
+# Publish on top of a paho client (loop started) with confirmations
+# delivered as asyncio futures.
+class AsyncPublisher:
+
+    # See Publisher for the arguments
+    def __init__(self, client, qos=0, max_inflight=20, retain=False, outbox=None,
+                 metrics=None):
+        self.client = client
+        self.qos = qos
+        self.max_inflight = max(1, max_inflight)
+        self.retain = retain
+        self.outbox = outbox
+        self.metrics = metrics
+        self.loop = None
+        self.window = None
+        # mid -> (future, topic, payload, timestamp, store, qos, replayed)
+        self.futures = {}
+        # mid -> (topic, payload, timestamp, store, qos) of QoS 1/2 messages
+        # that timed out but are still queued by paho
+        self.queued = {}
+        # mid -> time the message was handed to the client
+        self.sent_at = {}
+
+        # Statistics since start
+        self.sent = 0
+        self.confirmed = 0
+        self.failed = 0
+        self.stored = 0
+
+        client.max_inflight_messages_set(self.max_inflight)
+        client.on_publish = self._onPublish
+
+    # Called from the paho network thread
+    def _onPublish(self, client, userdata, mid, *args):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._confirm, mid)
+
+    def _confirm(self, mid):
+        item = self.futures.pop(mid, None)
+        start = self.sent_at.pop(mid, None)
+        if item is not None and not item[0].done():
+            item[0].set_result(True)
+            self.confirmed += 1
+            if start is not None:
+                self.metrics.observe('publish_latency_seconds', time.perf_counter() - start)
+        elif self.queued.pop(mid, None) is not None:
+            self.confirmed += 1
+
+    def _store(self, topic, payload, timestamp, store, qos):
+        if store and self.outbox is not None:
+            self.outbox.put(topic, payload, timestamp, qos)
+            self.stored += 1
+
+    # Publish a message. Returns a future that is set to True when the
+    # broker has confirmed the message, to False when a QoS 1/2 message
+    # timed out and is left to paho, and None if the message was stored in
+    # the outbox or failed. Only waits if the in-flight window is full. qos overrides
+    # the QoS of the publisher (for events replayed from the outbox).
+    # replayed is set for an event from the outbox, it is stored again if
+    # it is left to paho and still not confirmed at shutdown.
+    async def publish(self, topic, payload, timestamp=None, store=True, timeout=5.0,
+                      qos=None, replayed=False):
+        if qos is None:
+            qos = self.qos
+        if self.window is None:
+            self.loop = asyncio.get_event_loop()
+            self.window = asyncio.Semaphore(self.max_inflight)
+
+        if self.outbox is not None and not self.client.is_connected():
+            self._store(topic, payload, timestamp, store, qos)
+            return None
+
+        try:
+            await asyncio.wait_for(self.window.acquire(), timeout)
+        except asyncio.TimeoutError:
+            self.failed += 1
+            self._store(topic, payload, timestamp, store, qos)
+            return None
+
+        future = self.loop.create_future()
+        future.add_done_callback(lambda f: self.window.release())
+        info = clientPublish(self.client, topic, payload, qos, self.retain)
+        self.sent += 1
+        if messageState(info) is None:
+            future.cancel()
+            self.failed += 1
+            self._store(topic, payload, timestamp, store, qos)
+            return None
+        self.futures[info.mid] = (future, topic, payload, timestamp, store, qos, replayed)
+        if self.metrics is not None:
+            self.sent_at[info.mid] = time.perf_counter()
+        return future
+
+    # Number of messages not yet confirmed
+    def inflight(self):
+        return len(self.futures)
+
+    # Wait for the futures of published messages. Messages not confirmed
+    # within timeout are given up, see _expire(). Returns the number of
+    # confirmed messages.
+    async def confirm(self, futures, timeout=5.0):
+        futures = [f for f in futures if f is not None]
+        if not len(futures):
+            return 0
+        done, pending = await asyncio.wait(futures, timeout=timeout)
+        if len(pending):
+            self._expire(pending)
+        return len([f for f in done if not f.cancelled()])
+
+    # Stop waiting for messages. A QoS 0 message is lost and stored in the
+    # outbox. A QoS 1/2 message is still queued by paho, which sends it
+    # again after a reconnect, so it is left to paho and not stored (the
+    # replay would deliver it a second time).
+    def _expire(self, futures):
+        for mid, item in list(self.futures.items()):
+            if item[0] in futures:
+                del self.futures[mid]
+                self.sent_at.pop(mid, None)
+                future, topic, payload, timestamp, store, qos, replayed = item
+                if qos:
+                    self.queued[mid] = (topic, payload, timestamp, store or replayed, qos)
+                    future.set_result(False)
+                else:
+                    future.cancel()
+                    self.failed += 1
+                    self._store(topic, payload, timestamp, store, qos)
+
+    # Give up all unconfirmed messages before the client is stopped. paho
+    # drops its queue then, so messages left to it are stored in the outbox
+    # as well.
+    def abandon(self):
+        for item in self.futures.values():
+            self.failed += 1
+            item[0].cancel()
+            self._store(*item[1:6])
+        self.futures = {}
+        for item in self.queued.values():
+            self.failed += 1
+            self._store(*item)
+        self.queued = {}
+        self.sent_at = {}
+
+# A sensor handled by the engine
+#   name     - Name used in messages
+#   read     - Blocking function returning a Reading
+#   channels - Compiled channel templates for the sensor
+#   aggregator - Aggregator for windowed statistics (or None to publish
+#                every reading)
+#   bundle   - Bundle to send the values of a cycle in one message (or None)
+#   channel_topics - Publish on the channel topics also when bundling
+#   batch    - read returns a list of readings (burst mode)
+#   rollups  - Rollups for the query service (or None)
+class SensorTask:
+
+    def __init__(self, name, read, channels, aggregator=None, bundle=None,
+                 channel_topics=True, batch=False, rollups=None):
+        self.name = name
+        self.read = read
+        self.batch = batch
+        self.channels = channels
+        self.aggregator = aggregator
+        # Setting, the channel topics are always used without a bundle
+        self.bundle_channel_topics = channel_topics
+        self._setBundle(bundle)
+        self.rollups = rollups
+        # (channels, bundle) waiting to be used from the next cycle
+        self.pending = None
+
+    def _setBundle(self, bundle):
+        self.bundle = bundle
+        self.channel_topics = self.bundle_channel_topics or bundle is None
+
+    # Use new channels and bundle from the next cycle (on a configuration
+    # reload), so a cycle never mixes old and new settings. bundle is None
+    # to stop bundling.
+    def update(self, channels, bundle):
+        self.pending = (channels, bundle)
+
+    def _applyPending(self):
+        channels, bundle = self.pending
+        self.pending = None
+        self.channels = channels
+        if self.aggregator is not None:
+            self.aggregator.setChannels(channels)
+        self._setBundle(bundle)
+
+class Engine:
+
+    # publisher     - AsyncPublisher
+    # interval      - Seconds between measurement cycles
+    # flush_timeout - Max seconds to wait for the confirmation of events
+    # replayer      - Replayer for stored events (or None)
+    # executor      - Executor for sensor reads (a thread pool by default)
+    # metrics       - Metrics for the stage timers (or None)
+    # reporter      - MetricsReporter for the status message (or None)
+    # status_interval - Seconds between status messages
+    # changes       - ChangeFilter for deadband publishing (or None)
+    # reloader      - ConfigReloader that watches the configuration file (or
+    #                 None)
+    # query_listen  - Where the query service listens (see query.py), empty
+    #                 for no query service
+    def __init__(self, publisher, interval=60.0, flush_timeout=5.0,
+                 replayer=None, executor=None, verbose=False,
+                 metrics=None, reporter=None, status_interval=60.0,
+                 changes=None, reloader=None, query_listen=""):
+        self.publisher = publisher
+        self.interval = interval
+        self.flush_timeout = flush_timeout
+        self.replayer = replayer
+        self.executor = executor
+        self.verbose = verbose
+        self.metrics = metrics
+        self.reporter = reporter
+        self.status_interval = status_interval
+        self.changes = changes
+        self.reloader = reloader
+        self.query_listen = query_listen
+        self.query = None
+        self.sensors = []
+        self.tasks = set()
+        self.stopping = False
+        self.stop_event = None
+        self.cycles = 0
+
+    def addSensor(self, name, read, channels, aggregator=None, bundle=None,
+                  channel_topics=True, batch=False, rollups=None):
+        sensor = SensorTask(name, read, channels, aggregator, bundle, channel_topics, batch,
+                            rollups)
+        self.sensors.append(sensor)
+        return sensor
+
+    def findSensor(self, name):
+        for sensor in self.sensors:
+            if sensor.name == name:
+                return sensor
+        return None
+
+    # Stop the engine (safe to call from a signal handler)
+    def stop(self):
+        self.stopping = True
+        if self.stop_event is not None:
+            self.stop_event.set()
+
+    # Sleep that is cut short by stop()
+    async def _sleep(self, delay):
+        try:
+            await asyncio.wait_for(self.stop_event.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+
+    def _spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    # Record values (channel, value) in the change filter when the message
+    # that holds them is confirmed or sure to be delivered later (stored in
+    # the outbox or left to paho). A lost value must not hold back the
+    # values after it.
+    def _recordChanges(self, changed, timestamp, future):
+        if not len(changed):
+            return
+
+        def record(f=None):
+            if f is None or not f.cancelled() or self.publisher.outbox is not None:
+                for ch, value in changed:
+                    self.changes.published(ch, value, timestamp)
+
+        if future is not None:
+            future.add_done_callback(record)
+        elif self.publisher.outbox is not None:
+            record()
+
+    # Encode and publish one channel (and add it to the bundle). Values
+    # that go out with the bundle only are added to bundled for the change
+    # filter.
+    async def channelStage(self, ch, reading, sensor=None, bundled=None):
+        value = getattr(reading, ch.name)
+        # Gas (and with it the IAQ index) is not measured in every cycle
+        if value is None:
+            return None
+        if self.verbose:
+            print(ch.label, ch.format(value), ch.unitname)
+        if not len(ch.topic):
+            return None
+        changed = []
+        if self.changes is not None:
+            if not self.changes.check(ch, ch.value(value), reading.timestamp):
+                return None
+            changed = [(ch, ch.value(value))]
+        if sensor is not None and sensor.bundle is not None:
+            sensor.bundle.add(ch, value)
+            if not sensor.channel_topics:
+                if bundled is not None:
+                    bundled.extend(changed)
+                return None
+        if self.metrics is None:
+            payload = ch.encode(value, reading.timestamp)
+        else:
+            start = time.perf_counter()
+            payload = ch.encode(value, reading.timestamp)
+            self.metrics.observe('encode_seconds', time.perf_counter() - start)
+        future = await self.publisher.publish(ch.topic,
+                                              payload,
+                                              reading.timestamp,
+                                              timeout=self.flush_timeout)
+        self._recordChanges(changed, reading.timestamp, future)
+        return future
+
+    # Publish the statistics of a window. A channel with a deadband is
+    # judged on its mean, if that is suppressed so are the other
+    # statistics of the channel.
+    async def aggregateStage(self, sensor, timestamp):
+        suppressed = set()
+        futures = []
+        bundled = []
+        bundle = sensor.bundle
+        if bundle is not None:
+            bundle.begin(timestamp)
+        for ch, stat, topic, value, samples in sensor.aggregator.flush():
+            if self.verbose:
+                print(ch.label, stat, ch.format(value), ch.unitname)
+            if not len(topic) or ch.name in suppressed:
+                continue
+            changed = []
+            if self.changes is not None and 'mean' == stat:
+                if not self.changes.check(ch, ch.value(value), timestamp):
+                    suppressed.add(ch.name)
+                    continue
+                changed = [(ch, ch.value(value))]
+            if bundle is not None:
+                bundle.add(ch, value, stat, samples)
+                if not sensor.channel_topics:
+                    bundled.extend(changed)
+                    continue
+            future = await self.publisher.publish(topic,
+                                                  ch.encodeStat(value, timestamp, stat, samples),
+                                                  timestamp,
+                                                  timeout=self.flush_timeout)
+            self._recordChanges(changed, timestamp, future)
+            futures.append(future)
+        if bundle is not None:
+            future = await self.bundleStage(sensor)
+            self._recordChanges(bundled, timestamp, future)
+            futures.append(future)
+        return futures
+
+    # Publish the bundle of a cycle (if anything was added to it)
+    async def bundleStage(self, sensor):
+        bundle = sensor.bundle
+        if not len(bundle):
+            return None
+        if self.metrics is None:
+            payload = bundle.payload()
+        else:
+            start = time.perf_counter()
+            payload = bundle.payload()
+            self.metrics.observe('bundle_encode_seconds', time.perf_counter() - start)
+        return await self.publisher.publish(bundle.topic,
+                                            payload,
+                                            bundle.timestamp,
+                                            timeout=self.flush_timeout)
+
+    # Wait for the broker to confirm the events of a cycle
+    async def confirmStage(self, sensor, futures):
+        confirmed = await self.publisher.confirm(futures, self.flush_timeout)
+        if self.verbose:
+            print(sensor.name + ": confirmed", confirmed, "of",
+                  len([f for f in futures if f is not None]), "events")
+
+    # One measurement cycle for a sensor. Returns when all events have been
+    # handed to the client, confirmations are waited for in the background.
+    async def cycle(self, sensor):
+        loop = asyncio.get_event_loop()
+        start = time.perf_counter()
+        if sensor.pending is not None:
+            sensor._applyPending()
+        if sensor.batch:
+            readings = await loop.run_in_executor(self.executor, sensor.read)
+        else:
+            readings = [await loop.run_in_executor(self.executor, sensor.read)]
+        for reading in readings:
+            await self.readingStage(sensor, reading)
+        self.cycles += 1
+        if self.changes is not None and len(readings):
+            self.changes.maybeSave(readings[-1].timestamp)
+        if self.metrics is not None:
+            self.metrics.observe('cycle_seconds', time.perf_counter() - start)
+            self.metrics.inc('cycles_total')
+        return readings[-1] if len(readings) else None
+
+    # Publish a reading (or add it to the aggregation window)
+    async def readingStage(self, sensor, reading):
+        if sensor.rollups is not None:
+            sensor.rollups.add(reading)
+        if sensor.aggregator is None:
+            bundled = []
+            if sensor.bundle is not None:
+                sensor.bundle.begin(reading.timestamp)
+            futures = await asyncio.gather(*[self.channelStage(ch, reading, sensor, bundled)
+                                             for ch in sensor.channels])
+            if sensor.bundle is not None:
+                future = await self.bundleStage(sensor)
+                self._recordChanges(bundled, reading.timestamp, future)
+                futures.append(future)
+            self._spawn(self.confirmStage(sensor, futures))
+        elif sensor.aggregator.add(reading):
+            futures = await self.aggregateStage(sensor, reading.timestamp)
+            self._spawn(self.confirmStage(sensor, futures))
+
+    async def sensorLoop(self, sensor, cycles=None):
+        loop = asyncio.get_event_loop()
+        next_cycle = loop.time()
+        count = 0
+        while not self.stopping:
+            try:
+                await self.cycle(sensor)
+            except (OSError, RuntimeError, ValueError) as e:
+                # A failed read/publish should not take down the engine
+                print("Measurement cycle failed for " + sensor.name + ":", e)
+                if self.metrics is not None:
+                    self.metrics.inc('cycle_errors_total')
+            count += 1
+            if cycles is not None and count >= cycles:
+                break
+
+            # Keep a fixed rate, skip cycles we are too late for
+            next_cycle += self.interval
+            delay = next_cycle - loop.time()
+            if delay > 0:
+                await self._sleep(delay)
+            else:
+                next_cycle = loop.time()
+
+    # Send stored events at the rate the replayer allows. Waits only as
+    # long as the rate requires between batches, and a measurement interval
+    # when nothing is stored.
+    async def replayLoop(self):
+        while not self.stopping:
+            sent = []
+            for id, ts, topic, payload, qos in self.replayer.take():
+                future = await self.publisher.publish(topic, payload, ts, store=False,
+                                                      timeout=self.flush_timeout, qos=qos,
+                                                      replayed=True)
+                if future is None:
+                    break
+                sent.append((id, future))
+            if len(sent):
+                await self.publisher.confirm([f for id, f in sent], self.flush_timeout)
+                # Confirmed or left to paho (QoS 1/2), either way no longer
+                # for the outbox
+                delivered = [id for id, f in sent if f.done() and not f.cancelled()]
+                self.replayer.done(len(sent), delivered)
+                if self.verbose:
+                    print("Replayed", len(delivered), "stored events,",
+                          self.replayer.outbox.count, "left")
+            delay = self.replayer.delay()
+            await self._sleep(self.interval if delay is None else delay)
+
+    # Publish the status message and write the metrics file
+    async def statusLoop(self):
+        while not self.stopping:
+            await self._sleep(self.status_interval)
+            if len(self.reporter.topic):
+                await self.publisher.publish(self.reporter.topic,
+                                             self.reporter.payload(),
+                                             store=False,
+                                             timeout=self.flush_timeout)
+            self.reporter.write()
+
+    # Reload the configuration when the file has been modified
+    async def reloadLoop(self):
+        while not self.stopping:
+            await self._sleep(self.reloader.interval)
+            if not self.stopping and self.reloader.changed():
+                if self.verbose:
+                    print("Configuration file changed, reloading")
+                self.reloader.reload()
+
+    # Run until stop() is called (or all sensors have done cycles cycles)
+    async def run(self, cycles=None):
+        self.stop_event = asyncio.Event()
+        if self.stopping:
+            self.stop_event.set()
+        if self.executor is None:
+            self.executor = concurrent.futures.ThreadPoolExecutor(max(1, len(self.sensors)))
+
+        if self.replayer is not None:
+            self._spawn(self.replayLoop())
+
+        if self.reporter is not None:
+            self._spawn(self.statusLoop())
+
+        if self.reloader is not None and self.reloader.interval > 0:
+            self._spawn(self.reloadLoop())
+
+        if len(self.query_listen):
+            from vscp_bme680.query import QueryServer
+            self.query = QueryServer(self, self.query_listen)
+            try:
+                await self.query.start()
+            except OSError as e:
+                print("Unable to start the query service on " + self.query_listen + ":", e)
+                self.query = None
+
+        await asyncio.gather(*[self.sensorLoop(sensor, cycles) for sensor in self.sensors])
+
+        # Publish what there is of the current windows
+        for sensor in self.sensors:
+            if sensor.aggregator is not None and sensor.aggregator.pending():
+                futures = await self.aggregateStage(sensor, sensor.aggregator.last)
+                self._spawn(self.confirmStage(sensor, futures))
+
+        if self.query is not None:
+            await self.query.stop()
+
+        # Let outstanding confirmations finish before returning
+        self.stop()
+        if len(self.tasks):
+            await asyncio.wait(list(self.tasks))
+        self.publisher.abandon()
@@ -0,0 +1,289 @@
+###############################################################################
+# vscp_bme680/events.py
+#
+# This file is part of the VSCP (http://www.vscp.org)
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2000-2021 Ake Hedman, Grodans Paradis AB <info@grodansparadis.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Precompiled VSCP events for the measurement channels. Everything that
+# does not change between measurement cycles (GUID, header, class/type,
+# topic and the JSON envelope) is resolved once at startup so a cycle only
+# has to fill in the measured value.
+#
+# The value can be coded in three ways (encoding)
+#
+#   string - CLASS2.MEASUREMENT_STR, the value as a string (default)
+#   float  - CLASS2.MEASUREMENT_FLOAT, the value as an IEEE double
+#   level1 - CLASS1.MEASUREMENT, the value as a normalized integer. Level I
+#            events have no zone/subzone and sensor index is 0-7.
+
+import collections
+import json
+import struct
+
+# VSCP constants used here, the same values as in the vscp, vscp_class and
+# vscp_type modules. Those are large and slow to import on small boards so
+# vscp is only imported when a GUID has to be resolved.
+VSCP_PRIORITY_NORMAL = 0x60
+VSCP_HEADER16_DUMB = 0x8000
+VSCP_DATACODING_NORMALIZED = 0x80
+
+VSCP_CLASS1_MEASUREMENT = 10
+VSCP_CLASS2_MEASUREMENT_STR = 1040
+VSCP_CLASS2_MEASUREMENT_FLOAT = 1060
+
+VSCP_TYPE_MEASUREMENT_GENERAL = 0
+VSCP_TYPE_MEASUREMENT_TEMPERATURE = 6
+VSCP_TYPE_MEASUREMENT_PRESSURE = 12
+VSCP_TYPE_MEASUREMENT_ELECTRICAL_RESISTANCE = 18
+VSCP_TYPE_MEASUREMENT_HUMIDITY = 35
+VSCP_TYPE_MEASUREMENT_DEWPOINT = 49
+VSCP_TYPE_MEASUREMENT_ALTITUDE = 51
+
+# Static description of a measurement channel
+#   name     - Channel name, also the Reading field and config key suffix
+#   vscptype - VSCP measurement type
+#   unit     - VSCP unit code
+#   fmt      - Format used for the string coded value
+#   decimals - Decimals kept in the float and level1 codings
+#   vtype    - Type of the JSON measurement value
+#   label    - Label for verbose output
+#   unitname - Unit for verbose output
+ChannelDef = collections.namedtuple('ChannelDef',
+    ['name', 'vscptype', 'unit', 'fmt', 'decimals', 'vtype', 'label', 'unitname'])
+
+CHANNELS = (
+    ChannelDef('temperature', VSCP_TYPE_MEASUREMENT_TEMPERATURE, 1, "{:0.1f}", 1, float, "Temperature:", "C"),
+    ChannelDef('humidity', VSCP_TYPE_MEASUREMENT_HUMIDITY, 0, "{:0.1f}", 1, float, "Humidity:", "%"),
+    ChannelDef('pressure', VSCP_TYPE_MEASUREMENT_PRESSURE, 0, "{:0.0f}", 0, float, "Pressure:", "Pa"),
+    ChannelDef('pressure_adj', VSCP_TYPE_MEASUREMENT_PRESSURE, 0, "{:0.0f}", 0, float, "Relative pressure:", "Pa"),
+    ChannelDef('gas', VSCP_TYPE_MEASUREMENT_ELECTRICAL_RESISTANCE, 0, "{:d}", 0, int, "Gas:", "Ohm"),
+    ChannelDef('altitude', VSCP_TYPE_MEASUREMENT_ALTITUDE, 0, "{:0.0f}", 0, float, "Altitude", "meter"),
+    ChannelDef('dewpoint', VSCP_TYPE_MEASUREMENT_DEWPOINT, 1, "{:0.1f}", 1, float, "Dew point", "C"),
+    ChannelDef('iaq', VSCP_TYPE_MEASUREMENT_GENERAL, 0, "{:0.0f}", 0, float, "IAQ:", ""),
+)
+
+CHANNEL_NAMES = tuple(ch.name for ch in CHANNELS)
+
+ENCODINGS = ('string', 'float', 'level1')
+
+# VSCP class used for each encoding
+ENCODING_CLASS = {
+    'string': VSCP_CLASS2_MEASUREMENT_STR,
+    'float': VSCP_CLASS2_MEASUREMENT_FLOAT,
+    'level1': VSCP_CLASS1_MEASUREMENT,
+}
+
+# Check an encoding setting
+def parseEncoding(text):
+    encoding = text.strip().lower()
+    if encoding not in ENCODINGS:
+        raise ValueError("Unknown encoding: " + text)
+    return encoding
+
+# Big endian two's complement bytes for a Level I normalized integer, as
+# few bytes as possible (max 6 bytes fit in a Level I event)
+def normalizedBytes(mantissa):
+    n = 1
+    while n < 6 and not -(1 << (8 * n - 1)) <= mantissa < (1 << (8 * n - 1)):
+        n += 1
+    return list(mantissa.to_bytes(n, 'big', signed=True))
+
+# Resolve the GUID for a channel. A configured GUID is used as is,
+# otherwise it is built from the MAC address with the id in the two LSB's.
+# Returns the GUID as a string on the "FF:FF:...:00" form.
+def resolveGuid(guid, id):
+    import vscp
+    g = vscp.guid()
+    if ("" != guid):
+        g.setFromString(guid)
+    else :
+        g.setGUIDFromMAC(id)
+    return g.getAsString()
+
+# Resolve the GUIDs for all channels of a sensor (see compileChannels),
+# returns a dictionary with the GUID string for every channel
+def resolveGuids(cfg):
+    guids = {}
+    for name in CHANNEL_NAMES:
+        guids[name] = resolveGuid(cfg['guid'], cfg['id_' + name])
+    return guids
+
+# A compiled measurement channel
+class ChannelTemplate:
+
+    def __init__(self, chdef, guidstr, sensorindex, zone, subzone, note, topic,
+                 deadband=None, encoding='string'):
+        self.name = chdef.name
+        self.fmt = chdef.fmt
+        self.decimals = chdef.decimals
+        self.vtype = chdef.vtype
+        self.label = chdef.label
+        self.unitname = chdef.unitname
+        self.unit = chdef.unit
+        self.sensorindex = sensorindex
+        self.zone = zone
+        self.subzone = subzone
+        self.note = note
+        # (amount, percent) or None to publish every value
+        self.deadband = deadband
+
+        # Dumb node, priority normal
+        self.head = VSCP_PRIORITY_NORMAL | VSCP_HEADER16_DUMB
+        self.encoding = encoding
+        self.vscpclass = ENCODING_CLASS[encoding]
+        self.vscptype = chdef.vscptype
+        self.guid = bytes.fromhex(guidstr.replace(':', ''))
+        self.guidstr = guidstr
+
+        # An empty topic means the channel should not be published
+        self.topic = topic.format(xguid=self.guidstr,
+                                  xclass=self.vscpclass,
+                                  xtype=self.vscptype)
+
+        # Level II data starts with sensor index, zone, subzone and unit,
+        # Level I data with the data coding byte
+        if 'level1' == encoding:
+            self.predata = [VSCP_DATACODING_NORMALIZED |
+                            ((chdef.unit & 3) << 3) |
+                            (sensorindex & 7)]
+            # Exponent byte, bit 7 set moves the decimal point left
+            self.exponent = (0x80 | self.decimals) if self.decimals else 0
+            self._data = self._level1Data
+        elif 'float' == encoding:
+            self.predata = [sensorindex, zone, subzone, chdef.unit]
+            self._data = self._floatData
+        else:
+            self.predata = [sensorindex, zone, subzone, chdef.unit]
+            self._data = self._stringData
+        self.scale = 10 ** self.decimals
+
+        # JSON envelope, same layout as vscpEventEx.toJSON()
+        self.skeleton = {
+            "vscpHead": self.head,
+            "vscpObId": 0,
+            "vscpTimestampns": 0,
+            "vscpClass": self.vscpclass,
+            "vscpType": self.vscptype,
+            "vscpGuid": self.guidstr,
+            "vscpData": [],
+            "vscpNote": note,
+            "measurement": None
+        }
+        self.measurement = {
+            "value": 0,
+            "unit": chdef.unit,
+            "sensorindex": (sensorindex & 7) if 'level1' == encoding else sensorindex,
+            "zone": zone,
+            "subzone": subzone
+        }
+
+    # String coded value as published
+    def format(self, value):
+        return self.fmt.format(value)
+
+    # Value as published (rounded as the coded value)
+    def value(self, value):
+        if 'string' == self.encoding:
+            return self.vtype(self.fmt.format(value))
+        if self.vtype is int:
+            return int(round(value))
+        return round(value, self.decimals)
+
+    # Event data and JSON value for the string coding
+    def _stringData(self, value):
+        text = self.fmt.format(value)
+        # Value as string + terminating zero
+        return self.predata + list(text.encode()) + [0], self.vtype(text)
+
+    # Event data and JSON value for the float coding
+    def _floatData(self, value):
+        if self.vtype is int:
+            value = int(round(value))
+        else:
+            value = round(value, self.decimals)
+        # IEEE double, MSB first
+        return self.predata + list(struct.pack('>d', value)), value
+
+    # Event data and JSON value for the normalized integer coding
+    def _level1Data(self, value):
+        mantissa = int(round(value * self.scale))
+        if self.vtype is int:
+            value = mantissa
+        else:
+            value = mantissa / self.scale
+        return self.predata + [self.exponent] + normalizedBytes(mantissa), value
+
+    # Fill in the measured value, returns the event as a JSON object
+    def fill(self, value, timestamp):
+        data, value = self._data(value)
+        j = self.skeleton.copy()
+        # Same resolution as the VSCP event, microseconds
+        j["vscpTimestampns"] = int(timestamp * 1000000) * 1000
+        j["vscpData"] = data
+        m = self.measurement.copy()
+        m["value"] = value
+        j["measurement"] = m
+        return j
+
+    # Fill in the measured value, returns the JSON payload for publishing
+    def encode(self, value, timestamp):
+        return json.dumps(self.fill(value, timestamp))
+
+    # Fill in an aggregated value. The statistic (mean, min, ...) and the
+    # number of samples (unless None) are added to the measurement block.
+    def fillStat(self, value, timestamp, stat, samples=None):
+        j = self.fill(value, timestamp)
+        j["measurement"]["stat"] = stat
+        if samples is not None:
+            j["measurement"]["samples"] = samples
+        return j
+
+    def encodeStat(self, value, timestamp, stat, samples=None):
+        return json.dumps(self.fillStat(value, timestamp, stat, samples))
+
+# Compile a channel from its configuration
+def compileChannel(name, guid, id, sensorindex, zone, subzone, note, topic,
+                   deadband=None, encoding='string'):
+    chdef = CHANNELS[CHANNEL_NAMES.index(name)]
+    return ChannelTemplate(chdef, resolveGuid(guid, id), sensorindex,
+                           zone, subzone, note, topic, deadband, encoding)
+
+# Compile all channels from a dictionary holding the guid, zone, subzone,
+# encoding and id_*, sensorindex_*, note_*, topic_* and deadband_*
+# settings for every channel. If the dictionary holds the resolved GUIDs
+# (guids, from resolveGuids()) they are used as they are.
+def compileChannels(cfg):
+    guids = cfg.get('guids')
+    if guids is None:
+        guids = resolveGuids(cfg)
+    return [ChannelTemplate(chdef,
+                            guids[chdef.name],
+                            cfg['sensorindex_' + chdef.name],
+                            cfg['zone'],
+                            cfg['subzone'],
+                            cfg['note_' + chdef.name],
+                            cfg['topic_' + chdef.name],
+                            cfg['deadband_' + chdef.name],
+                            cfg['encoding']) for chdef in CHANNELS]
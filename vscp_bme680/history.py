@@ -0,0 +1,211 @@
+###############################################################################
+# vscp_bme680/history.py
+#
+# This file is part of the VSCP (http://www.vscp.org)
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2000-2021 Ake Hedman, Grodans Paradis AB <info@grodansparadis.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+
+# Local history of the readings of a sensor in fixed size ring files.
+#
+# Every column (the timestamp and each channel) is a file of capacity
+# doubles that is memory mapped, plus a small head file with the number
+# of readings ever appended. Appending a reading writes one double to
+# each column and then the count, there are no Python objects kept per
+# reading and nothing is ever moved, so an append is O(1) and the files
+# never grow. When the ring is full the oldest reading is overwritten.
+# The pages are written back by the kernel, only the pages the appends
+# touched are written (with the usual writeback interval that is a few
+# pages per column a minute), which keeps the wear of an SD card low.
+#
+# Values that were not measured (gas in cycles without gas, the IAQ
+# index during burn-in) are stored as NaN. A time range is found with a
+# binary search over the timestamps and is returned as views into the
+# mapped files, without copying.
+#
+# The files are
+#
+#   <directory>/head          - magic, version, capacity, count
+#   <directory>/<column>.f64  - capacity doubles, native byte order
+
+import mmap
+import os
+import struct
+
+from vscp_bme680.events import CHANNEL_NAMES
+
+MAGIC = b"BMEH"
+VERSION = 1
+
+# magic, version, capacity, count
+HEADER = struct.Struct("<4sIQQ")
+COUNT = struct.Struct("<Q")
+COUNT_OFFSET = 16
+
+COLUMNS = ('timestamp',) + CHANNEL_NAMES
+
+# A year of readings taken once a minute, about 38 MB
+DEFAULT_CAPACITY = 525600
+
+NAN = float('nan')
+
+# Map a file of size bytes, created (or resized) if it is writable
+def _mapFile(path, size, readonly):
+    if readonly:
+        fd = os.open(path, os.O_RDONLY)
+    else:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if not readonly and os.fstat(fd).st_size != size:
+            os.ftruncate(fd, size)
+        return mmap.mmap(fd, size,
+                         access=mmap.ACCESS_READ if readonly else mmap.ACCESS_WRITE)
+    finally:
+        os.close(fd)
+
+class HistoryStore:
+
+    # directory - Directory with the ring files of one sensor
+    # capacity  - Number of readings kept when the store is created, an
+    #             existing store keeps its capacity
+    # readonly  - Open an existing store for reading only, it can be
+    #             written by another process at the same time
+    def __init__(self, directory, capacity=DEFAULT_CAPACITY, readonly=False):
+        self.directory = directory
+        self.readonly = readonly
+        if not readonly:
+            os.makedirs(directory, exist_ok=True)
+        self.head = _mapFile(os.path.join(directory, "head"), HEADER.size, readonly)
+        magic, version, stored, count = HEADER.unpack_from(self.head)
+        if MAGIC == magic:
+            if VERSION != version:
+                raise ValueError("Unknown history version {} in {}".format(version, directory))
+            capacity = stored
+        elif readonly:
+            raise ValueError("No history in " + directory)
+        else:
+            if capacity < 1:
+                raise ValueError("History capacity must be at least 1")
+            count = 0
+            HEADER.pack_into(self.head, 0, MAGIC, VERSION, capacity, count)
+        self.capacity = capacity
+        self.count = count
+        self.maps = {}
+        self.columns = {}
+        for name in COLUMNS:
+            path = os.path.join(directory, name + ".f64")
+            if readonly and not os.path.exists(path):
+                continue
+            self.maps[name] = _mapFile(path, capacity * 8, readonly)
+            self.columns[name] = memoryview(self.maps[name]).cast('d')
+
+    # Number of readings in the store
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    # Add a reading (see reading.py)
+    def append(self, reading):
+        i = self.count % self.capacity
+        for name, column in self.columns.items():
+            value = getattr(reading, name)
+            column[i] = NAN if value is None else value
+        # The count last, a reader never sees a half written reading
+        self.count += 1
+        COUNT.pack_into(self.head, COUNT_OFFSET, self.count)
+
+    # Read the count again, for a reader while the store is written
+    def refresh(self):
+        self.count = COUNT.unpack_from(self.head, COUNT_OFFSET)[0]
+        return self.count
+
+    # First reading (as a count, not a position in the files) with a
+    # timestamp at or after t, between lo and hi
+    def _search(self, t, lo, hi):
+        timestamps = self.columns['timestamp']
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if timestamps[mid % self.capacity] < t:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    # The readings with start <= timestamp < end (None for no limit), as a
+    # list of one or, if the range wraps around the end of the ring, two
+    # segments. A segment is a dictionary with a memoryview of doubles for
+    # each column, views into the files that are valid until close().
+    def segments(self, start=None, end=None):
+        if self.readonly:
+            self.refresh()
+        count = self.count
+        first = count - min(count, self.capacity)
+        lo = first if start is None else self._search(start, first, count)
+        hi = count if end is None else self._search(end, lo, count)
+        if lo >= hi:
+            return []
+        begin = lo % self.capacity
+        n = hi - lo
+        if begin + n <= self.capacity:
+            ranges = [(begin, begin + n)]
+        else:
+            ranges = [(begin, self.capacity), (0, begin + n - self.capacity)]
+        return [dict((name, column[a:b]) for name, column in self.columns.items())
+                for a, b in ranges]
+
+    # The readings with start <= timestamp < end as a dictionary with a
+    # NumPy array for each column. The arrays are views into the files,
+    # only a range that wraps around the end of the ring is copied.
+    def read(self, start=None, end=None):
+        import numpy as np
+        segments = self.segments(start, end)
+        result = {}
+        for name in self.columns:
+            parts = [np.frombuffer(segment[name], dtype=np.float64) for segment in segments]
+            if not len(parts):
+                result[name] = np.empty(0)
+            elif 1 == len(parts):
+                result[name] = parts[0]
+            else:
+                result[name] = np.concatenate(parts)
+        return result
+
+    # Write the touched pages to the files now instead of when the kernel
+    # gets to it
+    def flush(self):
+        if not self.readonly:
+            for mm in self.maps.values():
+                mm.flush()
+            self.head.flush()
+
+    # Flush and unmap the files. Views from segments() and read() must not
+    # be used after this.
+    def close(self):
+        self.flush()
+        for column in self.columns.values():
+            column.release()
+        for mm in self.maps.values():
+            mm.close()
+        self.head.close()
+        self.columns = {}
+        self.maps = {}
@@ -0,0 +1,168 @@
+###############################################################################
+# vscp_bme680/iaq.py
+#
+# This file is part of the VSCP (http://www.vscp.org)
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2000-2021 Ake Hedman, Grodans Paradis AB <info@grodansparadis.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+
+# Indoor air quality (IAQ) index from the gas resistance.
+#
+# The resistance of the metal oxide layer goes down when there are
+# volatile organic compounds (VOC) in the air, and with higher humidity.
+# What resistance clean air gives differs between sensors and drifts
+# slowly, so it is tracked as a baseline: a running value of the
+# humidity compensated resistance that follows cleaner air (higher
+# resistance) within minutes and polluted air only over days. The index
+# is calculated from how far the resistance is below the baseline and
+# how far the humidity is from the optimum, on the same 0-500 scale as
+# the Bosch BSEC library (0-50 good, 51-100 average, 101-150 little bad,
+# 151-200 bad, 201-300 worse, 301-500 very bad).
+#
+# Each sample is O(1) and the state is a handful of numbers, which is
+# what is persisted so a restart doesn't have to burn in again.
+
+import math
+
+# Time constants (seconds) of the baseline when the air gets cleaner and
+# when it gets worse, and of the reference humidity
+BASELINE_RISE = 600.0
+BASELINE_FALL = 2 * 86400.0
+HUMIDITY_TAU = 86400.0
+
+# Time constant of the baseline during burn-in, it then follows the
+# resistance in both directions while the sensor settles
+BURN_IN_TAU = 60.0
+
+# Longest time step used, a long gap (the daemon was stopped) should not
+# move the baseline more than this
+MAX_STEP = 3600.0
+
+# Relative change of the gas resistance per percent relative humidity,
+# the resistance is compensated to the reference humidity
+HUMIDITY_SLOPE = 0.03
+
+# Humidity that gives the best score and the weight of the humidity in
+# the index
+HUMIDITY_OPTIMUM = 40.0
+HUMIDITY_WEIGHT = 0.25
+
+# Highest index
+IAQ_MAX = 500.0
+
+class IaqEstimator:
+
+    # burn_in       - Seconds of gas measurements before an index is given
+    # save_interval - Min seconds between checkpoints of the state
+    def __init__(self, burn_in=300.0, save_interval=3600.0):
+        self.burn_in = burn_in
+        self.save_interval = save_interval
+        # Humidity compensated resistance of clean air (Ohm)
+        self.baseline = None
+        # Reference humidity for the compensation (percent)
+        self.humidity = None
+        # Seconds of gas measurements seen
+        self.elapsed = 0.0
+        # Time of the last sample and of the last checkpoint
+        self.timestamp = None
+        self.saved = None
+
+    # State to persist, a dictionary with plain numbers
+    def state(self):
+        return {'baseline': self.baseline,
+                'humidity': self.humidity,
+                'elapsed': self.elapsed,
+                'timestamp': self.timestamp}
+
+    # Continue from a persisted state, None or a broken state starts over
+    def restore(self, state):
+        try:
+            baseline = float(state['baseline'])
+            humidity = float(state['humidity'])
+            elapsed = float(state['elapsed'])
+            timestamp = float(state['timestamp'])
+        except (KeyError, TypeError, ValueError):
+            return False
+        if not baseline > 0:
+            return False
+        self.baseline = baseline
+        self.humidity = humidity
+        self.elapsed = elapsed
+        self.timestamp = timestamp
+        self.saved = timestamp
+        return True
+
+    # The state if save_interval has passed since the last checkpoint,
+    # else None
+    def checkpoint(self, timestamp):
+        if self.baseline is None:
+            return None
+        if self.saved is not None and timestamp - self.saved < self.save_interval:
+            return None
+        self.saved = timestamp
+        return self.state()
+
+    # Add a sample, gas resistance in Ohm and relative humidity in percent.
+    # Returns the index or None during burn-in.
+    def update(self, gas, humidity, timestamp):
+        if gas is None or gas <= 0:
+            return None
+
+        step = 0.0
+        if self.timestamp is not None:
+            step = min(max(timestamp - self.timestamp, 0.0), MAX_STEP)
+        self.timestamp = timestamp
+
+        if self.humidity is None:
+            self.humidity = humidity
+        else:
+            self.humidity += (1.0 - math.exp(-step / HUMIDITY_TAU)) * (humidity - self.humidity)
+
+        compensated = gas * math.exp(HUMIDITY_SLOPE * (humidity - self.humidity))
+        if self.baseline is None:
+            self.baseline = compensated
+        else:
+            if self.elapsed < self.burn_in:
+                tau = BURN_IN_TAU
+            elif compensated > self.baseline:
+                tau = BASELINE_RISE
+            else:
+                tau = BASELINE_FALL
+            self.baseline += (1.0 - math.exp(-step / tau)) * (compensated - self.baseline)
+        self.elapsed += step
+
+        if self.elapsed < self.burn_in:
+            return None
+        return iaqIndex(compensated, self.baseline, humidity)
+
+# Index from the compensated gas resistance, the baseline and the
+# relative humidity. 0 is the best air, IAQ_MAX the worst.
+def iaqIndex(gas, baseline, humidity):
+    gas_score = min(gas / baseline, 1.0) * (1.0 - HUMIDITY_WEIGHT)
+    if humidity > HUMIDITY_OPTIMUM:
+        humidity_score = (100.0 - humidity) / (100.0 - HUMIDITY_OPTIMUM)
+    else:
+        humidity_score = humidity / HUMIDITY_OPTIMUM
+    humidity_score = min(max(humidity_score, 0.0), 1.0) * HUMIDITY_WEIGHT
+    return (1.0 - gas_score - humidity_score) * IAQ_MAX
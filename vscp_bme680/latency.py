@@ -0,0 +1,61 @@
+###############################################################################
+# vscp_bme680/latency.py
+#
+# This file is part of the VSCP (http://www.vscp.org)
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2000-2021 Ake Hedman, Grodans Paradis AB <info@grodansparadis.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Latency samples and their percentiles, for the benchmark (bench.py) and
+# the replay (replay.py).
+
+# Percentiles reported for every stage
+PERCENTILES = (50, 90, 99)
+
+# Nearest rank percentile of a sorted list
+def percentile(values, p):
+    if not len(values):
+        return 0.0
+    rank = int(round(p / 100.0 * (len(values) - 1)))
+    return values[rank]
+
+# Latency samples for one stage (seconds)
+class Stats:
+
+    def __init__(self):
+        self.samples = []
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+
+    # Summary in microseconds
+    def summary(self):
+        values = sorted(self.samples)
+        result = {"count": len(values)}
+        if len(values):
+            result["mean_us"] = round(sum(values) / len(values) * 1e6, 2)
+        else:
+            result["mean_us"] = 0.0
+        for p in PERCENTILES:
+            result["p{}_us".format(p)] = round(percentile(values, p) * 1e6, 2)
+        result["max_us"] = round(values[-1] * 1e6, 2) if len(values) else 0.0
+        return result
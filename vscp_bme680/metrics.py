@@ -0,0 +1,187 @@
+###############################################################################
+# vscp_bme680/metrics.py
+#
+# This file is part of the VSCP (http://www.vscp.org)
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2000-2021 Ake Hedman, Grodans Paradis AB <info@grodansparadis.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Timers and counters for the measurement path. Durations are kept in
+# histograms with a fixed set of buckets so recording a value costs the
+# same however long the process runs. The metrics can be published as a
+# JSON status message and written as a Prometheus textfile (for the node
+# exporter textfile collector).
+
+import bisect
+import json
+import os
+import threading
+import time
+
+# Bucket upper bounds in seconds
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Prefix for the Prometheus metric names
+PROMETHEUS_PREFIX = "vscp_bme680_"
+
+class Histogram:
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        # One extra bucket for values above the last bound (+Inf)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    # Cumulative counts as (upper bound, count), the last bound is "+Inf"
+    def cumulative(self):
+        result = []
+        total = 0
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+class Metrics:
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.collectors = []
+        self.start = time.time()
+
+    # Add n to a counter
+    def inc(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    # Set a gauge
+    def set(self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+
+    # Record a duration (seconds) in a histogram
+    def observe(self, name, seconds):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    # Add a function that is called when the metrics are read. It returns
+    # a list of (name, kind, value) where kind is "counter" or "gauge", for
+    # values that are already kept somewhere else (publisher statistics,
+    # outbox size).
+    def addCollector(self, collector):
+        self.collectors.append(collector)
+
+    def _collect(self):
+        counters = dict(self.counters)
+        gauges = dict(self.gauges)
+        for collector in self.collectors:
+            for name, kind, value in collector():
+                if "counter" == kind:
+                    counters[name] = value
+                else:
+                    gauges[name] = value
+        return counters, gauges
+
+    # All metrics as a JSON object
+    def snapshot(self):
+        with self.lock:
+            counters, gauges = self._collect()
+            histograms = {}
+            for name, histogram in self.histograms.items():
+                histograms[name] = {
+                    "count": histogram.count,
+                    "sum": round(histogram.sum, 6),
+                    "buckets": [[bound, count] for bound, count in histogram.cumulative()]
+                }
+        now = time.time()
+        return {
+            "time": int(now),
+            "uptime": round(now - self.start, 1),
+            "counters": counters,
+            "gauges": gauges,
+            "histograms": histograms
+        }
+
+    # All metrics in the Prometheus text exposition format
+    def prometheus(self, prefix=PROMETHEUS_PREFIX):
+        lines = []
+        with self.lock:
+            counters, gauges = self._collect()
+            for name in sorted(counters):
+                lines.append("# TYPE {}{} counter".format(prefix, name))
+                lines.append("{}{} {}".format(prefix, name, counters[name]))
+            for name in sorted(gauges):
+                lines.append("# TYPE {}{} gauge".format(prefix, name))
+                lines.append("{}{} {}".format(prefix, name, gauges[name]))
+            for name in sorted(self.histograms):
+                histogram = self.histograms[name]
+                lines.append("# TYPE {}{} histogram".format(prefix, name))
+                for bound, count in histogram.cumulative():
+                    lines.append('{}{}_bucket{{le="{}"}} {}'.format(prefix, name, bound, count))
+                lines.append("{}{}_sum {}".format(prefix, name, repr(histogram.sum)))
+                lines.append("{}{}_count {}".format(prefix, name, histogram.count))
+        return "\n".join(lines) + "\n"
+
+    # Write the Prometheus textfile. Written to a temporary file first so
+    # the exporter never sees a half written file.
+    def writeTextfile(self, path, prefix=PROMETHEUS_PREFIX):
+        tmppath = path + ".tmp"
+        with open(tmppath, "w") as f:
+            f.write(self.prometheus(prefix))
+        os.replace(tmppath, path)
+
+# Publishes the metrics as a status message and writes the textfile
+#   metrics  - Metrics
+#   topic    - MQTT topic for the status message, empty to not publish
+#   textfile - Path of the Prometheus textfile, empty to not write one
+class MetricsReporter:
+
+    def __init__(self, metrics, topic="", textfile=""):
+        self.metrics = metrics
+        self.topic = topic
+        self.textfile = textfile
+
+    # Status message payload
+    def payload(self):
+        return json.dumps(self.metrics.snapshot())
+
+    # Write the textfile (if one is configured)
+    def write(self):
+        if len(self.textfile):
+            try:
+                self.metrics.writeTextfile(self.textfile)
+            except OSError as e:
+                print("Unable to write metrics file:", e)
@@ -0,0 +1,171 @@
+###############################################################################
+# vscp_bme680/outbox.py
+#
+# This file is part of the VSCP (http://www.vscp.org)
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2000-2021 Ake Hedman, Grodans Paradis AB <info@grodansparadis.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Store-and-forward queue for events that could not be delivered to the
+# MQTT broker. Events are kept in a SQLite database in WAL mode with a cap
+# on the stored size (oldest events are evicted first) and are replayed in
+# timestamp order at a limited rate when the broker is reachable again.
+
+import sqlite3
+import time
+
+from vscp_bme680.publisher import messageState
+
+# Shortest wait between replay steps, for when the broker is not connected
+MIN_DELAY = 0.1
+
+class Outbox:
+
+    # path     - Path to the database file
+    # max_size - Max number of bytes (topic + payload) to keep
+    def __init__(self, path, max_size=10000000):
+        self.path = path
+        self.max_size = max_size
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS outbox ("
+                            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                            "ts REAL NOT NULL, "
+                            "topic TEXT NOT NULL, "
+                            "payload TEXT NOT NULL, "
+                            "qos INTEGER NOT NULL, "
+                            "size INTEGER NOT NULL)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS outbox_ts ON outbox (ts, id)")
+        row = self.db.execute("SELECT COUNT(*), TOTAL(size) FROM outbox").fetchone()
+        self.count = row[0]
+        self.size = int(row[1])
+        self.evicted = 0
+
+    # Store an event
+    def put(self, topic, payload, timestamp=None, qos=0):
+        if timestamp is None:
+            timestamp = time.time()
+        size = len(topic) + len(payload)
+        with self.db:
+            self.db.execute("INSERT INTO outbox (ts, topic, payload, qos, size) "
+                            "VALUES (?, ?, ?, ?, ?)",
+                            (timestamp, topic, payload, qos, size))
+        self.count += 1
+        self.size += size
+        if self.size > self.max_size:
+            self._evict()
+
+    # Remove the oldest events until we are below the size cap
+    def _evict(self):
+        while self.size > self.max_size and self.count:
+            rows = self.db.execute("SELECT id, size FROM outbox "
+                                   "ORDER BY ts, id LIMIT 100").fetchall()
+            ids = []
+            for id, size in rows:
+                ids.append((id,))
+                self.size -= size
+                self.count -= 1
+                self.evicted += 1
+                if self.size <= self.max_size:
+                    break
+            with self.db:
+                self.db.executemany("DELETE FROM outbox WHERE id = ?", ids)
+
+    # Get (at most) the n oldest events as (id, ts, topic, payload, qos)
+    def peek(self, n):
+        return self.db.execute("SELECT id, ts, topic, payload, qos FROM outbox "
+                               "ORDER BY ts, id LIMIT ?", (n,)).fetchall()
+
+    # Remove delivered events
+    def remove(self, ids):
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            marks = ",".join("?" * len(chunk))
+            with self.db:
+                count, size = self.db.execute("SELECT COUNT(*), TOTAL(size) FROM outbox "
+                                              "WHERE id IN (%s)" % marks, chunk).fetchone()
+                self.db.execute("DELETE FROM outbox WHERE id IN (%s)" % marks, chunk)
+            self.count -= count
+            self.size -= int(size)
+
+    def close(self):
+        self.db.close()
+
+# Replays stored events through a publisher. Uses a token bucket so the
+# broker is not flooded and live events are not held up.
+class Replayer:
+
+    # rate  - Max number of events/second to replay
+    # batch - Max number of events to replay in one step
+    def __init__(self, outbox, publisher, rate=50.0, batch=500):
+        self.outbox = outbox
+        self.publisher = publisher
+        self.rate = rate
+        self.batch = batch
+        self.tokens = float(batch)
+        self.last = time.monotonic()
+        self.replayed = 0
+
+    # Stored events the rate allows for to be sent now
+    def take(self):
+        now = time.monotonic()
+        self.tokens = min(float(self.batch), self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        n = int(self.tokens)
+        if not n or not self.outbox.count or not self.publisher.client.is_connected():
+            return []
+        return self.outbox.peek(n)
+
+    # Seconds until the token bucket holds enough tokens for the next batch,
+    # or None if there is nothing to replay
+    def delay(self):
+        if not self.outbox.count or self.rate <= 0:
+            return None
+        need = min(self.batch, self.outbox.count) - self.tokens
+        return max(MIN_DELAY, need / self.rate)
+
+    # Book keeping after sending events from take(). Delivered events are
+    # removed from the outbox.
+    def done(self, sent, delivered):
+        self.outbox.remove(delivered)
+        self.tokens -= sent
+        self.replayed += len(delivered)
+
+    # Replay the events the rate allows for. Returns the number of events
+    # delivered (and removed from the outbox).
+    def step(self, timeout=5.0):
+        sent = []
+        for id, ts, topic, payload, qos in self.take():
+            info = self.publisher.publish(topic, payload, timeout, ts, store=False, qos=qos)
+            if info is None:
+                break
+            sent.append((id, info))
+        if not len(sent):
+            return 0
+        self.publisher.flush(timeout)
+
+        delivered = [id for id, info in sent if messageState(info)]
+        self.done(len(sent), delivered)
+        return len(delivered)
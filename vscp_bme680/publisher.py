@@ -0,0 +1,176 @@
+###############################################################################
+# vscp_bme680/publisher.py
+#
+# This file is part of the VSCP (http://www.vscp.org)
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2000-2021 Ake Hedman, Grodans Paradis AB <info@grodansparadis.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Pipelined MQTT publishing. All messages of a measurement cycle are handed
+# to the paho client back to back and confirmed with one flush at the end
+# of the cycle instead of waiting for each of them.
+
+import time
+
+# Interval used when polling for confirmations
+POLL_INTERVAL = 0.005
+
+# paho return codes, the same values as in paho.mqtt.client (not imported
+# here to keep the startup of one-shot runs short)
+MQTT_ERR_SUCCESS = 0
+MQTT_ERR_NO_CONN = 4
+
+# Message state for a paho MQTTMessageInfo, returns True if published,
+# False if still in flight and None if it has failed for good
+def messageState(info):
+    try:
+        return info.is_published()
+    except (ValueError, RuntimeError):
+        return None
+
+# Hand a message to the paho client. A QoS 1/2 message published while
+# the client is not connected gets MQTT_ERR_NO_CONN but is kept by paho
+# and sent when the client has connected again. It is still in flight
+# and must not be stored in the outbox too (it would reach the broker
+# twice). Only a QoS 0 message is dropped by paho.
+def clientPublish(client, topic, payload, qos, retain):
+    info = client.publish(topic, payload, qos=qos, retain=retain)
+    if qos and MQTT_ERR_NO_CONN == info.rc:
+        info.rc = MQTT_ERR_SUCCESS
+    return info
+
+# Wait for the paho client to become connected. Returns True if it is.
+def waitForConnection(client, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not client.is_connected() and time.monotonic() < deadline:
+        time.sleep(POLL_INTERVAL)
+    return client.is_connected()
+
+class Publisher:
+
+    # client       - Connected paho client (loop started)
+    # qos          - QoS used for messages published without a QoS of their own
+    # max_inflight - Max number of unconfirmed messages before publish()
+    #                waits for the oldest one
+    # retain       - Set the retain flag on published messages
+    # outbox       - Outbox for messages that can't be delivered (or None)
+    # metrics      - Metrics for the publish latency (or None)
+    def __init__(self, client, qos=0, max_inflight=20, retain=False, outbox=None,
+                 metrics=None):
+        self.client = client
+        self.qos = qos
+        self.max_inflight = max(1, max_inflight)
+        self.retain = retain
+        self.outbox = outbox
+        self.metrics = metrics
+        self.pending = []
+        # mid -> time the message was handed to the client
+        self.sent_at = {}
+
+        # Statistics since start
+        self.sent = 0
+        self.confirmed = 0
+        self.failed = 0
+        self.stored = 0
+
+        # Let paho use the same window for QoS > 0 flows
+        client.max_inflight_messages_set(self.max_inflight)
+
+    # Move finished messages out of the in-flight list
+    def _collect(self):
+        pending = []
+        for item in self.pending:
+            state = messageState(item[2])
+            if state is None:
+                self.failed += 1
+                self.sent_at.pop(item[2].mid, None)
+                self.onFailed(*item)
+            elif state:
+                self.confirmed += 1
+                if self.metrics is not None:
+                    self._latency(item[2].mid)
+            else:
+                pending.append(item)
+        self.pending = pending
+
+    def _latency(self, mid):
+        start = self.sent_at.pop(mid, None)
+        if start is not None:
+            self.metrics.observe('publish_latency_seconds', time.perf_counter() - start)
+
+    # Called for messages that could not be delivered
+    def onFailed(self, topic, payload, info, timestamp, store, qos):
+        if store and self.outbox is not None:
+            self.outbox.put(topic, payload, timestamp, qos)
+            self.stored += 1
+
+    # Number of messages not yet confirmed
+    def inflight(self):
+        return len(self.pending)
+
+    # Queue a message. Only blocks (for at most timeout seconds) if the
+    # in-flight window is full. If there is an outbox and the broker is not
+    # connected the message goes to the outbox (if store is set) and None is
+    # returned. timestamp is the time of the measurement. qos overrides the
+    # QoS of the publisher (for events replayed from the outbox).
+    def publish(self, topic, payload, timeout=5.0, timestamp=None, store=True, qos=None):
+        if qos is None:
+            qos = self.qos
+        if self.outbox is not None and not self.client.is_connected():
+            if store:
+                self.outbox.put(topic, payload, timestamp, qos)
+                self.stored += 1
+            return None
+        if len(self.pending) >= self.max_inflight:
+            self._collect()
+            deadline = time.monotonic() + timeout
+            while len(self.pending) >= self.max_inflight and \
+                    time.monotonic() < deadline:
+                time.sleep(POLL_INTERVAL)
+                self._collect()
+        info = clientPublish(self.client, topic, payload, qos, self.retain)
+        if self.metrics is not None:
+            self.sent_at[info.mid] = time.perf_counter()
+        self.pending.append((topic, payload, info, timestamp, store, qos))
+        self.sent += 1
+        return info
+
+    # Hand messages that are still not confirmed over to the outbox. Used
+    # before shutting down so they are not lost.
+    def abandon(self):
+        self._collect()
+        for item in self.pending:
+            self.onFailed(*item)
+        self.pending = []
+        self.sent_at = {}
+
+    # Wait until all queued messages are confirmed or the timeout expires.
+    # Returns the number of messages confirmed by this flush.
+    def flush(self, timeout=5.0):
+        before = self.confirmed
+        deadline = time.monotonic() + timeout
+        self._collect()
+        while len(self.pending) and time.monotonic() < deadline:
+            time.sleep(POLL_INTERVAL)
+            self._collect()
+        return self.confirmed - before
@@ -0,0 +1,214 @@
+###############################################################################
+# vscp_bme680/query.py
+#
+# This file is part of the VSCP (http://www.vscp.org)
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2000-2021 Ake Hedman, Grodans Paradis AB <info@grodansparadis.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+
+# Local query service in daemon mode. A small HTTP server on a TCP port
+# or a Unix socket answers from the rollups of the sensors (see
+# rollup.py), so checking what a sensor read in the last hour doesn't go
+# through the broker and the backend.
+#
+#   GET /sensors
+#       The sensors, their channels and the resolutions
+#   GET /sensors/<sensor>?since=3600
+#       mean, min, max and stddev of every channel
+#   GET /sensors/<sensor>/<channel>?resolution=1m&stat=mean&since=3600
+#       One value per bucket
+#
+# The range is the last since seconds (default 3600) or start and end as
+# Unix times. Values are returned as the measurement block of the
+# published events, with the statistic and the number of samples added
+# as for aggregated events,
+#
+#   {"vscpTimestampns": ..., "measurement": {"value": 21.3, "unit": 1,
+#    "sensorindex": 0, "zone": 0, "subzone": 0, "stat": "mean",
+#    "samples": 60}}
+#
+# The server runs in the event loop of the engine, as the rollups are
+# updated, so nothing is locked. Only GET is served, one request per
+# connection.
+
+import asyncio
+import json
+import math
+import os
+import time
+import urllib.parse
+
+from vscp_bme680.rollup import RESOLUTION_NAMES, STATISTICS, statistic
+
+# Prefix for a Unix socket in the query_listen setting
+UNIX_PREFIX = "unix:"
+
+# Longest request head read
+MAX_REQUEST = 8192
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed"}
+
+class QueryError(Exception):
+
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+class QueryServer:
+
+    # engine - The engine, its sensors (name, channels, rollups) are served
+    # listen - Where to listen, "port", "host:port" or "unix:/path"
+    def __init__(self, engine, listen):
+        self.engine = engine
+        self.listen = listen
+        self.server = None
+        self.requests = 0
+
+    async def start(self):
+        if self.listen.startswith(UNIX_PREFIX):
+            path = self.listen[len(UNIX_PREFIX):]
+            # A socket left by an earlier run
+            if os.path.exists(path):
+                os.unlink(path)
+            self.server = await asyncio.start_unix_server(self._handle, path)
+        else:
+            host, sep, port = self.listen.rpartition(':')
+            self.server = await asyncio.start_server(self._handle, host or "127.0.0.1", int(port))
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+            if self.listen.startswith(UNIX_PREFIX):
+                try:
+                    os.unlink(self.listen[len(UNIX_PREFIX):])
+                except OSError:
+                    pass
+
+    async def _handle(self, reader, writer):
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+            status, body = self.request(head[:MAX_REQUEST].decode('latin-1'))
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            writer.close()
+            return
+        self.requests += 1
+        data = json.dumps(body).encode()
+        writer.write("HTTP/1.0 {} {}\r\nContent-Type: application/json\r\n"
+                     "Content-Length: {}\r\nConnection: close\r\n\r\n".format(
+                         status, REASONS[status], len(data)).encode() + data)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+    # Answer a request head. Returns (status, JSON object).
+    def request(self, head):
+        try:
+            parts = head.split("\r\n", 1)[0].split()
+            if len(parts) < 2:
+                raise QueryError(400, "Bad request line")
+            if parts[0] != "GET":
+                raise QueryError(405, "Only GET is supported")
+            url = urllib.parse.urlsplit(parts[1])
+            params = dict(urllib.parse.parse_qsl(url.query))
+            path = [urllib.parse.unquote(p) for p in url.path.split('/') if len(p)]
+            if path in ([], ['sensors']):
+                return 200, self.sensors()
+            if 'sensors' != path[0] or len(path) > 3:
+                raise QueryError(404, "Unknown path: " + url.path)
+            sensor = self.engine.findSensor(path[1])
+            if sensor is None or sensor.rollups is None:
+                raise QueryError(404, "Unknown sensor: " + path[1])
+            start, end = self._range(params)
+            if 2 == len(path):
+                return 200, self.summary(sensor, start, end)
+            return 200, self.series(sensor, path[2], start, end,
+                                    params.get('resolution', RESOLUTION_NAMES[0]),
+                                    params.get('stat', 'mean'))
+        except QueryError as e:
+            return e.status, {"error": str(e)}
+
+    # start and end from the parameters
+    def _range(self, params):
+        try:
+            end = float(params['end']) if 'end' in params else time.time()
+            if 'start' in params:
+                start = float(params['start'])
+            else:
+                start = end - float(params.get('since', 3600))
+        except ValueError as e:
+            raise QueryError(400, str(e))
+        if not (math.isfinite(start) and math.isfinite(end)):
+            raise QueryError(400, "start and end must be finite")
+        if start > end:
+            raise QueryError(400, "start is after end")
+        return start, end
+
+    def _channel(self, sensor, name):
+        for ch in sensor.channels:
+            if ch.name == name:
+                return ch
+        raise QueryError(404, "Unknown channel: " + name)
+
+    # A value as the measurement block of an event, with the timestamp
+    def _value(self, ch, value, timestamp, stat, samples):
+        if ch.vtype is int:
+            value = int(round(value))
+        event = ch.fillStat(value, timestamp, stat, samples)
+        return {"vscpTimestampns": event["vscpTimestampns"],
+                "measurement": event["measurement"]}
+
+    def sensors(self):
+        return {"sensors": dict((sensor.name, [ch.name for ch in sensor.channels])
+                                for sensor in self.engine.sensors
+                                if sensor.rollups is not None),
+                "resolutions": list(RESOLUTION_NAMES),
+                "statistics": list(STATISTICS)}
+
+    def summary(self, sensor, start, end):
+        channels = {}
+        for ch in sensor.channels:
+            stats = sensor.rollups.summary(ch.name, start, end)
+            if not stats[0]:
+                continue
+            channels[ch.name] = dict((stat, self._value(ch, statistic(stats, stat), end,
+                                                        stat, stats[0]))
+                                     for stat in STATISTICS)
+        return {"sensor": sensor.name, "start": start, "end": end,
+                "last": sensor.rollups.last, "channels": channels}
+
+    def series(self, sensor, name, start, end, resolution, stat):
+        ch = self._channel(sensor, name)
+        if resolution not in RESOLUTION_NAMES:
+            raise QueryError(400, "Unknown resolution: " + resolution)
+        if stat not in STATISTICS:
+            raise QueryError(400, "Unknown statistic: " + stat)
+        buckets = sensor.rollups.buckets(name, resolution, start, end)
+        return {"sensor": sensor.name, "channel": name, "resolution": resolution,
+                "stat": stat, "start": start, "end": end,
+                "buckets": [self._value(ch, statistic(stats, stat), t, stat, stats[0])
+                            for t, stats in buckets]}
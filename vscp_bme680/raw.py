@@ -0,0 +1,335 @@
+###############################################################################
+# vscp_bme680/raw.py
+#
+# This file is part of the VSCP (http://www.vscp.org)
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2000-2021 Ake Hedman, Grodans Paradis AB <info@grodansparadis.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Raw register access and compensation for burst acquisition.
+#
+# In burst mode a sample is the raw data block of the sensor (17 bytes
+# from register 0x1D, status, pressure, temperature, humidity and gas
+# ADC values) read in one I2C transaction. Samples are queued and the
+# Bosch compensation formulas are applied to a whole batch at once,
+# vectorized with NumPy if it is installed. The formulas are the floating
+# point versions the Adafruit driver uses. The calibration registers are
+# parsed as in the Bosch reference (BME68x Sensor API), the driver mixes
+# up the shared H1/H2 register and reads signed values as unsigned.
+#
+# Register dumps (a calibration block and a series of data blocks) can
+# be written and read back so burst acquisition and compensation can be
+# run without hardware.
+
+import collections
+import struct
+
+# Registers
+REG_DATA = 0x1D
+DATA_LENGTH = 17
+REG_COEFF1 = 0x89
+COEFF1_LENGTH = 25
+REG_COEFF2 = 0xE1
+COEFF2_LENGTH = 16
+REG_RES_HEAT_VAL = 0x00
+REG_RES_HEAT_RANGE = 0x02
+REG_RANGE_SW_ERR = 0x04
+
+# Gas range lookup tables (BME680)
+LOOKUP_TABLE_1 = (
+    2147483647.0, 2147483647.0, 2147483647.0, 2147483647.0,
+    2147483647.0, 2126008810.0, 2147483647.0, 2130303777.0,
+    2147483647.0, 2147483647.0, 2143188679.0, 2136746228.0,
+    2147483647.0, 2126008810.0, 2147483647.0, 2147483647.0)
+LOOKUP_TABLE_2 = (
+    4096000000.0, 2048000000.0, 1024000000.0, 512000000.0,
+    255744255.0, 127110228.0, 64000000.0, 32258064.0,
+    16016016.0, 8000000.0, 4000000.0, 2000000.0,
+    1000000.0, 500000.0, 250000.0, 125000.0)
+
+# Calibration coefficients of a sensor
+#   t, p, h, g  - Temperature, pressure, humidity and gas coefficients in
+#                 the order the compensation uses them
+#   heat_range, heat_val, sw_err - Heater and gas range values
+#   variant     - 0 for BME680, 1 for BME688
+#   raw         - The register bytes the coefficients were parsed from
+Calibration = collections.namedtuple('Calibration', [
+    't', 'p', 'h', 'g', 'heat_range', 'heat_val', 'sw_err', 'variant', 'raw'])
+
+# Parse the calibration registers. coeff is the 25 bytes from 0x89
+# followed by the 16 bytes from 0xE1, heat is the bytes of registers
+# 0x00-0x04.
+def parseCalibration(coeff, heat, variant=0):
+    coeff = bytes(coeff)
+    heat = bytes(heat)
+    values = [float(v) for v in
+              struct.unpack("<hbBHhbBhhbbHhhBBBHbbbBbHhbb", coeff[1:39])]
+    t = [values[x] for x in (23, 0, 1)]
+    p = [values[x] for x in (3, 4, 5, 7, 8, 10, 9, 12, 13, 14)]
+    h = [values[x] for x in (17, 16, 18, 19, 20, 21, 22)]
+    g = [values[x] for x in (25, 24, 26)]
+    # H1 and H2 share register 0xE2, the low nibble is the LSB's of H1
+    # (MSB's in 0xE3) and the high nibble the LSB's of H2 (MSB's in 0xE1)
+    h[0], h[1] = (float((coeff[27] << 4) | (coeff[26] & 0x0F)),
+                  float((coeff[25] << 4) | (coeff[26] >> 4)))
+    # Heater value and range switching error are signed
+    heat_val, sw_err = struct.unpack("bb", bytes([heat[REG_RES_HEAT_VAL],
+                                                  heat[REG_RANGE_SW_ERR] & 0xF0]))
+    return Calibration(t=tuple(t), p=tuple(p), h=tuple(h), g=tuple(g),
+                       heat_range=(heat[REG_RES_HEAT_RANGE] & 0x30) / 16,
+                       heat_val=heat_val,
+                       sw_err=sw_err / 16,
+                       variant=variant,
+                       raw=(coeff, heat))
+
+# True if the data block holds a new conversion
+def newData(block):
+    return 0 != block[0] & 0x80
+
+# ADC values of a data block as (temperature, pressure, humidity, gas,
+# gas range)
+def parseBlock(block, variant=0):
+    adc_pres = ((block[2] << 16) | (block[3] << 8) | block[4]) >> 4
+    adc_temp = ((block[5] << 16) | (block[6] << 8) | block[7]) >> 4
+    adc_hum = (block[8] << 8) | block[9]
+    g = 15 if variant else 13
+    adc_gas = ((block[g] << 8) | block[g + 1]) // 64
+    gas_range = block[g + 1] & 0x0F
+    return (adc_temp, adc_pres, adc_hum, adc_gas, gas_range)
+
+# Heater resistance register value for a heater temperature (degrees
+# Celsius) at an ambient temperature
+def heaterResistance(cal, temperature, ambient=25.0):
+    gh1, gh2, gh3 = cal.g
+    temperature = min(temperature, 400)
+    var1 = (gh1 / 16.0) + 49.0
+    var2 = ((gh2 / 32768.0) * 0.0005) + 0.00235
+    var3 = gh3 / 1024.0
+    var4 = var1 * (1.0 + (var2 * float(temperature)))
+    var5 = var4 + (var3 * ambient)
+    return int(3.4 * ((var5 * (4 / (4 + cal.heat_range)) *
+                       (1 / (1 + (cal.heat_val * 0.002)))) - 25))
+
+# Gas wait register value for a heater duration in milliseconds (6 bits
+# value, 2 bits multiplication factor 1, 4, 16 or 64)
+def gasWait(duration):
+    if duration >= 0xFC0:
+        return 0xFF
+    factor = 0
+    while duration > 0x3F:
+        duration = duration / 4
+        factor += 1
+    return int(duration + factor * 64)
+
+# -----------------------------------------------------------------------------
+#                      S C A L A R   C O M P E N S A T I O N
+# -----------------------------------------------------------------------------
+
+# Compensate one data block. Returns (temperature, humidity, pressure,
+# gas) in the units of the backends, gas is None if gas is False.
+def compensate(cal, block, gas=True):
+    adc_temp, adc_pres, adc_hum, adc_gas, gas_range = parseBlock(block, cal.variant)
+    t, p, h = cal.t, cal.p, cal.h
+
+    var1 = (adc_temp / 8) - (t[0] * 2)
+    var2 = (var1 * t[1]) / 2048
+    var3 = ((var1 / 2) * (var1 / 2)) / 4096
+    var3 = (var3 * t[2] * 16) / 16384
+    t_fine = int(var2 + var3)
+    temperature = (((t_fine * 5) + 128) / 256) / 100
+
+    var1 = (t_fine / 2) - 64000
+    var2 = ((var1 / 4) * (var1 / 4)) / 2048
+    var2 = (var2 * p[5]) / 4
+    var2 = var2 + (var1 * p[4] * 2)
+    var2 = (var2 / 4) + (p[3] * 65536)
+    var1 = ((((var1 / 4) * (var1 / 4)) / 8192) * (p[2] * 32) / 8) + ((p[1] * var1) / 2)
+    var1 = var1 / 262144
+    var1 = ((32768 + var1) * p[0]) / 32768
+    calc_pres = 1048576 - adc_pres
+    calc_pres = (calc_pres - (var2 / 4096)) * 3125
+    calc_pres = (calc_pres / var1) * 2
+    var1 = (p[8] * (((calc_pres / 8) * (calc_pres / 8)) / 8192)) / 4096
+    var2 = ((calc_pres / 4) * p[7]) / 8192
+    var3 = (((calc_pres / 256) ** 3) * p[9]) / 131072
+    calc_pres += (var1 + var2 + var3 + (p[6] * 128)) / 16
+    pressure = calc_pres / 100
+
+    temp_scaled = ((t_fine * 5) + 128) / 256
+    var1 = (adc_hum - (h[0] * 16)) - ((temp_scaled * h[2]) / 200)
+    var2 = (h[1] * (((temp_scaled * h[3]) / 100) +
+                    (((temp_scaled * ((temp_scaled * h[4]) / 100)) / 64) / 100) +
+                    16384)) / 1024
+    var3 = var1 * var2
+    var4 = h[5] * 128
+    var4 = (var4 + ((temp_scaled * h[6]) / 100)) / 16
+    var5 = ((var3 / 16384) * (var3 / 16384)) / 1024
+    var6 = (var4 * var5) / 2
+    humidity = ((((var3 + var6) / 1024) * 1000) / 4096) / 1000
+    humidity = max(0, min(humidity, 100))
+
+    if not gas:
+        return (temperature, humidity, pressure, None)
+    if cal.variant:
+        var1 = 262144 >> gas_range
+        var2 = 4096 + (adc_gas - 512) * 3
+        resistance = ((10000 * var1) / var2) * 100
+    else:
+        var1 = ((1340 + (5 * cal.sw_err)) * LOOKUP_TABLE_1[gas_range]) / 65536
+        var2 = ((adc_gas * 32768) - 16777216) + var1
+        var3 = (LOOKUP_TABLE_2[gas_range] * var1) / 512
+        resistance = (var3 + (var2 / 2)) / var2
+    return (temperature, humidity, pressure, int(resistance))
+
+# -----------------------------------------------------------------------------
+#                     B A T C H E D   C O M P E N S A T I O N
+# -----------------------------------------------------------------------------
+
+# Compensate a batch of data blocks with NumPy. Returns four arrays,
+# temperature, humidity, pressure and gas (NaN where gas is False). gas is
+# a sequence with one flag per block.
+def compensateArrays(cal, blocks, gas):
+    import numpy as np
+
+    data = np.frombuffer(b"".join(bytes(b) for b in blocks), dtype=np.uint8)
+    data = data.reshape(-1, DATA_LENGTH).astype(np.int64)
+    t, p, h = cal.t, cal.p, cal.h
+
+    adc_pres = (((data[:, 2] << 16) | (data[:, 3] << 8) | data[:, 4]) >> 4).astype(np.float64)
+    adc_temp = (((data[:, 5] << 16) | (data[:, 6] << 8) | data[:, 7]) >> 4).astype(np.float64)
+    adc_hum = ((data[:, 8] << 8) | data[:, 9]).astype(np.float64)
+    col = 15 if cal.variant else 13
+    adc_gas = (((data[:, col] << 8) | data[:, col + 1]) // 64).astype(np.float64)
+    gas_range = data[:, col + 1] & 0x0F
+
+    var1 = (adc_temp / 8) - (t[0] * 2)
+    var2 = (var1 * t[1]) / 2048
+    var3 = ((var1 / 2) * (var1 / 2)) / 4096
+    var3 = (var3 * t[2] * 16) / 16384
+    t_fine = np.trunc(var2 + var3)
+    temperature = (((t_fine * 5) + 128) / 256) / 100
+
+    var1 = (t_fine / 2) - 64000
+    var2 = ((var1 / 4) * (var1 / 4)) / 2048
+    var2 = (var2 * p[5]) / 4
+    var2 = var2 + (var1 * p[4] * 2)
+    var2 = (var2 / 4) + (p[3] * 65536)
+    var1 = ((((var1 / 4) * (var1 / 4)) / 8192) * (p[2] * 32) / 8) + ((p[1] * var1) / 2)
+    var1 = var1 / 262144
+    var1 = ((32768 + var1) * p[0]) / 32768
+    calc_pres = 1048576 - adc_pres
+    calc_pres = (calc_pres - (var2 / 4096)) * 3125
+    calc_pres = (calc_pres / var1) * 2
+    var1 = (p[8] * (((calc_pres / 8) * (calc_pres / 8)) / 8192)) / 4096
+    var2 = ((calc_pres / 4) * p[7]) / 8192
+    var3 = (((calc_pres / 256) ** 3) * p[9]) / 131072
+    calc_pres = calc_pres + (var1 + var2 + var3 + (p[6] * 128)) / 16
+    pressure = calc_pres / 100
+
+    temp_scaled = ((t_fine * 5) + 128) / 256
+    var1 = (adc_hum - (h[0] * 16)) - ((temp_scaled * h[2]) / 200)
+    var2 = (h[1] * (((temp_scaled * h[3]) / 100) +
+                    (((temp_scaled * ((temp_scaled * h[4]) / 100)) / 64) / 100) +
+                    16384)) / 1024
+    var3 = var1 * var2
+    var4 = h[5] * 128
+    var4 = (var4 + ((temp_scaled * h[6]) / 100)) / 16
+    var5 = ((var3 / 16384) * (var3 / 16384)) / 1024
+    var6 = (var4 * var5) / 2
+    humidity = ((((var3 + var6) / 1024) * 1000) / 4096) / 1000
+    humidity = np.clip(humidity, 0, 100)
+
+    if cal.variant:
+        var1 = (262144 >> gas_range).astype(np.float64)
+        var2 = 4096 + (adc_gas - 512) * 3
+        resistance = ((10000 * var1) / var2) * 100
+    else:
+        var1 = ((1340 + (5 * cal.sw_err)) * np.asarray(LOOKUP_TABLE_1)[gas_range]) / 65536
+        var2 = ((adc_gas * 32768) - 16777216) + var1
+        var3 = (np.asarray(LOOKUP_TABLE_2)[gas_range] * var1) / 512
+        resistance = (var3 + (var2 / 2)) / var2
+    resistance = np.where(np.asarray(gas, dtype=bool), np.trunc(resistance), np.nan)
+    return temperature, humidity, pressure, resistance
+
+# Compensate a batch of data blocks. Returns a list of (temperature,
+# humidity, pressure, gas) tuples as compensate() does. Uses NumPy if it
+# is installed, one block at a time otherwise.
+def compensateBatch(cal, blocks, gas):
+    if not len(blocks):
+        return []
+    try:
+        arrays = compensateArrays(cal, blocks, gas)
+    except ImportError:
+        return [compensate(cal, block, g) for block, g in zip(blocks, gas)]
+    result = []
+    for temperature, humidity, pressure, resistance, g in zip(*(a.tolist() for a in arrays),
+                                                                gas):
+        result.append((temperature, humidity, pressure, int(resistance) if g else None))
+    return result
+
+# -----------------------------------------------------------------------------
+#                                D U M P S
+# -----------------------------------------------------------------------------
+
+# A register dump is a text file. The first line holds the calibration,
+#
+#   calibration <variant> <coefficient bytes> <heater bytes>
+#
+# and each following line a sample,
+#
+#   <unix time> <gas 0/1> <data block>
+#
+# with the bytes as hex. Lines starting with # are comments.
+
+def writeDump(path, cal, samples):
+    with open(path, "w") as f:
+        f.write("# BME680 register dump\n")
+        f.write("calibration {} {} {}\n".format(cal.variant, cal.raw[0].hex(), cal.raw[1].hex()))
+        for timestamp, gas, block in samples:
+            f.write("{:.6f} {} {}\n".format(timestamp, int(gas), bytes(block).hex()))
+
+# Read a register dump. Returns (calibration, samples) with samples a list
+# of (timestamp, gas, block).
+def readDump(path):
+    cal = None
+    samples = []
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not len(line) or line.startswith("#"):
+                continue
+            fields = line.split()
+            try:
+                if "calibration" == fields[0]:
+                    cal = parseCalibration(bytes.fromhex(fields[2]), bytes.fromhex(fields[3]),
+                                           int(fields[1]))
+                    continue
+                block = bytes.fromhex(fields[2])
+                if len(block) != DATA_LENGTH:
+                    raise ValueError("data block is not {} bytes".format(DATA_LENGTH))
+                samples.append((float(fields[0]), fields[1] != "0", block))
+            except (IndexError, ValueError, struct.error) as e:
+                raise ValueError("{}:{}: {}".format(path, number, e))
+    if cal is None:
+        raise ValueError(path + ": no calibration")
+    return cal, samples
@@ -0,0 +1,86 @@
+###############################################################################
+# vscp_bme680/reading.py
+#
+# This file is part of the VSCP (http://www.vscp.org)
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2000-2021 Ake Hedman, Grodans Paradis AB <info@grodansparadis.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# One snapshot of the sensor. All published values of a measurement cycle
+# are derived from the same forced mode conversion so that they are
+# consistent with each other.
+
+import collections
+import time
+
+from vscp_bme680.derived import altitude, dewPoint, seaLevelPressure
+
+# An immutable sensor reading
+#   timestamp    - Unix time (seconds) for the reading
+#   temperature  - Degrees Celsius (temp_corr applied)
+#   humidity     - Relative humidity in percent
+#   pressure     - Pascal
+#   pressure_adj - Pascal, reduced to sea level from height at location
+#   gas          - Gas resistance in Ohms (None if gas was not measured)
+#   altitude     - Meters, calculated from sea level pressure
+#   dewpoint     - Degrees Celsius
+#   iaq          - Indoor air quality index 0-500 (None if not known)
+Reading = collections.namedtuple('Reading', [
+    'timestamp',
+    'temperature',
+    'humidity',
+    'pressure',
+    'pressure_adj',
+    'gas',
+    'altitude',
+    'dewpoint',
+    'iaq'])
+
+# Build a reading from the raw sensor values. Temperature in degrees
+# Celsius, humidity in percent, pressure in hPa and gas in Ohms (as
+# delivered by the sensor backends). gas is None for a conversion without
+# gas measurement. The derived values are calculated by
+# vscp_bme680.derived, the IAQ index by the sensor (see iaq.py).
+def makeReading(temperature, humidity, pressure, gas,
+                temp_corr=0.0,
+                height_at_location=0.0,
+                sea_level_pressure=1013.25,
+                timestamp=None,
+                iaq=None):
+
+    if timestamp is None:
+        timestamp = time.time()
+
+    # The dew point is calculated from the uncorrected temperature as the
+    # relative humidity is measured at the sensor temperature
+    dewpoint = dewPoint(temperature, humidity)
+
+    return Reading(timestamp=timestamp,
+                   temperature=temperature - temp_corr,
+                   humidity=humidity,
+                   pressure=pressure * 100,
+                   pressure_adj=seaLevelPressure(pressure, height_at_location) * 100,
+                   gas=None if gas is None else int(gas),
+                   altitude=altitude(pressure, sea_level_pressure),
+                   dewpoint=dewpoint,
+                   iaq=iaq)
@@ -0,0 +1,139 @@
+###############################################################################
+# vscp_bme680/reload.py
+#
+# This file is part of the VSCP (http://www.vscp.org)
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2000-2021 Ake Hedman, Grodans Paradis AB <info@grodansparadis.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Reload of the configuration in daemon mode (SIGHUP or a changed
+# configuration file). The file is read again and the settings are
+# compared with the ones in use. The caller applies what changed without
+# restarting, the sensors and the broker connection are kept.
+
+import configparser
+import os
+
+from vscp_bme680.config import readConfig
+from vscp_bme680.events import CHANNEL_NAMES, resolveGuids
+from vscp_bme680.sensors import SENSOR_KEYS, readSensorConfigs
+
+# Sensor settings that need the sensor to be opened again, these are not
+# changed by a reload
+HARDWARE_KEYS = ('bus', 'address', 'backend', 'heater_temperature', 'heater_duration',
+                 'burst_batch', 'dump_file', 'sim_seed', 'sim_latency', 'sim_noise', 'sim_i2c_error_rate',
+                 'sim_stuck_rate', 'sim_start', 'sim_step')
+
+# Settings that need a new connection to the broker
+CONNECTION_KEYS = ('host', 'port', 'user', 'password')
+
+# Settings besides the sensor settings that are changed by a reload. A
+# change of any other setting is used after a restart.
+LIVE_KEYS = CONNECTION_KEYS + ('bVerbose', 'qos', 'flush_timeout', 'max_silence',
+                               'topic', 'bundle_topic', 'bundle_format')
+
+# Names of the sensor settings
+SENSOR_SETTINGS = tuple(key for key, conv in SENSOR_KEYS)
+
+# True if a changed setting is used without a restart
+def isLive(key):
+    if key in SENSOR_SETTINGS:
+        return key not in HARDWARE_KEYS
+    return key in LIVE_KEYS
+
+# Names of the settings that differ between two dictionaries
+def changedKeys(old, new):
+    return sorted(key for key in set(old) | set(new) if old.get(key) != new.get(key))
+
+# Channels without a topic of their own use the general topic
+def channelTopics(settings):
+    for name in CHANNEL_NAMES:
+        if settings.get('topic_' + name) is None:
+            settings['topic_' + name] = settings.get('topic')
+    return settings
+
+class ConfigReloader:
+
+    # cfgpath  - Configuration file
+    # defaults - Value of every setting in SCHEMA when it is not in the
+    #            file (the defaults of the script)
+    # settings - Settings in use
+    # apply    - Called as apply(settings, sensor_configs, changed) with the
+    #            new settings, the new sensor settings (see
+    #            readSensorConfigs) and the names of the changed settings
+    # interval - Seconds between checks of the file modification time, 0
+    #            to only reload on request
+    def __init__(self, cfgpath, defaults, settings, apply, interval=0.0):
+        self.cfgpath = cfgpath
+        self.defaults = defaults
+        self.settings = settings
+        self.apply = apply
+        self.interval = interval
+        self.mtime = self._mtime()
+        self.reloads = 0
+
+    def _mtime(self):
+        try:
+            return os.stat(self.cfgpath).st_mtime_ns
+        except OSError:
+            return None
+
+    # True if the configuration file has been modified since it was read
+    def changed(self):
+        return self._mtime() != self.mtime
+
+    # Read the configuration file. Returns the settings (defaults for the
+    # ones not in the file) and the sensor settings. Raises ValueError for
+    # a bad configuration.
+    def read(self):
+        config = configparser.ConfigParser()
+        try:
+            if not len(config.read(self.cfgpath)):
+                raise ValueError("Unable to read " + self.cfgpath)
+        except configparser.Error as e:
+            raise ValueError(str(e))
+        settings = dict(self.defaults)
+        settings.update(readConfig(config))
+        channelTopics(settings)
+        defaults = {}
+        for key, conv in SENSOR_KEYS:
+            defaults[key] = settings[key]
+        sensor_configs = readSensorConfigs(config, defaults)
+        for name, cfg in sensor_configs:
+            cfg['guids'] = resolveGuids(cfg)
+        return settings, sensor_configs
+
+    # Read the configuration file and apply what has changed. A bad
+    # configuration is reported and the current one is kept.
+    def reload(self):
+        self.mtime = self._mtime()
+        try:
+            settings, sensor_configs = self.read()
+        except ValueError as e:
+            print("Configuration not reloaded:", e)
+            return False
+        changed = changedKeys(self.settings, settings)
+        self.settings = settings
+        self.apply(settings, sensor_configs, changed)
+        self.reloads += 1
+        return True
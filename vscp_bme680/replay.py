@@ -0,0 +1,233 @@
+###############################################################################
+# vscp_bme680/replay.py
+#
+# This file is part of the VSCP (http://www.vscp.org)
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2000-2021 Ake Hedman, Grodans Paradis AB <info@grodansparadis.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+
+# Replay of recorded readings through the publish path of mqtt-bme680.py,
+# for load tests of the systems that ingest the events. The readings are
+# encoded with the same compiled channels (and bundles) as live readings
+# and published at the recorded rate, a multiple of it or as fast as the
+# broker takes them. With a GUID remap one recording can stand for many
+# nodes.
+#
+# A recording is CSV with a header row
+#
+#   timestamp,temperature,humidity,pressure,pressure_adj,gas,altitude,dewpoint
+#
+# or NDJSON, one object per line, either flat with the same keys or a
+# compact bundle as mqtt-bme680.py publishes it (values in "values", the
+# time in "vscpTimestampns"). Timestamps are Unix seconds. Channels that
+# are missing or empty are not published for that reading.
+
+import csv
+import json
+import sys
+import time
+
+from vscp_bme680.events import CHANNELS
+from vscp_bme680.latency import Stats
+from vscp_bme680.publisher import Publisher
+from vscp_bme680.reading import Reading
+
+# Seconds behind the schedule a reading is counted as late
+LATE = 1.0
+
+# Check a speed setting, "1", "10", "10x" or "max". Returns the factor,
+# 0 for as fast as possible.
+def parseSpeed(text):
+    text = text.strip().lower()
+    if "max" == text:
+        return 0.0
+    if text.endswith('x'):
+        text = text[:-1]
+    speed = float(text)
+    if speed <= 0:
+        raise ValueError("Speed must be positive or max")
+    return speed
+
+# Value of a channel as recorded, None if it is missing
+def _channelValue(chdef, value):
+    if value is None or "" == value:
+        return None
+    # Aggregated compact bundles hold the statistics
+    if isinstance(value, dict):
+        value = value.get('mean')
+        if value is None:
+            return None
+    if chdef.vtype is int:
+        return int(round(float(value)))
+    return float(value)
+
+# A reading from a recorded row (dictionary)
+def recordedReading(row):
+    values = row.get('values', row)
+    if 'timestamp' in row:
+        timestamp = float(row['timestamp'])
+    else:
+        timestamp = int(row['vscpTimestampns']) / 1e9
+    return Reading(timestamp=timestamp,
+                   **dict((chdef.name, _channelValue(chdef, values.get(chdef.name)))
+                          for chdef in CHANNELS))
+
+# The readings of a recording, one at a time
+def readRecording(path):
+    with open(path, newline='') as f:
+        first = f.readline()
+        f.seek(0)
+        if first.lstrip().startswith('{'):
+            for line in f:
+                if len(line.strip()):
+                    yield recordedReading(json.loads(line))
+        else:
+            for row in csv.DictReader(f):
+                yield recordedReading(row)
+
+# GUID for node number node, the node number added to bytes 10-13 (the
+# low part of the MAC address in a GUID built from it), so node 0 keeps
+# the GUID. The id of the channel in bytes 14-15 is kept.
+def remapGuid(guidstr, node):
+    guid = bytearray(bytes.fromhex(guidstr.replace(':', '')))
+    base = int.from_bytes(guid[10:14], 'big')
+    guid[10:14] = ((base + node) & 0xFFFFFFFF).to_bytes(4, 'big')
+    return ':'.join("{:02X}".format(b) for b in guid)
+
+# The resolved channel GUIDs (see events.resolveGuids) for node number node
+def remapGuids(guids, node):
+    return dict((name, remapGuid(guid, node)) for name, guid in guids.items())
+
+class Playback:
+
+    # client         - Connected paho client (loop started)
+    # nodes          - List of (channels, bundle) for every node, channels
+    #                  compiled as for mqtt-bme680.py, bundle None if not
+    #                  bundling
+    # speed          - Factor of the recorded rate, 0 for max
+    # qos            - QoS of the published messages
+    # max_inflight   - Max number of unconfirmed messages
+    # channel_topics - Publish on the channel topics also when bundling
+    # now            - Use the time of publishing as timestamp instead of
+    #                  the recorded time
+    # flush_timeout  - Max seconds to wait for confirmations
+    # verbose        - Print progress
+    def __init__(self, client, nodes, speed=1.0, qos=1, max_inflight=20,
+                 channel_topics=False, now=False, flush_timeout=5.0, verbose=False):
+        self.client = client
+        self.nodes = nodes
+        self.speed = speed
+        self.qos = qos
+        self.max_inflight = max_inflight
+        self.channel_topics = channel_topics
+        self.now = now
+        self.flush_timeout = flush_timeout
+        self.verbose = verbose
+
+    # Publish one reading for every node, the same way measureAndPublish()
+    # in mqtt-bme680.py does (without deadbands)
+    def _publishReading(self, publisher, reading, sent):
+        for channels, bundle in self.nodes:
+            if bundle is not None:
+                bundle.begin(reading.timestamp)
+            for ch in channels:
+                value = getattr(reading, ch.name)
+                if value is None or not len(ch.topic):
+                    continue
+                if bundle is not None:
+                    bundle.add(ch, value)
+                    if not self.channel_topics:
+                        continue
+                payload = ch.encode(value, reading.timestamp)
+                t = time.perf_counter()
+                info = publisher.publish(ch.topic, payload, self.flush_timeout, reading.timestamp)
+                sent[info.mid] = t
+            if bundle is not None and len(bundle):
+                payload = bundle.payload()
+                t = time.perf_counter()
+                info = publisher.publish(bundle.topic, payload, self.flush_timeout, reading.timestamp)
+                sent[info.mid] = t
+
+    # Replay the readings, returns the result as a dictionary
+    def run(self, readings):
+        publisher = Publisher(self.client, self.qos, self.max_inflight)
+        ack = Stats()
+
+        # Confirmation times by message id, set from the paho network thread
+        acked = {}
+        def onPublish(client, userdata, mid):
+            acked[mid] = time.perf_counter()
+        self.client.on_publish = onPublish
+
+        sent = {}
+        count = 0
+        late = 0
+        first = None
+        start = time.perf_counter()
+        for reading in readings:
+            if first is None:
+                first = reading.timestamp
+            if self.speed > 0:
+                # Keep the recorded rate, scaled by speed
+                delay = start + (reading.timestamp - first) / self.speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                elif delay < -LATE:
+                    late += 1
+            if self.now:
+                reading = reading._replace(timestamp=time.time())
+            self._publishReading(publisher, reading, sent)
+            count += 1
+            # Message ids are reused by paho so collect ack times as we go
+            if len(sent) >= 1000:
+                publisher.flush(self.flush_timeout)
+                self._collectAcks(sent, acked, ack)
+            if self.verbose and 0 == count % 1000:
+                print("Replayed", count, "readings,", publisher.sent, "messages", file=sys.stderr)
+        publisher.flush(self.flush_timeout)
+        self._collectAcks(sent, acked, ack)
+        elapsed = time.perf_counter() - start
+        self.client.on_publish = None
+
+        return {
+            "nodes": len(self.nodes),
+            "speed": self.speed if self.speed > 0 else "max",
+            "qos": self.qos,
+            "readings": count,
+            "messages": publisher.sent,
+            "confirmed": publisher.confirmed,
+            "failed": publisher.failed,
+            "unconfirmed": publisher.inflight(),
+            "late": late,
+            "seconds": round(elapsed, 4),
+            "msg_per_s": round(publisher.sent / elapsed, 1) if elapsed > 0 else 0.0,
+            "readings_per_s": round(count / elapsed, 1) if elapsed > 0 else 0.0,
+            "ack": ack.summary(),
+        }
+
+    def _collectAcks(self, sent, acked, ack):
+        for mid, t in sent.items():
+            if mid in acked:
+                ack.add(acked.pop(mid) - t)
+        sent.clear()
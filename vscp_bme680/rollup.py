@@ -0,0 +1,169 @@
+###############################################################################
+# vscp_bme680/rollup.py
+#
+# This file is part of the VSCP (http://www.vscp.org)
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2000-2021 Ake Hedman, Grodans Paradis AB <info@grodansparadis.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+
+# Rollups of the recent readings of a sensor for the local query service
+# (see query.py). Every channel has a ring of buckets for each resolution
+# (1 minute, 15 minutes and 1 hour) and a reading is added to the current
+# bucket of each ring as it arrives, so adding is O(1) and a query is
+# O(buckets) whatever the number of readings. A bucket keeps the count,
+# mean, sum of squared differences (Welford) and min/max of its readings,
+# buckets are combined with the parallel variance formula.
+
+import array
+import math
+
+# (name, seconds) of the resolutions
+RESOLUTIONS = (('1m', 60), ('15m', 900), ('1h', 3600))
+
+RESOLUTION_NAMES = tuple(name for name, seconds in RESOLUTIONS)
+
+# Statistics a query can give
+STATISTICS = ('mean', 'min', 'max', 'stddev')
+
+# Statistics of a range, (count, mean, m2, min, max)
+EMPTY = (0, 0.0, 0.0, math.inf, -math.inf)
+
+# Combine two (count, mean, m2, min, max)
+def combine(a, b):
+    n = a[0] + b[0]
+    if not a[0]:
+        return b
+    if not b[0]:
+        return a
+    delta = b[1] - a[1]
+    return (n,
+            a[1] + delta * b[0] / n,
+            a[2] + b[2] + delta * delta * a[0] * b[0] / n,
+            min(a[3], b[3]),
+            max(a[4], b[4]))
+
+# Value of a statistic from (count, mean, m2, min, max)
+def statistic(stats, stat):
+    if 'mean' == stat:
+        return stats[1]
+    if 'min' == stat:
+        return stats[3]
+    if 'max' == stat:
+        return stats[4]
+    return math.sqrt(stats[2] / stats[0])
+
+# The buckets of one channel at one resolution
+class BucketRing:
+
+    # seconds - Length of a bucket
+    # size    - Number of buckets kept
+    def __init__(self, seconds, size):
+        self.seconds = seconds
+        self.size = max(1, size)
+        zeros = bytes(8 * self.size)
+        # Start of the period each bucket holds, -1 for unused
+        self.starts = array.array('d', [-1.0]) * self.size
+        self.counts = array.array('d', zeros)
+        self.means = array.array('d', zeros)
+        self.m2s = array.array('d', zeros)
+        self.mins = array.array('d', zeros)
+        self.maxs = array.array('d', zeros)
+
+    def add(self, timestamp, value):
+        start = (timestamp // self.seconds) * self.seconds
+        i = int(timestamp // self.seconds) % self.size
+        if self.starts[i] != start:
+            # A bucket from an earlier round, start over
+            self.starts[i] = start
+            self.counts[i] = 0.0
+            self.means[i] = 0.0
+            self.m2s[i] = 0.0
+            self.mins[i] = value
+            self.maxs[i] = value
+        n = self.counts[i] + 1.0
+        delta = value - self.means[i]
+        self.counts[i] = n
+        self.means[i] += delta / n
+        self.m2s[i] += delta * (value - self.means[i])
+        if value < self.mins[i]:
+            self.mins[i] = value
+        if value > self.maxs[i]:
+            self.maxs[i] = value
+
+    # (bucket start, (count, mean, m2, min, max)) for the buckets with
+    # readings that overlap start <= t < end, oldest first
+    def buckets(self, start, end):
+        first = (start // self.seconds) * self.seconds
+        # Not further back than the ring reaches
+        first = max(first, (end // self.seconds - self.size + 1) * self.seconds)
+        result = []
+        # At most one round of the ring, whatever the range
+        for n in range(self.size):
+            t = first + n * self.seconds
+            if not t < end:
+                break
+            i = int(t // self.seconds) % self.size
+            if self.starts[i] == t:
+                result.append((t, (int(self.counts[i]), self.means[i], self.m2s[i],
+                                   self.mins[i], self.maxs[i])))
+        return result
+
+# Rollups of all channels of a sensor
+#   channels - Names of the channels
+#   span     - Seconds of readings kept at each resolution
+class Rollups:
+
+    def __init__(self, channels, span=86400.0):
+        self.span = span
+        self.rings = {}
+        for name, seconds in RESOLUTIONS:
+            size = int(math.ceil(span / seconds)) + 1
+            self.rings[name] = dict((channel, BucketRing(seconds, size)) for channel in channels)
+        self.last = None
+
+    # Add a reading (see reading.py)
+    def add(self, reading):
+        self.last = reading.timestamp
+        for rings in self.rings.values():
+            for channel, ring in rings.items():
+                value = getattr(reading, channel)
+                # Gas is not measured in every cycle
+                if value is not None:
+                    ring.add(reading.timestamp, value)
+
+    # (bucket start, stats) of a channel for start <= t < end
+    def buckets(self, channel, resolution, start, end):
+        return self.rings[resolution][channel].buckets(start, end)
+
+    # Combined stats of a channel for start <= t < end, with the finest
+    # resolution that reaches back to start
+    def summary(self, channel, start, end):
+        for name, seconds in RESOLUTIONS:
+            ring = self.rings[name][channel]
+            if end - start <= (ring.size - 1) * seconds:
+                break
+        stats = EMPTY
+        for t, bucket in ring.buckets(start, end):
+            stats = combine(stats, bucket)
+        return stats
@@ -0,0 +1,281 @@
+###############################################################################
+# vscp_bme680/sensors.py
+#
+# This file is part of the VSCP (http://www.vscp.org)
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2000-2021 Ake Hedman, Grodans Paradis AB <info@grodansparadis.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Support for more than one BME680 in the same process. Each sensor has
+# its own section in the configuration file
+#
+#   [BME680.<name>]
+#
+# where all per sensor settings (GUID, id's, sensor indexes, zone/subzone,
+# notes, topics, deadbands, encoding, corrections, bus and address) can be
+# set. Settings not given in the section are taken from the [VSCP], [MQTT]
+# and [BME680] sections. If there are no sensor sections there is one
+# sensor set up from the general sections.
+
+import threading
+import time
+
+from vscp_bme680.config import intAuto, parseBackend
+from vscp_bme680.events import CHANNEL_NAMES, compileChannels, parseEncoding
+from vscp_bme680.deadband import parseDeadband
+from vscp_bme680.iaq import IaqEstimator
+from vscp_bme680.reading import makeReading
+from vscp_bme680.backends import parseHeaterTemperature, parseHeaterDuration
+from vscp_bme680.raw import compensateBatch
+from vscp_bme680.timing import parseOversampling, parseFilterSize
+
+# Prefix for sensor sections
+SECTION_PREFIX = "BME680."
+
+# Per sensor settings and how to convert them from the configuration file
+SENSOR_KEYS = [
+    ('guid', str),
+    ('zone', int),
+    ('subzone', int),
+    ('encoding', parseEncoding),
+    ('temp_corr', float),
+    ('height_at_location', float),
+    ('sea_level_pressure', float),
+    ('bus', int),
+    ('address', intAuto),
+    ('backend', parseBackend),
+    ('heater_temperature', parseHeaterTemperature),
+    ('heater_duration', parseHeaterDuration),
+    ('gas_every_n_cycles', int),
+    ('temperature_oversample', parseOversampling),
+    ('humidity_oversample', parseOversampling),
+    ('pressure_oversample', parseOversampling),
+    ('filter_size', parseFilterSize),
+    ('burst_batch', int),
+    ('dump_file', str),
+    ('iaq_burn_in', float),
+    ('iaq_save_interval', float),
+    ('sim_seed', int),
+    ('sim_latency', float),
+    ('sim_noise', float),
+    ('sim_i2c_error_rate', float),
+    ('sim_stuck_rate', float),
+    ('sim_start', float),
+    ('sim_step', float),
+]
+for name in CHANNEL_NAMES:
+    SENSOR_KEYS.append(('id_' + name, int))
+    SENSOR_KEYS.append(('sensorindex_' + name, int))
+    SENSOR_KEYS.append(('note_' + name, str))
+    SENSOR_KEYS.append(('topic_' + name, str))
+    SENSOR_KEYS.append(('deadband_' + name, parseDeadband))
+
+# Names of the sensors sections in a configuration
+def sensorSections(config):
+    return [s for s in config.sections() if s.startswith(SECTION_PREFIX)]
+
+# Get the settings for all sensors as a list of (name, settings) where
+# settings is a dictionary with all SENSOR_KEYS. defaults holds the values
+# from the general sections. config is None if there is no configuration
+# file. A bad value raises ValueError telling which setting it is.
+def readSensorConfigs(config, defaults):
+    sections = sensorSections(config) if config is not None else []
+    if not len(sections):
+        return [('bme680', dict(defaults))]
+    result = []
+    for section in sections:
+        cfg = dict(defaults)
+        for key, conv in SENSOR_KEYS:
+            if key in config[section]:
+                # Raw so a percent deadband ("2%") can be written as is
+                try:
+                    cfg[key] = conv(config.get(section, key, raw=True))
+                except ValueError as e:
+                    raise ValueError("[{}] {}: {}".format(section, key, e))
+        result.append((section[len(SECTION_PREFIX):], cfg))
+    return result
+
+# -----------------------------------------------------------------------------
+
+# One lock per bus. Sensors on the same bus are read one at a time, sensors
+# on different buses can be read in parallel.
+_bus_locks = {}
+_bus_locks_lock = threading.Lock()
+
+def busLock(bus):
+    with _bus_locks_lock:
+        if bus not in _bus_locks:
+            _bus_locks[bus] = threading.Lock()
+        return _bus_locks[bus]
+
+# -----------------------------------------------------------------------------
+
+class Sensor:
+
+    # name    - Name of the sensor (from the section name)
+    # cfg     - Settings from readSensorConfigs()
+    # backend - Sensor backend (see backends.py)
+    # metrics - Metrics for the conversion time and read errors (or None)
+    # state   - ChangeFilter where the IAQ baseline is kept (or None)
+    def __init__(self, name, cfg, backend, metrics=None, state=None):
+        self.name = name
+        self.cfg = cfg
+        self.backend = backend
+        self.metrics = metrics
+        self.lock = busLock(cfg['bus'])
+        self.channels = compileChannels(cfg)
+        self.cycles = 0
+        self._setOversampling(cfg)
+        # Raw samples waiting to be compensated in burst mode
+        self.burst = cfg['burst_batch'] > 0 and hasattr(backend, 'acquire')
+        self.queue = []
+        # IAQ index from the gas resistance, continues from the saved
+        # baseline
+        self.state = state
+        self.iaq = IaqEstimator(cfg['iaq_burn_in'], cfg['iaq_save_interval'])
+        if state is not None:
+            self.iaq.restore(state.value("iaq/" + name))
+        # Local history of the readings (see history.py), set by the
+        # script if it is used
+        self.history = None
+
+    def _setOversampling(self, cfg):
+        self.backend.setOversampling(cfg['temperature_oversample'],
+                                     cfg['humidity_oversample'],
+                                     cfg['pressure_oversample'],
+                                     cfg['filter_size'])
+
+    # New settings (on a configuration reload). The backend is kept, only
+    # its oversampling is changed.
+    def configure(self, cfg):
+        channels = compileChannels(cfg)
+        with self.lock:
+            self._setOversampling(cfg)
+            self.iaq.burn_in = cfg['iaq_burn_in']
+            self.iaq.save_interval = cfg['iaq_save_interval']
+            self.cfg = cfg
+        self.channels = channels
+
+    # Time one conversion with the settings of the sensor. Returns the
+    # seconds it took, the cycle count is not changed.
+    def timeConversion(self, gas=True):
+        with self.lock:
+            start = time.perf_counter()
+            self.backend.read(gas)
+            return time.perf_counter() - start
+
+    # True if gas is measured in this cycle. Gas is measured every
+    # gas_every_n_cycles cycle, starting with the first one, never if 0.
+    def gasCycle(self):
+        every = self.cfg['gas_every_n_cycles']
+        gas = every > 0 and 0 == self.cycles % every
+        self.cycles += 1
+        return gas
+
+    # Read the sensor, one conversion for all values published in a cycle
+    def read(self):
+        cfg = self.cfg
+        gas = self.gasCycle()
+        with self.lock:
+            if self.metrics is None:
+                raw = self.backend.read(gas)
+            else:
+                raw = self._timed(self.backend.read, gas)
+        timestamp = time.time()
+        reading = makeReading(*raw,
+                              temp_corr=cfg['temp_corr'],
+                              height_at_location=cfg['height_at_location'],
+                              sea_level_pressure=cfg['sea_level_pressure'],
+                              timestamp=timestamp,
+                              iaq=self._updateIaq(raw[3], raw[1], timestamp))
+        if self.history is not None:
+            self.history.append(reading)
+        return reading
+
+    # Burst mode. Take one raw sample, without compensation, and queue it.
+    # When burst_batch samples are queued they are compensated in one
+    # batch. Returns the readings of the batch, an empty list until the
+    # batch is full.
+    def readBurst(self):
+        cfg = self.cfg
+        gas = self.gasCycle()
+        with self.lock:
+            if self.metrics is None:
+                sample = self.backend.acquire(gas)
+            else:
+                sample = self._timed(self.backend.acquire, gas)
+        self.queue.append(sample)
+        if len(self.queue) < cfg['burst_batch']:
+            return []
+        samples = self.queue
+        self.queue = []
+        start = time.perf_counter()
+        values = compensateBatch(self.backend.calibration,
+                                 [block for timestamp, gas, block in samples],
+                                 [gas for timestamp, gas, block in samples])
+        if self.metrics is not None:
+            self.metrics.observe('compensate_seconds', time.perf_counter() - start)
+        readings = [makeReading(*v,
+                                temp_corr=cfg['temp_corr'],
+                                height_at_location=cfg['height_at_location'],
+                                sea_level_pressure=cfg['sea_level_pressure'],
+                                timestamp=sample[0],
+                                iaq=self._updateIaq(v[3], v[1], sample[0]))
+                    for v, sample in zip(values, samples)]
+        if self.history is not None:
+            for reading in readings:
+                self.history.append(reading)
+        return readings
+
+    # Add a gas measurement to the IAQ index, returns the index (None
+    # without gas and during burn-in). The baseline is put in the state
+    # every iaq_save_interval seconds, the state file is written when the
+    # ChangeFilter saves.
+    def _updateIaq(self, gas, humidity, timestamp):
+        if gas is None:
+            return None
+        iaq = self.iaq.update(gas, humidity, timestamp)
+        if self.state is not None:
+            state = self.iaq.checkpoint(timestamp)
+            if state is not None:
+                self.state.setValue("iaq/" + self.name, state, timestamp)
+        return iaq
+
+    # Put the IAQ baseline in the state, at exit
+    def saveState(self):
+        if self.state is not None and self.iaq.baseline is not None:
+            self.state.setValue("iaq/" + self.name, self.iaq.state(), self.iaq.timestamp)
+
+    # Call read (backend.read or backend.acquire) and time the conversion
+    def _timed(self, read, gas):
+        start = time.perf_counter()
+        try:
+            raw = read(gas)
+        except (OSError, RuntimeError, ValueError):
+            self.metrics.inc('read_errors_total')
+            raise
+        if gas:
+            self.metrics.observe('conversion_seconds', time.perf_counter() - start)
+        else:
+            self.metrics.observe('conversion_nogas_seconds', time.perf_counter() - start)
+        return raw
@@ -0,0 +1,152 @@
+###############################################################################
+# vscp_bme680/timing.py
+#
+# This file is part of the VSCP (http://www.vscp.org)
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2000-2021 Ake Hedman, Grodans Paradis AB <info@grodansparadis.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Oversampling, IIR filter and conversion time of the BME680.
+#
+# More oversampling gives less noise but a longer conversion. The IIR
+# filter smooths temperature and pressure over several conversions
+# without making a conversion longer, at the cost of a slower response
+# to real changes. conversionTime() gives the time a forced mode
+# conversion takes according to the Bosch BME68x API, calibrate() sweeps
+# the settings on a sensor and measures conversion time and noise.
+
+import math
+import time
+
+# Valid oversampling settings (0, skipping the measurement, is not
+# supported as all values are published)
+OVERSAMPLING = (1, 2, 4, 8, 16)
+
+# Valid IIR filter sizes (0 is no filter)
+FILTER_SIZES = (0, 1, 3, 7, 15, 31, 63, 127)
+
+# Defaults of the Adafruit driver
+TEMPERATURE_OVERSAMPLE = 8
+HUMIDITY_OVERSAMPLE = 2
+PRESSURE_OVERSAMPLE = 4
+FILTER_SIZE = 3
+
+def parseOversampling(text):
+    oversample = int(text)
+    if oversample not in OVERSAMPLING:
+        raise ValueError("Oversampling must be one of 1, 2, 4, 8, 16")
+    return oversample
+
+def parseFilterSize(text):
+    size = int(text)
+    if size not in FILTER_SIZES:
+        raise ValueError("Filter size must be one of 0, 1, 3, 7, 15, 31, 63, 127")
+    return size
+
+# Seconds a forced mode conversion takes (bme68x_get_meas_dur() in the
+# Bosch API). 1.963 ms per oversampling cycle, switching between the
+# measurements, the gas measurement, 1 ms wake up and, for a gas
+# measurement, the heater duration (milliseconds).
+def conversionTime(temperature_oversample, humidity_oversample, pressure_oversample,
+                   gas=True, heater_duration=150):
+    cycles = temperature_oversample + humidity_oversample + pressure_oversample
+    us = cycles * 1963 + 477 * 4 + 477 * 5 + 1000
+    if gas:
+        us += heater_duration * 1000
+    return us / 1e6
+
+# Theoretical conversion time for the settings of a sensor (see
+# sensors.SENSOR_KEYS)
+def sensorConversionTime(cfg, gas=True):
+    return conversionTime(cfg['temperature_oversample'],
+                          cfg['humidity_oversample'],
+                          cfg['pressure_oversample'],
+                          gas,
+                          cfg['heater_duration'])
+
+# Noise of a series of samples. The standard deviation of the difference
+# between consecutive samples divided by sqrt(2), so a slow change of the
+# value itself is not counted as noise.
+def noise(values):
+    if len(values) < 3:
+        return 0.0
+    diffs = [b - a for a, b in zip(values, values[1:])]
+    mean = sum(diffs) / len(diffs)
+    var = sum((d - mean) ** 2 for d in diffs) / (len(diffs) - 1)
+    return math.sqrt(var / 2.0)
+
+# Time samples conversions of a backend and take the noise of the values.
+# Returns (seconds per conversion, temperature noise, humidity noise,
+# pressure noise) with pressure in Pa. The first conversions after a
+# settings change are skipped so the IIR filter has settled.
+def measure(backend, samples=16, gas=False, settle=4):
+    for i in range(settle):
+        backend.read(gas)
+        time.sleep(backend.min_interval)
+    times = []
+    values = []
+    for i in range(samples):
+        start = time.perf_counter()
+        values.append(backend.read(gas))
+        elapsed = time.perf_counter() - start
+        times.append(elapsed)
+        if elapsed < backend.min_interval:
+            time.sleep(backend.min_interval - elapsed)
+    times.sort()
+    return (times[len(times) // 2],
+            noise([v[0] for v in values]),
+            noise([v[1] for v in values]),
+            noise([v[2] * 100 for v in values]))
+
+# Sweep oversampling (the same for all three measurements) and filter
+# sizes on a backend. Conversions are done without gas as the heater
+# only adds its duration. Returns a list of (oversample, filter_size,
+# theoretical seconds, measured seconds, temperature noise, humidity
+# noise, pressure noise). The backend is left with the settings in cfg.
+def calibrate(backend, cfg, oversampling=OVERSAMPLING, filter_sizes=(0, 1, 3, 7, 15),
+              samples=16):
+    result = []
+    try:
+        for oversample in oversampling:
+            for size in filter_sizes:
+                backend.setOversampling(oversample, oversample, oversample, size)
+                measured = measure(backend, samples)
+                theoretical = conversionTime(oversample, oversample, oversample, gas=False)
+                result.append((oversample, size, theoretical) + measured)
+    finally:
+        backend.setOversampling(cfg['temperature_oversample'],
+                                cfg['humidity_oversample'],
+                                cfg['pressure_oversample'],
+                                cfg['filter_size'])
+    return result
+
+# Print the result of calibrate() as a table
+def printCalibration(name, cfg, result):
+    print("Sensor", name, "backend =", cfg['backend'])
+    print("Conversions without gas, a gas measurement adds the heater duration ({} ms)".format(
+          cfg['heater_duration']))
+    print("{:>4} {:>6} {:>10} {:>11} {:>9} {:>9} {:>9}".format(
+          "os", "filter", "theory ms", "measured ms", "T noise C", "H noise %", "P noise Pa"))
+    for oversample, size, theoretical, measured, tnoise, hnoise, pnoise in result:
+        print("{:>4} {:>6} {:>10.1f} {:>11.1f} {:>9.4f} {:>9.4f} {:>9.3f}".format(
+              oversample, size, theoretical * 1000, measured * 1000, tnoise, hnoise, pnoise))
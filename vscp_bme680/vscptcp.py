@@ -0,0 +1,259 @@
+###############################################################################
+# vscp_bme680/vscptcp.py
+#
+# This file is part of the VSCP (http://www.vscp.org)
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2000-2021 Ake Hedman, Grodans Paradis AB <info@grodansparadis.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+
+# Client for the tcp/ip interface of the VSCP daemon. The connection is
+# kept open between measurement cycles, kept alive with NOOP and opened
+# again when it fails. The events of a cycle are written as one batch of
+# send commands and the replies are read afterwards, so a cycle waits
+# for one round trip to the daemon whatever the number of events.
+
+import datetime
+import socket
+import time
+
+# Default port of the tcp/ip interface of the VSCP daemon
+VSCP_DEFAULT_TCP_PORT = 9598
+
+# A command that the daemon answered with -OK
+class VscpError(Exception):
+    pass
+
+# Split "host:port" into host and port, the port is optional
+def parseHost(host):
+    host = host.strip()
+    if host.startswith("tcp://"):
+        host = host[6:]
+    name, sep, port = host.rpartition(':')
+    if not sep or not port.isdigit():
+        return host, VSCP_DEFAULT_TCP_PORT
+    return name, int(port)
+
+# The send command for an event given as a JSON object (see
+# events.ChannelTemplate.fill) on the form
+#   send head,class,type,obid,datetime,timestamp,GUID,data1,data2,...
+# The date is left empty (set by the daemon) if the event has no
+# vscpTimestampns.
+def formatEvent(event):
+    ns = event.get("vscpTimestampns", 0)
+    datestr = ""
+    if ns:
+        dt = datetime.datetime.fromtimestamp(ns // 1000000000, datetime.timezone.utc)
+        datestr = dt.strftime("%Y-%m-%dT%H:%M:%SZ")
+    fields = [event["vscpHead"],
+              event["vscpClass"],
+              event["vscpType"],
+              event.get("vscpObId", 0),
+              datestr,
+              # Sub second part of the time in microseconds
+              (ns // 1000) % 1000000,
+              event["vscpGuid"]]
+    fields += event["vscpData"]
+    return "send " + ",".join(str(field) for field in fields) + "\r\n"
+
+class VscpLink:
+
+    # host      - VSCP daemon on the form "host:port", port defaults to 9598
+    # user      - Username to login with
+    # password  - Password to login with
+    # timeout   - Seconds to wait for the daemon to answer
+    # keepalive - Send a NOOP when the connection has been idle this many
+    #             seconds, 0 never sends one
+    # retries   - Number of times the unconfirmed events of a batch are
+    #             sent again on a new connection
+    def __init__(self, host, user, password, timeout=5.0, keepalive=30.0,
+                 retries=1, verbose=False):
+        self.host, self.port = parseHost(host)
+        self.user = user
+        self.password = password
+        self.timeout = timeout
+        self.keepalive = keepalive
+        self.retries = retries
+        self.verbose = verbose
+        self.sock = None
+        self.buf = b""
+        # Time of the last reply from the daemon
+        self.last = 0.0
+        # Counters
+        self.opens = 0
+        self.batches = 0
+        self.events = 0
+        self.resent = 0
+        self.noops = 0
+
+    def isOpen(self):
+        return self.sock is not None
+
+    # Connect and login
+    def open(self):
+        self._drop()
+        if self.verbose:
+            print("Connecting to VSCP daemon {}:{}".format(self.host, self.port))
+        self.sock = socket.create_connection((self.host, self.port), self.timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            # Welcome message
+            ok, reply = self._reply()
+            if not ok:
+                raise VscpError("Connect: " + reply)
+            self._command("user " + self.user, "user")
+            self._command("pass " + self.password, "pass")
+        except BaseException:
+            self._drop()
+            raise
+        self.opens += 1
+
+    # Drop the connection without saying goodbye
+    def _drop(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+        self.sock = None
+        self.buf = b""
+
+    # Logout and close the connection
+    def close(self):
+        if self.sock is None:
+            return
+        try:
+            self._command("quit")
+        except (OSError, VscpError):
+            pass
+        self._drop()
+
+    # Read one line from the daemon
+    def _readLine(self):
+        while True:
+            pos = self.buf.find(b"\n")
+            if pos >= 0:
+                line = self.buf[:pos]
+                self.buf = self.buf[pos + 1:]
+                return line.decode(errors="replace").strip()
+            data = self.sock.recv(4096)
+            if not data:
+                raise ConnectionError("Connection closed by the VSCP daemon")
+            self.buf += data
+
+    # Read up to the +OK or -OK that ends a reply, other lines are
+    # information from the daemon. Returns (ok, reply line).
+    def _reply(self):
+        while True:
+            line = self._readLine()
+            if line.startswith("+OK"):
+                self.last = time.monotonic()
+                return True, line
+            if line.startswith("-OK"):
+                self.last = time.monotonic()
+                return False, line
+
+    # Send a command and wait for the reply. name is used in place of the
+    # command in errors (so that passwords are not shown).
+    def _command(self, command, name=None):
+        self.sock.sendall((command + "\r\n").encode())
+        ok, reply = self._reply()
+        if not ok:
+            raise VscpError("{}: {}".format(name or command, reply))
+        return reply
+
+    def noop(self):
+        if self.sock is None:
+            self.open()
+        self._command("noop")
+        self.noops += 1
+
+    # Send a NOOP if the connection has been idle for keepalive seconds.
+    # A connection that fails is opened again, if that fails too the next
+    # send() tries again.
+    def keepAlive(self):
+        if self.sock is None or not self.keepalive:
+            return
+        if time.monotonic() - self.last < self.keepalive:
+            return
+        try:
+            self.noop()
+        except (OSError, VscpError) as e:
+            if self.verbose:
+                print("VSCP keepalive failed:", e)
+            self._drop()
+            try:
+                self.open()
+            except (OSError, VscpError) as e:
+                if self.verbose:
+                    print("Reconnect failed:", e)
+
+    # Sleep for the given number of seconds and keep the connection alive
+    def wait(self, seconds):
+        deadline = time.monotonic() + seconds
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                return
+            delay = deadline - now
+            if self.sock is not None and self.keepalive:
+                delay = min(delay, max(0.0, self.last + self.keepalive - now))
+            time.sleep(delay)
+            self.keepAlive()
+
+    # Send events (JSON objects, see formatEvent) with one write and then
+    # read the replies, which come in the order of the commands. If the
+    # connection fails it is opened again and the events that were not
+    # confirmed are sent again, so an event can reach the daemon twice but
+    # is not lost. Raises VscpError when the daemon rejected events and
+    # OSError when it can't be reached.
+    def send(self, events):
+        lines = [formatEvent(event) for event in events]
+        done = 0
+        rejected = []
+        attempt = 0
+        while done < len(lines):
+            try:
+                if self.sock is None:
+                    self.open()
+                if attempt:
+                    self.resent += len(lines) - done
+                self.sock.sendall("".join(lines[done:]).encode())
+                while done < len(lines):
+                    ok, reply = self._reply()
+                    if not ok:
+                        rejected.append(reply)
+                    done += 1
+            except OSError as e:
+                self._drop()
+                if attempt >= self.retries:
+                    raise
+                attempt += 1
+                if self.verbose:
+                    print("VSCP link failed ({}), sending {} events again".format(
+                          e, len(lines) - done))
+        self.batches += 1
+        self.events += len(lines)
+        if rejected:
+            raise VscpError("{} of {} events rejected: {}".format(
+                            len(rejected), len(lines), rejected[0]))